@@ -5,8 +5,24 @@ import re
 from io import BytesIO
 import xml.etree.ElementTree as ET
 import math
-from geopy.distance import geodesic
+import time
 import openpyxl
+import pydeck as pdk
+from boq_history import get_history
+from boq_limiter import AdmissionTimeout, estimate_template_memory_mb, get_limiter
+from boq_incremental import IncrementalBoq
+from boq_metrics import METRICS, SIZE_BUCKETS, record_cache, start_exporters
+from cable_topology import DEFAULT_SNAP_TOLERANCE, build_topology, count_shared_once
+from kml_diff import diff_features
+from kml_geometry import ERROR_SAMPLE_SIZE
+from kml_network import (CABLE_CLASSES, KMLParseError, merge_features, parse_kml_bytes, parse_many,
+                         save_snapshot, summarize_features)
+from map_preview import build_preview
+from network_analysis import DEFAULT_MAX_DROP, DEFAULT_MAX_SPAN, analyze_spans, assign_homepass
+from odp_optimizer import DEFAULT_SPARE_PORTS, optimize_odp_mix
+from program_workbook import write_program_workbook
+from template_formulas import compile_template, write_cached_values
+from upload_buffer import upload_buffer
 
 # Initialize session state at the beginning
 def initialize_session_state():
@@ -73,228 +89,110 @@ def reset_boq_application():
         'active_tab': "manual",
         'is_adss': False
     }
+    discard_manual_boq()
 
-def parse_kml_file(kml_file):
+def parse_kml_file(kml_file, length_mode="exact"):
     try:
-        kml_data = kml_file.read()
-        if not kml_data:
-            st.error("KML file is empty")
-            return None
-            
-        try:
-            root = ET.fromstring(kml_data)
-        except ET.ParseError as e:
-            st.error(f"Invalid KML format: {str(e)}")
-            return None
-            
-        ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-        
-        values = {
-            'tiang_new': 0,
-            'tiang_existing': 0,
-            'kabel_12': 0.0,
-            'kabel_24': 0.0,
-            'odp_8': 0,
-            'odp_16': 0,
-            'closure': 0,
-            'otb_12': 0
-        }
-        
-        for placemark in root.findall('.//kml:Placemark', ns):
-            name_elem = placemark.find('kml:name', ns)
-            desc_elem = placemark.find('kml:description', ns)
-            
-            name = name_elem.text.upper().strip() if name_elem is not None and name_elem.text else ""
-            desc = desc_elem.text.strip() if desc_elem is not None and desc_elem.text else ""
-            
-            if placemark.find('.//kml:Point', ns) is not None:
-                if any(keyword in name for keyword in ["TN", "TN7", "TIANG NEW"]):
-                    values['tiang_new'] += 1
-                elif any(keyword in name for keyword in ["TE", "TIANG EXISTING"]):
-                    values['tiang_existing'] += 1
-                elif "ODP" in name and any(keyword in name for keyword in ["NEW", "BARU"]):
-                    if "8" in name or "ODP Solid-PB-8 AS" in desc:
-                        values['odp_8'] += 1
-                    elif "16" in name or "ODP Solid-PB-16 AS" in desc:
-                        values['odp_16'] += 1
-                elif "OTB" in name and any(keyword in name for keyword in ["NEW", "BARU"]):
-                    values['otb_12'] += 1
-                elif any(keyword in name for keyword in ["CL", "CLOSURE"]):
-                    values['closure'] += 1
-            
-            elif placemark.find('.//kml:LineString', ns) is not None:
-                if any(keyword in name for keyword in ["DIS NEW", "DISTRIBUSI", "AC-OF-SM-12"]):
-                    coords_elem = placemark.find('.//kml:coordinates', ns)
-                    if coords_elem is not None and coords_elem.text:
-                        try:
-                            coords = [
-                                tuple(map(float, c.split(',')[:2]))
-                                for c in coords_elem.text.split() 
-                                if len(c.split(',')) >= 2
-                            ]
-                            if len(coords) > 1:
-                                total_length = 0.0
-                                for i in range(len(coords)-1):
-                                    lon1, lat1 = coords[i]
-                                    lon2, lat2 = coords[i+1]
-                                    total_length += geodesic((lat1, lon1), (lat2, lon2)).meters
-                                values['kabel_12'] += total_length
-                        except ValueError:
-                            continue
-        
+        kml_data = upload_buffer(kml_file).data
+        METRICS.observe('boq_upload_bytes', len(kml_data), buckets=SIZE_BUCKETS, kind='kml')
+        started = time.perf_counter()
+        features, warnings = parse_kml_bytes(kml_data)
+    except KMLParseError as e:
+        st.error(str(e))
+        return None
+    except Exception as e:
+        st.error(f"KML parsing failed: {str(e)}")
+        return None
+
+    for warning in warnings:
+        st.warning(warning)
+    try:
+        values = summarize_features(features, length_mode=length_mode)
+        METRICS.observe('boq_kml_parse_seconds', time.perf_counter() - started, tab='kml')
         return values
-    
     except Exception as e:
         st.error(f"KML parsing failed: {str(e)}")
         return None
 
-def parse_kml_file_adss(kml_file, sumber):
+def parse_kml_file_adss(kml_file, sumber, length_mode="exact"):
     try:
-        kml_data = kml_file.read()
-        if not kml_data:
-            st.error("KML file is empty")
-            return None
-            
-        try:
-            root = ET.fromstring(kml_data)
-        except ET.ParseError as e:
-            st.error(f"Invalid KML format: {str(e)}")
-            return None
-            
-        ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-        
-        values = {
-            'tiang_new': 0,
-            'tiang_existing': 0,
-            'total_tiang': 0,
-            'kabel_12': 0.0,
-            'kabel_24': 0.0,
-            'kabel_adss_12': 0.0,
-            'kabel_adss_24': 0.0,
-            'odp_8': 0,
-            'odp_16': 0,
-            'closure': 0,
-            'otb_12': 0,
-            'pu_as_hl_count': 0,  # Jumlah marker dengan deskripsi PU-AS-HL
-            'pu_as_sc_count': 0,  # Jumlah marker dengan deskripsi PU-AS atau PU-AS-SC
-            'pu_as_hl': 0,       # Volume akhir PU-AS-HL
-            'pu_as_sc': 0        # Volume akhir PU-AS-SC
-        }
-        
-        for placemark in root.findall('.//kml:Placemark', ns):
-            name_elem = placemark.find('kml:name', ns)
-            desc_elem = placemark.find('kml:description', ns)
-            
-            name = name_elem.text.upper().strip() if name_elem is not None and name_elem.text else ""
-            desc = desc_elem.text.upper().strip() if desc_elem is not None and desc_elem.text else ""
-            
-            if placemark.find('.//kml:Point', ns) is not None:
-              # Check for poles (TE/TN)
-                if any(keyword in name for keyword in ["TN", "TN7", "TIANG NEW", "TE", "TIANG EXISTING"]):
-                    values['total_tiang'] += 1
-                    
-                    if "TIANG NEW" in name or "TN" in name:
-                        values['tiang_new'] += 1
-                    else:
-                        values['tiang_existing'] += 1
-                    
-                    # Check PU-AS-HL in description
-                    if "PU-AS-HL" in desc:
-                        values['pu_as_hl_count'] += 1
-                    # Check PU-AS or PU-AS-SC in description
-                    elif "PU-AS" in desc or "PU-AS-SC" in desc:
-                        values['pu_as_sc_count'] += 1
-                
-                # Other elements (ODP, OTB, etc)  
-                elif "ODP" in name and any(keyword in name for keyword in ["NEW", "BARU"]):
-                    if "8" in name or "ODP Solid-PB-8 AS" in desc:
-                        values['odp_8'] += 1
-                    elif "16" in name or "ODP Solid-PB-16 AS" in desc:
-                        values['odp_16'] += 1
-                elif "OTB" in name and any(keyword in name for keyword in ["NEW", "BARU"]):
-                    values['otb_12'] += 1
-                elif any(keyword in name for keyword in ["CL", "CLOSURE"]):
-                    values['closure'] += 1
-                
-            
-            elif placemark.find('.//kml:LineString', ns) is not None:
-                if any(keyword in name for keyword in ["DIS NEW", "DISTRIBUSI", "AC-OF-SM-12"]):
-                    coords_elem = placemark.find('.//kml:coordinates', ns)
-                    if coords_elem is not None and coords_elem.text:
-                        try:
-                            coords = [
-                                tuple(map(float, c.split(',')[:2]))
-                                for c in coords_elem.text.split() 
-                                if len(c.split(',')) >= 2
-                            ]
-                            if len(coords) > 1:
-                                total_length = 0.0
-                                for i in range(len(coords)-1):
-                                    lon1, lat1 = coords[i]
-                                    lon2, lat2 = coords[i+1]
-                                    total_length += geodesic((lat1, lon1), (lat2, lon2)).meters
-                                values['kabel_12'] += total_length
-                        except ValueError:
-                            continue
-                elif "AC-OF-SM-ADSS-12D" in name:
-                    coords_elem = placemark.find('.//kml:coordinates', ns)
-                    if coords_elem is not None and coords_elem.text:
-                        try:
-                            coords = [
-                                tuple(map(float, c.split(',')[:2]))
-                                for c in coords_elem.text.split() 
-                                if len(c.split(',')) >= 2
-                            ]
-                            if len(coords) > 1:
-                                total_length = 0.0
-                                for i in range(len(coords)-1):
-                                    lon1, lat1 = coords[i]
-                                    lon2, lat2 = coords[i+1]
-                                    total_length += geodesic((lat1, lon1), (lat2, lon2)).meters
-                                values['kabel_adss_12'] += total_length
-                        except ValueError:
-                            continue
-                elif "AC-OF-SM-ADSS-24D" in name:
-                    coords_elem = placemark.find('.//kml:coordinates', ns)
-                    if coords_elem is not None and coords_elem.text:
-                        try:
-                            coords = [
-                                tuple(map(float, c.split(',')[:2]))
-                                for c in coords_elem.text.split() 
-                                if len(c.split(',')) >= 2
-                            ]
-                            if len(coords) > 1:
-                                total_length = 0.0
-                                for i in range(len(coords)-1):
-                                    lon1, lat1 = coords[i]
-                                    lon2, lat2 = coords[i+1]
-                                    total_length += geodesic((lat1, lon1), (lat2, lon2)).meters
-                                values['kabel_adss_24'] += total_length
-                        except ValueError:
-                            continue
-        
-        # Calculate PU-AS-HL based on source
-        if sumber == "ODC":
-            values['pu_as_hl'] = (values['pu_as_hl_count'] * 2) - 1
-        else:  # ODP
-            values['pu_as_hl'] = (values['pu_as_hl_count'] * 2) - 2 if values['pu_as_hl_count'] > 0 else 0
-        
-        # Calculate PU-AS-SC volume (total poles minus PU-AS-HL count)
-        values['pu_as_sc'] = values['total_tiang'] - values['pu_as_hl_count']
-        
-        # Ensure non-negative values
-        values['pu_as_hl'] = max(values['pu_as_hl'], 0)
-        values['pu_as_sc'] = max(values['pu_as_sc'], 0)
+        kml_data = upload_buffer(kml_file).data
+        METRICS.observe('boq_upload_bytes', len(kml_data), buckets=SIZE_BUCKETS, kind='kml')
+        started = time.perf_counter()
+        features, warnings = parse_kml_bytes(kml_data, adss=True)
+    except KMLParseError as e:
+        st.error(str(e))
+        return None
+    except Exception as e:
+        st.error(f"KML parsing failed: {str(e)}")
+        return None
+
+    for warning in warnings:
+        st.warning(warning)
+    try:
+        values = summarize_features(features, adss=True, sumber=sumber, length_mode=length_mode)
+        METRICS.observe('boq_kml_parse_seconds', time.perf_counter() - started, tab='adss')
         return values
-    
     except Exception as e:
         st.error(f"KML parsing failed: {str(e)}")
         return None
+
+def parse_kml_files(kml_files, adss=False, sumber="ODC", length_mode="exact", dedupe=False,
+                    shared_once=False):
+    """Parse several KML uploads concurrently and combine them.
+
+    Network snapshots (``.boqnet``) are accepted alongside KML files.
+    Returns the combined values (with ``files`` holding a per-file
+    breakdown, ``duplicates_dropped`` the number of placemarks skipped by
+    cross-file duplicate suppression, ``features`` the merged classified
+    features and ``topology`` the cable route topology), or None if no
+    file could be parsed. With ``shared_once`` a cable stretch drawn more
+    than once counts once in the cable lengths.
+    """
+    started = time.perf_counter()
+    buffers = [upload_buffer(f) for f in kml_files]
+    for buffer in buffers:
+        METRICS.observe('boq_upload_bytes', len(buffer), buckets=SIZE_BUCKETS, kind='kml')
+    named_files = [(buffer.name, buffer) for buffer in buffers]
+    try:
+        results = parse_many(named_files, adss=adss)
+    except Exception as e:
+        st.error(f"KML parsing failed: {str(e)}")
+        return None
+
+    feature_sets = []
+    breakdown = []
+    for name, features, warnings, error in results:
+        if error:
+            st.error(f"{name}: {error}")
+            continue
+        for warning in warnings:
+            st.warning(f"{name}: {warning}")
+        feature_sets.append(features)
+        file_values = summarize_features(features, adss=adss, sumber=sumber, length_mode=length_mode)
+        breakdown.append({'file': name, **file_values})
+    if not feature_sets:
+        return None
+
+    features, dropped = merge_features(feature_sets, dedupe=dedupe)
+    values = summarize_features(features, adss=adss, sumber=sumber, length_mode=length_mode)
+    values['files'] = breakdown
+    values['duplicates_dropped'] = dropped
+    values['features'] = features
+    # Lines are measured per file; the merged summary reuses those lengths.
+    for key in ('length_memo_segments', 'length_memo_hits'):
+        values[key] += sum(file_values[key] for file_values in breakdown)
+    values['topology'] = build_topology(features, classes=CABLE_CLASSES if adss else ('kabel_12',))
+    if shared_once:
+        count_shared_once(values, values['topology'])
+    METRICS.observe('boq_kml_parse_seconds', time.perf_counter() - started, tab='adss' if adss else 'kml')
+    return values
+
 def generate_adss_kml(inputs, original_kml):
     try:
         # Parse the original KML
-        kml_data = original_kml.read()
-        root = ET.fromstring(kml_data)
+        # Read through the shared buffer; the upload stream was already consumed by the parser.
+        root = ET.fromstring(upload_buffer(original_kml).data)
         ns = {'kml': 'http://www.opengis.net/kml/2.2'}
         
         # Add PU-AS-SC description to poles without PU-AS-HL
@@ -417,6 +315,29 @@ def calculate_volumes_adss(inputs):
         }
     ]
 
+# Designators each manual input feeds in calculate_volumes. Fields missing
+# here (sumber, which also switches the Base Tray rule) refill everything.
+BASE_TRAY = ("J-Base Tray ODC", "M-Base Tray ODC")
+ODP_DESIGNATORS = ("J-PC-UPC-652-2", "M-PC-UPC-652-2", "J-PC-APC/UPC-652-A1", "M-PC-APC/UPC-652-A1",
+                   "J-PS-1-4-ODC", "M-PS-1-4-ODC")
+MANUAL_DEPENDENCIES = {
+    'lop_name': (),
+    'kabel_12': ("AC-OF-SM-12-SC_O_STOCK",) + BASE_TRAY,
+    'kabel_24': ("AC-OF-SM-24-SC_O_STOCK",) + BASE_TRAY,
+    'odp_8': ODP_DESIGNATORS,
+    'odp_16': ODP_DESIGNATORS,
+    'otb_12': ("J-TC-SM-12", "M-TC-SM-12", "J-PS-1-8-ODX", "M-PS-1-8-ODX"),
+    'closure': ("J-SC-OF-SM-24", "M-SC-OF-SM-24"),
+    'izin': ("J-Preliminary Project",),
+    'tiang_new': (),
+    'tiang_existing': (),
+    'tikungan': (),
+    'kabel_adss_12': (),
+    'kabel_adss_24': (),
+    'pu_as_hl': (),
+    'pu_as_sc': (),
+}
+
 def calculate_volumes(inputs):
     """Calculate BOQ volumes for non-ADSS (distribution) mode.
     This mirrors the ADSS calculation structure but uses kabel_12/kabel_24 fields.
@@ -571,25 +492,46 @@ def calculate_volumes_adss(inputs):
         }
     ]
 
-def process_boq_template(uploaded_file, inputs, lop_name, adss_mode=False):
+def process_boq_template(uploaded_file, inputs, lop_name, adss_mode=False, on_wait=None):
+    """Fill the BOQ template, waiting for a slot in the process-wide limiter.
+
+    ``on_wait(position)`` is called with the queue position while waiting.
+    """
+    try:
+        limiter = get_limiter()
+        template = upload_buffer(uploaded_file)
+        METRICS.observe('boq_upload_bytes', len(template), buckets=SIZE_BUCKETS, kind='template')
+        with limiter.admit(estimate_template_memory_mb(template), on_wait=on_wait):
+            return fill_boq_template(uploaded_file, inputs, lop_name, adss_mode)
+    except AdmissionTimeout:
+        st.error("Server sedang sibuk, silakan coba generate lagi beberapa saat lagi.")
+        return None
+
+def fill_boq_template(uploaded_file, inputs, lop_name, adss_mode=False):
+    labels = {'tab': 'adss' if adss_mode else 'kml', 'sumber': inputs.get('sumber') or ""}
     try:
-        wb = openpyxl.load_workbook(uploaded_file)
+        started = time.perf_counter()
+        template = upload_buffer(uploaded_file)
+        wb = openpyxl.load_workbook(template.reader())
         ws = wb.active
+        formulas = compile_template(template.digest(), ws)
 
-        if adss_mode:
-            items = calculate_volumes_adss(inputs)
-        else:
-            items = calculate_volumes(inputs)
+        with METRICS.timer('boq_volume_calc_seconds', **labels):
+            if adss_mode:
+                items = calculate_volumes_adss(inputs)
+            else:
+                items = calculate_volumes(inputs)
 
         # Fill volumes into the template (rows 9..1082)
+        changed = {}
         for row in range(9, 1083):
             cell_value = str(ws[f'B{row}'].value or "").strip()
 
             for item in items:
                 if cell_value == item["designator"] and item["volume"] > 0:
-                    ws[f'G{row}'] = item["volume"]
+                    ws[f'G{row}'] = changed[f'G{row}'] = item["volume"]
                     if "Preliminary" in cell_value and "izin_value" in item:
-                        ws[f'F{row}'] = item["izin_value"]
+                        ws[f'F{row}'] = changed[f'F{row}'] = item["izin_value"]
 
         # Calculate totals
         material = 0.0
@@ -617,10 +559,13 @@ def process_boq_template(uploaded_file, inputs, lop_name, adss_mode=False):
         total_odp = inputs.get('odp_8', 0) + inputs.get('odp_16', 0)
         total_ports = (total_odp * 8) + (1 if inputs.get('otb_12', 0) > 0 else 0) * 8
         cpp = round(total / total_ports, 2) if total_ports > 0 else 0
+        METRICS.observe('boq_template_fill_seconds', time.perf_counter() - started, **labels)
 
         output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        with METRICS.timer('boq_template_save_seconds', **labels):
+            wb.save(output)
+            # Cache formula results so readers that don't recalculate see values.
+            output = write_cached_values(output.getvalue(), wb.worksheets.index(ws), formulas.evaluate(changed))
 
         return {
             'excel_data': output,
@@ -639,21 +584,480 @@ def process_boq_template(uploaded_file, inputs, lop_name, adss_mode=False):
         st.error(f"Error generating BOQ: {str(e)}")
         return None
 
-def generate_adss_kml(inputs):
-    # This function would generate a modified KML file with PU-AS-SC descriptions added
-    # Implementation depends on your specific KML structure
-    # Here's a basic example:
-    
-    kml_template = f"""<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-  <Document>
-    <name>ADSS Network - {inputs['lop_name']}</name>
-    <description>Modified KML with PU-AS-SC markers</description>
-    <!-- KML content would be generated here -->
-  </Document>
-</kml>"""
-    
-    return BytesIO(kml_template.encode())
+def process_manual_boq(uploaded_file, inputs, on_wait=None):
+    """Manual-tab generate that patches the session's filled template.
+
+    The first generate for a template loads and fills it; later ones only
+    refill the designators fed by the inputs that changed. Every generate
+    waits for a limiter slot, and between generates the filled workbook is
+    counted against the limiter's memory budget, which may release it.
+    """
+    boq = st.session_state.get('manual_boq')
+    try:
+        limiter = get_limiter()
+        template = upload_buffer(uploaded_file)
+        METRICS.observe('boq_upload_bytes', len(template), buckets=SIZE_BUCKETS, kind='template')
+        cost_mb = estimate_template_memory_mb(template)
+        labels = {'tab': 'manual', 'sumber': inputs.get('sumber') or ""}
+        with limiter.admit(cost_mb, on_wait=on_wait):
+            if boq is not None:
+                # Counted by this job's slot while in use.
+                limiter.forget(boq)
+            hit = boq is not None and boq.loaded and boq.digest == template.digest()
+            record_cache('manual_workbook', hit)
+            if not hit:
+                with METRICS.timer('boq_template_fill_seconds', **labels):
+                    boq = IncrementalBoq(template, calculate_volumes, MANUAL_DEPENDENCIES)
+                    boq.apply(inputs)
+                st.session_state['manual_boq'] = boq
+            else:
+                with METRICS.timer('boq_template_fill_seconds', **labels):
+                    boq.apply(inputs)
+            with METRICS.timer('boq_template_save_seconds', **labels):
+                result = boq.result()
+        limiter.retain(boq, cost_mb, boq.evict)
+        return result
+    except AdmissionTimeout:
+        st.error("Server sedang sibuk, silakan coba generate lagi beberapa saat lagi.")
+        return None
+    except Exception as e:
+        discard_manual_boq()
+        st.error(f"Error generating BOQ: {str(e)}")
+        return None
+
+def discard_manual_boq():
+    """Drop the session's filled manual workbook and its memory accounting."""
+    boq = st.session_state.pop('manual_boq', None)
+    if boq is not None:
+        get_limiter().forget(boq)
+
+def queue_position_notifier():
+    """Placeholder plus callback that shows the generate queue position."""
+    placeholder = st.empty()
+
+    def on_wait(position):
+        placeholder.info(f"⏳ Menunggu giliran generate BOQ, posisi antrian: {position}")
+
+    return placeholder, on_wait
+
+def record_history(mode, result):
+    """Save a generated BOQ to the local history; failures only warn."""
+    form_values = st.session_state.boq_form_values
+    METRICS.inc('boq_generate_total', tab=mode, sumber=form_values.get('sumber') or "")
+    try:
+        template = form_values.get('uploaded_file')
+        kml_files = (form_values.get('kml_file') or []) if mode != "manual" else []
+        get_history().record_run(
+            lop_name=form_values['lop_name'],
+            mode=mode,
+            inputs=form_values,
+            summary=result['summary'],
+            updated_items=result['updated_items'],
+            excel_data=result['excel_data'].getvalue(),
+            template_data=upload_buffer(template).data if template is not None else None,
+            template_name=getattr(template, 'name', None),
+            kml_files=[(f.name, upload_buffer(f).data) for f in kml_files]
+        )
+    except Exception as e:
+        st.warning(f"Riwayat BOQ tidak tersimpan: {str(e)}")
+
+def history_tab():
+    history = get_history()
+
+    col1, col2, col3 = st.columns([2, 1, 2])
+    with col1:
+        lop_query = st.text_input("Cari Nama LOP", key='history_lop', help="Awalan nama LOP")
+    with col2:
+        date_range = st.date_input("Tanggal", value=(), key='history_dates')
+    with col3:
+        templates = history.templates()
+        template_labels = {t['template_hash']: f"{t['template_name'] or 'template'} ({t['runs']} run)" for t in templates}
+        template_hash = st.selectbox(
+            "Template",
+            [None] + list(template_labels),
+            format_func=lambda h: "Semua template" if h is None else template_labels[h],
+            key='history_template'
+        )
+
+    date_from = date_to = None
+    if len(date_range) >= 1:
+        date_from = datetime.combine(date_range[0], datetime.min.time())
+        date_to = datetime.combine(date_range[-1], datetime.min.time()) + pd.Timedelta(days=1)
+    runs = history.search(lop_name=lop_query.strip(), date_from=date_from, date_to=date_to, template_hash=template_hash)
+    if not runs:
+        st.info("Belum ada BOQ yang cocok.")
+        return
+
+    df_runs = pd.DataFrame(runs)[['id', 'created_at', 'lop_name', 'mode', 'sumber', 'template_name', 'total']]
+    st.dataframe(df_runs, hide_index=True, use_container_width=True)
+
+    run_ids = [r['id'] for r in runs]
+    run_labels = {r['id']: f"#{r['id']} {r['lop_name']} ({r['created_at']})" for r in runs}
+    selected = st.selectbox("Detail BOQ", run_ids, format_func=run_labels.get, key='history_selected')
+    run = history.get_run(selected)
+    summary = run['summary']
+    cols = st.columns(4)
+    cols[0].metric("Total ODP", summary['total_odp'])
+    cols[1].metric("Material", f"Rp {summary['material']:,.0f}")
+    cols[2].metric("Jasa", f"Rp {summary['jasa']:,.0f}")
+    cols[3].metric("Total Biaya", f"Rp {summary['total']:,.0f}")
+    st.dataframe(pd.DataFrame(run['updated_items']), hide_index=True, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="⬇️ Download BOQ",
+            data=history.get_artifact(run['excel_hash']),
+            file_name=f"BOQ-{run['lop_name']}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            key=f"history_download_{run['id']}",
+            use_container_width=True
+        )
+    with col2:
+        if run['template_hash']:
+            st.download_button(
+                label="📄 Download Template",
+                data=history.get_artifact(run['template_hash']),
+                file_name=run['template_name'] or "template.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key=f"history_template_{run['id']}",
+                use_container_width=True
+            )
+
+    if len(run_ids) > 1:
+        st.subheader("Bandingkan BOQ")
+        col1, col2 = st.columns(2)
+        with col1:
+            run_a = st.selectbox("BOQ A", run_ids, index=1, format_func=run_labels.get, key='history_compare_a')
+        with col2:
+            run_b = st.selectbox("BOQ B", run_ids, index=0, format_func=run_labels.get, key='history_compare_b')
+        df_compare = pd.DataFrame(history.compare(run_a, run_b))
+        if not df_compare.empty:
+            df_compare = df_compare[df_compare['delta'] != 0]
+        if df_compare.empty:
+            st.info("Tidak ada perbedaan item antara kedua BOQ.")
+        else:
+            st.dataframe(df_compare, hide_index=True, use_container_width=True)
+
+    st.subheader("Workbook Program")
+    program_ids = st.multiselect("BOQ yang Digabung", run_ids, format_func=run_labels.get, key='history_program_runs')
+    if st.button("📦 Buat Workbook Program", key='history_program_build', disabled=not program_ids):
+        program_runs = [history.get_run(run_id) for run_id in program_ids]
+        template_hashes = {r['template_hash'] for r in program_runs}
+        if None in template_hashes or len(template_hashes) > 1:
+            st.error("Semua BOQ harus memakai template yang sama dan tersimpan di riwayat.")
+        else:
+            lops = [{'lop_name': r['lop_name'], 'inputs': r['inputs'], 'items': r['updated_items']} for r in program_runs]
+            workbook = write_program_workbook(history.get_artifact(template_hashes.pop()), lops)
+            st.session_state['history_program'] = (tuple(program_ids), workbook.getvalue())
+    program = st.session_state.get('history_program')
+    if program and program[0] == tuple(program_ids):
+        st.download_button(
+            label="⬇️ Download Workbook Program",
+            data=program[1],
+            file_name=f"BOQ-Program-{datetime.now().strftime('%Y%m%d')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            key='history_program_download',
+            use_container_width=True
+        )
+
+def show_map_preview(kml_values, prefix):
+    """Map of the detected poles, ODPs and cable routes."""
+    st.markdown("**Peta Hasil Deteksi**")
+    detail = st.select_slider(
+        "Tingkat Detail",
+        options=[0, 1, 2, 3, 4],
+        value=0,
+        format_func=lambda level: "Seluruh area" if level == 0 else f"Zoom +{level}",
+        key=f'{prefix}_map_detail'
+    )
+    preview = build_preview(kml_values['features'], detail=detail)
+    if preview['view'] is None:
+        st.caption("Tidak ada koordinat untuk ditampilkan")
+        return
+    for point in preview['points']:
+        point['radius'] = 2 + 2 * math.log2(point['count'])
+    layers = [
+        pdk.Layer(
+            "PathLayer",
+            preview['paths'],
+            get_path='path',
+            get_color='color',
+            width_min_pixels=2,
+            pickable=True,
+        ),
+        pdk.Layer(
+            "ScatterplotLayer",
+            preview['points'],
+            get_position='position',
+            get_fill_color='color',
+            get_radius='radius',
+            radius_units='pixels',
+            pickable=True,
+        ),
+    ]
+    st.pydeck_chart(pdk.Deck(
+        layers=layers,
+        initial_view_state=pdk.ViewState(**preview['view']),
+        tooltip={'text': '{label}'},
+    ))
+    st.caption(f"{preview['vertices_in']:,} titik koordinat ditampilkan sebagai {preview['vertices_out']:,}")
+
+def show_span_analysis(kml_values, prefix):
+    """Span check between poles along the cable routes.
+
+    Returns the suggested ``tiang_new`` when the planner chooses to apply
+    it, otherwise None.
+    """
+    st.markdown("**Analisis Jarak Antar Tiang**")
+    max_span = st.number_input(
+        "Maks. Jarak Antar Tiang (m)",
+        min_value=10.0,
+        value=DEFAULT_MAX_SPAN,
+        step=5.0,
+        key=f'{prefix}_max_span'
+    )
+    spans = analyze_spans(kml_values['features'], max_span=max_span)
+    cols = st.columns(3)
+    cols[0].metric("Bentang > Maks.", spans['over_limit'])
+    cols[1].metric("Kekurangan Tiang", spans['missing_poles'])
+    cols[2].metric("Saran Tiang Baru", spans['suggested_tiang_new'])
+    if spans['unsnapped_poles']:
+        st.caption(f"{spans['unsnapped_poles']} tiang tidak berada di dekat jalur kabel")
+    if spans['oversized_segments']:
+        st.warning(f"{spans['oversized_segments']} segmen kabel sangat panjang (periksa koordinat yang menyimpang)")
+    over = [span for span in spans['spans'] if span['over_limit']]
+    if over:
+        st.dataframe(pd.DataFrame(over), hide_index=True, use_container_width=True)
+    apply = st.checkbox("Gunakan saran jumlah tiang baru", key=f'{prefix}_apply_span')
+    return spans['suggested_tiang_new'] if apply else None
+
+def show_homepass_analysis(kml_values, prefix):
+    """Homepass coverage and port utilization of the new ODPs."""
+    if not kml_values.get('homepass'):
+        return
+    st.markdown("**Cakupan Homepass**")
+    max_drop = st.number_input(
+        "Maks. Jarak Drop (m)",
+        min_value=10.0,
+        value=DEFAULT_MAX_DROP,
+        step=10.0,
+        key=f'{prefix}_max_drop'
+    )
+    coverage = assign_homepass(kml_values['features'], max_drop=max_drop)
+    cols = st.columns(4)
+    cols[0].metric("Homepass", coverage['homepass'])
+    cols[1].metric("Terlayani", coverage['served'])
+    cols[2].metric("Tidak Terlayani", coverage['unserved'])
+    cols[3].metric("Utilisasi Port", f"{coverage['utilization']:.1%}")
+    if coverage['overloaded_odps']:
+        st.warning(f"{coverage['overloaded_odps']} ODP melebihi kapasitas ({coverage['excess_homes']} homepass berlebih)")
+    if coverage['odps']:
+        st.dataframe(pd.DataFrame(coverage['odps']), hide_index=True, use_container_width=True)
+    if coverage['unserved_homes']:
+        st.caption("Homepass di luar jangkauan: " + ", ".join(coverage['unserved_homes'][:20])
+                   + (" ..." if coverage['unserved'] > 20 else ""))
+
+def show_cable_topology(kml_values):
+    """Cable stretches drawn more than once and disconnected route islands."""
+    topology = kml_values['topology']
+    if not topology['routes']:
+        return
+    st.markdown("**Topologi Kabel**")
+    cols = st.columns(3)
+    cols[0].metric("Panjang Duplikat (m)", f"{topology['duplicated_length']:.2f}")
+    cols[1].metric("Segmen Duplikat", topology['segments'] - topology['unique_segments'])
+    cols[2].metric("Pulau Jaringan", len(topology['islands']))
+    if topology['overlaps']:
+        st.dataframe(pd.DataFrame(topology['overlaps']), hide_index=True, use_container_width=True)
+    if len(topology['islands']) > 1:
+        st.warning(f"Jalur kabel terputus menjadi {len(topology['islands'])} bagian")
+        st.dataframe(pd.DataFrame(topology['islands']), hide_index=True, use_container_width=True)
+
+def show_file_breakdown(kml_values, columns):
+    if len(kml_values.get('files', [])) < 2:
+        return
+    st.markdown("**Rincian per File**")
+    df_files = pd.DataFrame(kml_values['files'])[['file'] + columns]
+    st.dataframe(df_files, hide_index=True, use_container_width=True)
+    if kml_values.get('duplicates_dropped'):
+        st.caption(f"{kml_values['duplicates_dropped']} placemark duplikat antar file diabaikan")
+
+def read_template_prices(uploaded_file, sumber="ODC"):
+    """Material and jasa unit prices per designator from the BOQ template.
+
+    Follows the totals in fill_boq_template: rows 9..1082, a designator on
+    several rows counts once per row, and Base Tray rows are free for ODC.
+    """
+    wb = openpyxl.load_workbook(upload_buffer(uploaded_file).reader(), read_only=True)
+    prices = {}
+    for row in wb.active.iter_rows(min_row=9, max_row=1082, min_col=2, max_col=6, values_only=True):
+        designator = str(row[0] or "").strip()
+        if not designator or (sumber == 'ODC' and "BASE TRAY" in designator.upper()):
+            continue
+        try:
+            h_mat = float(row[3] or 0)
+            h_jasa = float(row[4] or 0)
+        except (TypeError, ValueError):
+            continue
+        mat, jasa = prices.get(designator, (0.0, 0.0))
+        prices[designator] = (mat + h_mat, jasa + h_jasa)
+    wb.close()
+    return prices
+
+def delta_boq(items_old, items_new, prices=None):
+    """Per-designator volume (and cost, when prices are given) differences."""
+    old = {item['designator']: item['volume'] for item in items_old}
+    new = {item['designator']: item['volume'] for item in items_new}
+    rows = []
+    for designator in dict.fromkeys(list(old) + list(new)):
+        delta = new.get(designator, 0) - old.get(designator, 0)
+        if delta == 0:
+            continue
+        row = {'designator': designator, 'volume_lama': old.get(designator, 0),
+               'volume_baru': new.get(designator, 0), 'delta': delta}
+        if prices is not None:
+            h_mat, h_jasa = prices.get(designator, (0.0, 0.0))
+            row.update({'delta_material': delta * h_mat, 'delta_jasa': delta * h_jasa,
+                        'delta_biaya': delta * (h_mat + h_jasa)})
+        rows.append(row)
+    return rows
+
+def parse_revision(upload, adss):
+    """Features of one uploaded revision, or None after reporting the error."""
+    try:
+        (name, features, warnings, error), = parse_many([(upload.name, upload_buffer(upload))], adss=adss)
+    except Exception as e:
+        st.error(f"{upload.name}: KML parsing failed: {str(e)}")
+        return None
+    if error:
+        st.error(f"{name}: {error}")
+        return None
+    for warning in warnings:
+        st.warning(f"{name}: {warning}")
+    return features
+
+def diff_tab():
+    st.subheader("Bandingkan Revisi KML")
+    col1, col2 = st.columns(2)
+    with col1:
+        adss = st.radio("Jenis", ["Distribusi", "ADSS"], key='diff_mode', horizontal=True) == "ADSS"
+    with col2:
+        sumber = st.radio("Sumber", ["ODC", "ODP"], key='diff_sumber', horizontal=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        old_file = st.file_uploader("KML Revisi Lama*", type=["kml", "boqnet"], key='diff_old')
+    with col2:
+        new_file = st.file_uploader("KML Revisi Baru*", type=["kml", "boqnet"], key='diff_new')
+    template = st.file_uploader(
+        "Template BOQ (opsional)",
+        type=["xlsx"],
+        key='diff_template',
+        help="Untuk menghitung selisih biaya dari harga template"
+    )
+    if not old_file or not new_file:
+        st.info("Unggah dua revisi KML untuk melihat perubahannya.")
+        return
+
+    with st.spinner("Membandingkan KML..."):
+        old_features = parse_revision(old_file, adss)
+        new_features = parse_revision(new_file, adss)
+        if old_features is None or new_features is None:
+            return
+        diff = diff_features(old_features, new_features)
+
+    changes = diff['changes']
+    cols = st.columns(5)
+    cols[0].metric("Tidak Berubah", diff['unchanged'])
+    for col, (change, label) in zip(cols[1:], [('added', "Ditambah"), ('removed', "Dihapus"),
+                                               ('moved', "Dipindah"), ('rerouted', "Jalur Berubah")]):
+        col.metric(label, sum(1 for c in changes if c['change'] == change))
+
+    if diff['counts']:
+        st.markdown("**Perubahan per Jenis**")
+        df_counts = pd.DataFrame.from_dict(diff['counts'], orient='index')
+        st.dataframe(df_counts, use_container_width=True)
+    if diff['cable_lengths']:
+        st.markdown("**Panjang Kabel (m)**")
+        df_lengths = pd.DataFrame.from_dict(diff['cable_lengths'], orient='index')
+        st.dataframe(df_lengths.style.format("{:.2f}"), use_container_width=True)
+    if changes:
+        with st.expander("Rincian Perubahan Placemark"):
+            st.dataframe(pd.DataFrame(changes), hide_index=True, use_container_width=True)
+
+    calculate = calculate_volumes_adss if adss else calculate_volumes
+    base_inputs = {'sumber': sumber, 'izin': "", 'tikungan': 0}
+    items_old = calculate({**base_inputs, **summarize_features(old_features, adss=adss, sumber=sumber)})
+    items_new = calculate({**base_inputs, **summarize_features(new_features, adss=adss, sumber=sumber)})
+    prices = None
+    if template:
+        try:
+            prices = read_template_prices(template, sumber)
+        except Exception as e:
+            st.error(f"Template tidak terbaca: {str(e)}")
+    rows = delta_boq(items_old, items_new, prices)
+
+    st.markdown("**Delta BOQ**")
+    if not rows:
+        st.info("Tidak ada perubahan volume antara kedua revisi.")
+        return
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    if prices is not None:
+        cols = st.columns(3)
+        cols[0].metric("Delta Material", f"Rp {sum(r['delta_material'] for r in rows):,.0f}")
+        cols[1].metric("Delta Jasa", f"Rp {sum(r['delta_jasa'] for r in rows):,.0f}")
+        cols[2].metric("Delta Total", f"Rp {sum(r['delta_biaya'] for r in rows):,.0f}")
+
+def odp_mix_panel(prefix, adss=False, allow_apply=False):
+    """Suggest the cheapest ODP-8/ODP-16/OTB mix for a port requirement."""
+    form_values = st.session_state.boq_form_values
+    with st.expander("🧮 Optimasi Komposisi ODP"):
+        current_ports = form_values.get('odp_8', 0) * 8 + form_values.get('odp_16', 0) * 16 + (8 if form_values.get('otb_12', 0) > 0 else 0)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            required_ports = st.number_input("Kebutuhan Port", min_value=1, value=max(current_ports, 8), key=f'{prefix}_mix_ports')
+        with col2:
+            spare_ports = st.number_input("Maks. Port Cadangan", min_value=0, value=DEFAULT_SPARE_PORTS, step=8, key=f'{prefix}_mix_spare')
+        with col3:
+            allow_otb = st.checkbox("Boleh pakai OTB 12", value=True, key=f'{prefix}_mix_otb')
+
+        if st.button("Cari Komposisi Termurah", key=f'{prefix}_mix_run'):
+            if not form_values.get('uploaded_file'):
+                st.error("Silakan unggah file template BOQ!")
+                return
+            try:
+                prices = read_template_prices(form_values['uploaded_file'], form_values.get('sumber', "ODC"))
+            except Exception as e:
+                st.error(f"Template tidak terbaca: {str(e)}")
+                return
+            inputs = {'izin': "", 'kabel_24': 0.0, 'kabel_adss_12': 0.0, 'kabel_adss_24': 0.0, 'tiang_new': 0, **form_values}
+            st.session_state[f'{prefix}_mix_result'] = optimize_odp_mix(
+                required_ports,
+                inputs,
+                calculate_volumes_adss if adss else calculate_volumes,
+                prices,
+                spare_ports=spare_ports,
+                allow_otb=allow_otb
+            )
+
+        mix = st.session_state.get(f'{prefix}_mix_result')
+        if not mix:
+            return
+        if not mix['by_total']:
+            st.info("Tidak ada komposisi yang memenuhi kebutuhan port.")
+            return
+        st.caption(f"{mix['candidates']} komposisi dievaluasi. CPP dihitung per port fisik (ODP 16 = 16 port).")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**Termurah (Total)**")
+            st.dataframe(pd.DataFrame(mix['by_total']), hide_index=True, use_container_width=True)
+        with col2:
+            st.markdown("**Termurah (CPP)**")
+            st.dataframe(pd.DataFrame(mix['by_cpp']), hide_index=True, use_container_width=True)
+        if allow_apply and st.button("Gunakan komposisi termurah (Total)", key=f'{prefix}_mix_apply'):
+            best = mix['by_total'][0]
+            form_values.update({'odp_8': best['odp_8'], 'odp_16': best['odp_16'], 'otb_12': best['otb_12']})
+            st.rerun()
 
 def manual_input_form():
     initialize_session_state()
@@ -758,11 +1162,13 @@ def manual_input_form():
                 return
             
             st.session_state.boq_state['active_tab'] = "manual"
-            result = process_boq_template(
+            queue_status, on_wait = queue_position_notifier()
+            result = process_manual_boq(
                 st.session_state.boq_form_values['uploaded_file'],
                 st.session_state.boq_form_values,
-                st.session_state.boq_form_values['lop_name']
+                on_wait=on_wait
             )
+            queue_status.empty()
             
             if result:
                 st.session_state.boq_state.update({
@@ -773,8 +1179,11 @@ def manual_input_form():
                     'summary': result['summary'],
                     'is_adss': False
                 })
+                record_history("manual", result)
                 st.success("✅ BOQ berhasil digenerate!")
 
+    odp_mix_panel('manual', allow_apply=True)
+
 def kml_input_form():
     initialize_session_state()
     
@@ -853,16 +1262,41 @@ def kml_input_form():
       3. Koordinat valid  
     - 🔄 Jika error, export ulang dari Google Earth
     """)
+        length_mode = st.radio(
+            "Akurasi Panjang Kabel",
+            ["exact", "fast"],
+            format_func=lambda m: "Exact (geodesic)" if m == "exact" else "Cepat (planar)",
+            key='kml_length_mode',
+            horizontal=True,
+            help="Mode cepat untuk iterasi desain, gunakan Exact untuk BOQ final"
+        )
         st.session_state.boq_form_values['kml_file'] = st.file_uploader(
             "Unggah File KML*",
-            type=["kml"],
+            type=["kml", "boqnet"],
             key='kml_uploader',
-            help="File harus berisi: ODP NEW/BARU, Tiang, dan jalur kabel"
+            accept_multiple_files=True,
+            help="File harus berisi: ODP NEW/BARU, Tiang, dan jalur kabel. Desain yang terpecah bisa diunggah sekaligus. Snapshot jaringan (.boqnet) juga diterima."
+        )
+        dedupe = st.checkbox(
+            "Abaikan placemark duplikat antar file",
+            key='kml_dedupe',
+            help="Placemark dengan nama dan koordinat sama di beberapa file hanya dihitung sekali"
+        )
+        shared_once = st.checkbox(
+            "Hitung segmen kabel yang tumpang tindih sekali",
+            key='kml_shared_once',
+            help=f"Segmen kabel yang digambar lebih dari sekali (toleransi {DEFAULT_SNAP_TOLERANCE:g} m) hanya dihitung sekali"
         )
 
+        kml_values = None
         if st.session_state.boq_form_values.get('kml_file'):
             with st.spinner("Memproses KML..."):
-                kml_values = parse_kml_file(st.session_state.boq_form_values['kml_file'])
+                kml_values = parse_kml_files(
+                    st.session_state.boq_form_values['kml_file'],
+                    length_mode=length_mode,
+                    dedupe=dedupe,
+                    shared_once=shared_once
+                )
                 if kml_values:
                     st.success("✅ KML berhasil diproses!")
                     
@@ -876,17 +1310,6 @@ def kml_input_form():
                         'otb_12': kml_values['otb_12']
                     })
 
-                    with st.expander("🔍 Hasil Deteksi KML"):
-                        cols = st.columns(2)
-                        with cols[0]:
-                            st.metric("ODP 8 Port (NEW/BARU)", kml_values['odp_8'])
-                            st.metric("Tiang Baru", kml_values['tiang_new'])
-                            st.metric("Panjang Kabel (m)", f"{kml_values['kabel_12']:.2f}")
-                        with cols[1]:
-                            st.metric("ODP 16 Port (NEW/BARU)", kml_values['odp_16'])
-                            st.metric("Tiang Existing", kml_values['tiang_existing'])
-                            st.metric("OTB 12 (NEW/BARU)", kml_values['otb_12'])
-
         st.subheader("Additional Inputs")
         col1, col2 = st.columns(2)
         with col1:
@@ -912,35 +1335,73 @@ def kml_input_form():
         )
 
         submitted = st.form_submit_button("🚀 Generate BOQ dari KML", use_container_width=True)
-        
-        if submitted:
-            if not st.session_state.boq_form_values.get('uploaded_file'):
-                st.error("Silakan unggah file template BOQ!")
-                return
-            if not st.session_state.boq_form_values.get('lop_name'):
-                st.error("Silakan isi nama LOP!")
-                return
-            if not st.session_state.boq_form_values.get('kml_file'):
-                st.error("Silakan unggah file KML!")
-                return
-            
-            st.session_state.boq_state['active_tab'] = "kml"
-            result = process_boq_template(
-                st.session_state.boq_form_values['uploaded_file'],
-                st.session_state.boq_form_values,
-                st.session_state.boq_form_values['lop_name']
-            )
-            
-            if result:
-                st.session_state.boq_state.update({
-                    'ready': True,
-                    'excel_data': result['excel_data'],
-                    'project_name': st.session_state.boq_form_values['lop_name'],
-                    'updated_items': result['updated_items'],
-                    'summary': result['summary'],
-                    'is_adss': False
-                })
-                st.success("✅ BOQ berhasil digenerate!")
+
+    if kml_values:
+        with st.expander("🔍 Hasil Deteksi KML"):
+            cols = st.columns(2)
+            with cols[0]:
+                st.metric("ODP 8 Port (NEW/BARU)", kml_values['odp_8'])
+                st.metric("Tiang Baru", kml_values['tiang_new'])
+                st.metric("Panjang Kabel (m)", f"{kml_values['kabel_12']:.2f}")
+            with cols[1]:
+                st.metric("ODP 16 Port (NEW/BARU)", kml_values['odp_16'])
+                st.metric("Tiang Existing", kml_values['tiang_existing'])
+                st.metric("OTB 12 (NEW/BARU)", kml_values['otb_12'])
+            if kml_values['length_mode'] == "fast":
+                st.caption(f"Mode cepat: error panjang maks. pada sampel {ERROR_SAMPLE_SIZE} segmen {kml_values['length_max_rel_error']:.4%} vs geodesic (estimasi)")
+            if kml_values['length_memo_segments']:
+                st.caption(f"Memo panjang segmen: {kml_values['length_memo_hits']:,} dari {kml_values['length_memo_segments']:,} segmen diambil dari memo ({kml_values['length_memo_hits'] / kml_values['length_memo_segments']:.0%})")
+            show_file_breakdown(kml_values, ['odp_8', 'odp_16', 'tiang_new', 'tiang_existing', 'kabel_12', 'otb_12', 'closure'])
+            show_map_preview(kml_values, 'kml')
+            show_cable_topology(kml_values)
+            suggested_tiang = show_span_analysis(kml_values, 'kml')
+            show_homepass_analysis(kml_values, 'kml')
+            if suggested_tiang is not None:
+                st.session_state.boq_form_values['tiang_new'] = suggested_tiang
+
+        features = kml_values['features']
+        # Built only when the download is clicked; fast-mode lines are measured then.
+        st.download_button(
+            label="💾 Download Snapshot Jaringan",
+            data=lambda: save_snapshot(features, adss=False),
+            file_name=f"{st.session_state.boq_form_values.get('lop_name') or 'network'}.boqnet",
+            mime="application/octet-stream",
+            key='kml_snapshot_download',
+            help="Hasil deteksi KML dalam format ringkas, bisa diunggah ulang untuk menghitung BOQ tanpa memproses KML lagi"
+        )
+
+    if submitted:
+        if not st.session_state.boq_form_values.get('uploaded_file'):
+            st.error("Silakan unggah file template BOQ!")
+            return
+        if not st.session_state.boq_form_values.get('lop_name'):
+            st.error("Silakan isi nama LOP!")
+            return
+        if not st.session_state.boq_form_values.get('kml_file'):
+            st.error("Silakan unggah file KML!")
+            return
+
+        st.session_state.boq_state['active_tab'] = "kml"
+        queue_status, on_wait = queue_position_notifier()
+        result = process_boq_template(
+            st.session_state.boq_form_values['uploaded_file'],
+            st.session_state.boq_form_values,
+            st.session_state.boq_form_values['lop_name'],
+            on_wait=on_wait
+        )
+        queue_status.empty()
+
+        if result:
+            st.session_state.boq_state.update({
+                'ready': True,
+                'excel_data': result['excel_data'],
+                'project_name': st.session_state.boq_form_values['lop_name'],
+                'updated_items': result['updated_items'],
+                'summary': result['summary'],
+                'is_adss': False
+            })
+            record_history("kml", result)
+            st.success("✅ BOQ berhasil digenerate!")
 
 def adss_input_form():
     initialize_session_state()
@@ -979,17 +1440,42 @@ def adss_input_form():
                - Otomatis dihitung dari tiang tanpa deskripsi PU-AS-HL
             """)
             
+        length_mode = st.radio(
+            "Akurasi Panjang Kabel",
+            ["exact", "fast"],
+            format_func=lambda m: "Exact (geodesic)" if m == "exact" else "Cepat (planar)",
+            key='adss_length_mode',
+            horizontal=True,
+            help="Mode cepat untuk iterasi desain, gunakan Exact untuk BOQ final"
+        )
         st.session_state.boq_form_values['kml_file'] = st.file_uploader(
             "Unggah File KML*",
-            type=["kml"],
-            key='adss_uploader'
+            type=["kml", "boqnet"],
+            key='adss_uploader',
+            accept_multiple_files=True,
+            help="Snapshot jaringan (.boqnet) juga diterima"
+        )
+        dedupe = st.checkbox(
+            "Abaikan placemark duplikat antar file",
+            key='adss_dedupe',
+            help="Placemark dengan nama dan koordinat sama di beberapa file hanya dihitung sekali"
+        )
+        shared_once = st.checkbox(
+            "Hitung segmen kabel yang tumpang tindih sekali",
+            key='adss_shared_once',
+            help=f"Segmen kabel yang digambar lebih dari sekali (toleransi {DEFAULT_SNAP_TOLERANCE:g} m) hanya dihitung sekali"
         )
 
+        kml_values = None
         if st.session_state.boq_form_values.get('kml_file'):
             with st.spinner("Memproses KML ADSS..."):
-                kml_values = parse_kml_file_adss(
+                kml_values = parse_kml_files(
                     st.session_state.boq_form_values['kml_file'],
-                    st.session_state.boq_form_values['sumber']
+                    adss=True,
+                    sumber=st.session_state.boq_form_values['sumber'],
+                    length_mode=length_mode,
+                    dedupe=dedupe,
+                    shared_once=shared_once
                 )
                 if kml_values:
                     st.success("✅ KML ADSS berhasil diproses!")
@@ -1009,19 +1495,6 @@ def adss_input_form():
                         'pu_as_sc': kml_values['pu_as_sc']
                     })
 
-                    with st.expander("🔍 Hasil Deteksi KML ADSS"):
-                        cols = st.columns(2)
-                        with cols[0]:
-                            st.metric("ODP 8 Port", kml_values['odp_8'])
-                            st.metric("Tiang Baru", kml_values['tiang_new'])
-                            st.metric("Kabel ADSS 12D (m)", f"{kml_values['kabel_adss_12']:.2f}")
-                            st.metric("PU-AS-HL", kml_values['pu_as_hl'])
-                        with cols[1]:
-                            st.metric("ODP 16 Port", kml_values['odp_16'])
-                            st.metric("Tiang Existing", kml_values['tiang_existing'])
-                            st.metric("Kabel ADSS 24D (m)", f"{kml_values['kabel_adss_24']:.2f}")
-                            st.metric("PU-AS-SC", kml_values['pu_as_sc'])
-
         st.subheader("Additional Inputs")
         col1, col2 = st.columns(2)
         with col1:
@@ -1046,39 +1519,82 @@ def adss_input_form():
         )
 
         submitted = st.form_submit_button("🚀 Generate BOQ ADSS", use_container_width=True)
-        
-        if submitted:
-            if not st.session_state.boq_form_values.get('uploaded_file'):
-                st.error("Silakan unggah file template BOQ!")
-                return
-            if not st.session_state.boq_form_values.get('lop_name'):
-                st.error("Silakan isi nama LOP!")
-                return
-            if not st.session_state.boq_form_values.get('kml_file'):
-                st.error("Silakan unggah file KML!")
-                return
-            
-            st.session_state.boq_state['active_tab'] = "adss"
-            result = process_boq_template(
-                st.session_state.boq_form_values['uploaded_file'],
-                st.session_state.boq_form_values,
-                st.session_state.boq_form_values['lop_name'],
-                adss_mode=True
-            )
-            
-            if result:
-                st.session_state.boq_state.update({
-                    'ready': True,
-                    'excel_data': result['excel_data'],
-                    'project_name': st.session_state.boq_form_values['lop_name'],
-                    'updated_items': result['updated_items'],
-                    'summary': result['summary'],
-                    'is_adss': True
-                })
-                st.success("✅ BOQ ADSS berhasil digenerate!")
+
+    if kml_values:
+        with st.expander("🔍 Hasil Deteksi KML ADSS"):
+            cols = st.columns(2)
+            with cols[0]:
+                st.metric("ODP 8 Port", kml_values['odp_8'])
+                st.metric("Tiang Baru", kml_values['tiang_new'])
+                st.metric("Kabel ADSS 12D (m)", f"{kml_values['kabel_adss_12']:.2f}")
+                st.metric("PU-AS-HL", kml_values['pu_as_hl'])
+            with cols[1]:
+                st.metric("ODP 16 Port", kml_values['odp_16'])
+                st.metric("Tiang Existing", kml_values['tiang_existing'])
+                st.metric("Kabel ADSS 24D (m)", f"{kml_values['kabel_adss_24']:.2f}")
+                st.metric("PU-AS-SC", kml_values['pu_as_sc'])
+            if kml_values['length_mode'] == "fast":
+                st.caption(f"Mode cepat: error panjang maks. pada sampel {ERROR_SAMPLE_SIZE} segmen {kml_values['length_max_rel_error']:.4%} vs geodesic (estimasi)")
+            if kml_values['length_memo_segments']:
+                st.caption(f"Memo panjang segmen: {kml_values['length_memo_hits']:,} dari {kml_values['length_memo_segments']:,} segmen diambil dari memo ({kml_values['length_memo_hits'] / kml_values['length_memo_segments']:.0%})")
+            show_file_breakdown(kml_values, ['odp_8', 'odp_16', 'tiang_new', 'tiang_existing', 'kabel_adss_12', 'kabel_adss_24', 'pu_as_hl', 'pu_as_sc'])
+            show_map_preview(kml_values, 'adss')
+            show_cable_topology(kml_values)
+            suggested_tiang = show_span_analysis(kml_values, 'adss')
+            show_homepass_analysis(kml_values, 'adss')
+            if suggested_tiang is not None:
+                st.session_state.boq_form_values['tiang_new'] = suggested_tiang
+
+        features = kml_values['features']
+        # Built only when the download is clicked; fast-mode lines are measured then.
+        st.download_button(
+            label="💾 Download Snapshot Jaringan",
+            data=lambda: save_snapshot(features, adss=True),
+            file_name=f"{st.session_state.boq_form_values.get('lop_name') or 'network'}.boqnet",
+            mime="application/octet-stream",
+            key='adss_snapshot_download',
+            help="Hasil deteksi KML dalam format ringkas, bisa diunggah ulang untuk menghitung BOQ tanpa memproses KML lagi"
+        )
+
+    if submitted:
+        if not st.session_state.boq_form_values.get('uploaded_file'):
+            st.error("Silakan unggah file template BOQ!")
+            return
+        if not st.session_state.boq_form_values.get('lop_name'):
+            st.error("Silakan isi nama LOP!")
+            return
+        if not st.session_state.boq_form_values.get('kml_file'):
+            st.error("Silakan unggah file KML!")
+            return
+
+        st.session_state.boq_state['active_tab'] = "adss"
+        queue_status, on_wait = queue_position_notifier()
+        result = process_boq_template(
+            st.session_state.boq_form_values['uploaded_file'],
+            st.session_state.boq_form_values,
+            st.session_state.boq_form_values['lop_name'],
+            adss_mode=True,
+            on_wait=on_wait
+        )
+        queue_status.empty()
+
+        if result:
+            st.session_state.boq_state.update({
+                'ready': True,
+                'excel_data': result['excel_data'],
+                'project_name': st.session_state.boq_form_values['lop_name'],
+                'updated_items': result['updated_items'],
+                'summary': result['summary'],
+                'is_adss': True
+            })
+            record_history("adss", result)
+            st.success("✅ BOQ ADSS berhasil digenerate!")
+
+    odp_mix_panel('adss', adss=True)
 
 def show():
     initialize_session_state()
+    start_exporters()
     
     st.title("📊 BOQ Generator")
     st.markdown("""
@@ -1093,7 +1609,7 @@ def show():
     </style>
     """, unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["📝 Manual Input", "🗺️ BOQ dari KML", "🌀 BOQ ADSS"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📝 Manual Input", "🗺️ BOQ dari KML", "🌀 BOQ ADSS", "📚 Riwayat BOQ", "🔀 Diff KML"])
     
     with tab1:
         manual_input_form()
@@ -1101,6 +1617,10 @@ def show():
         kml_input_form()
     with tab3:
         adss_input_form()
+    with tab4:
+        history_tab()
+    with tab5:
+        diff_tab()
     
     if 'boq_state' in st.session_state and st.session_state.boq_state.get('ready', False):
         st.divider()
@@ -1139,19 +1659,22 @@ def show():
         with col2:
             if st.session_state.boq_state.get('is_adss', False):
                 try:
-                    if 'kml_file' in st.session_state.boq_form_values and st.session_state.boq_form_values['kml_file'] is not None:
-                        modified_kml = generate_adss_kml(
-                            inputs=st.session_state.boq_form_values,
-                            original_kml=st.session_state.boq_form_values['kml_file']
-                        )
-                        if modified_kml:
-                            st.download_button(
-                                label="🗺️ Download Modified KML",
-                                data=modified_kml,
-                                file_name=f"KML-ADSS-{st.session_state.boq_state['project_name']}.kml",
-                                mime="application/vnd.google-earth.kml+xml",
-                                use_container_width=True
+                    if 'kml_file' in st.session_state.boq_form_values and st.session_state.boq_form_values['kml_file']:
+                        kml_files = [f for f in st.session_state.boq_form_values['kml_file'] if f.name.lower().endswith(".kml")]
+                        for index, kml_file in enumerate(kml_files):
+                            modified_kml = generate_adss_kml(
+                                inputs=st.session_state.boq_form_values,
+                                original_kml=kml_file
                             )
+                            if modified_kml:
+                                suffix = "" if len(kml_files) == 1 else f"-{index + 1}"
+                                st.download_button(
+                                    label=f"🗺️ Download Modified KML{suffix}",
+                                    data=modified_kml,
+                                    file_name=f"KML-ADSS-{st.session_state.boq_state['project_name']}{suffix}.kml",
+                                    mime="application/vnd.google-earth.kml+xml",
+                                    use_container_width=True
+                                )
                     else:
                         st.warning("File KML tidak ditemukan untuk di-generate")
                 except Exception as e:
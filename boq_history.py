@@ -0,0 +1,191 @@
+"""Local SQLite history of generated BOQ runs.
+
+Every generate stores its inputs, summary and updated items together with
+content-addressed copies of the produced workbook, the template and the
+KML files, so an old BOQ can be found and re-downloaded without
+recomputing anything. The database path defaults to ``boq_history.sqlite3``
+and can be changed with the ``BOQ_HISTORY_DB`` environment variable.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+DEFAULT_DB_PATH = os.environ.get("BOQ_HISTORY_DB", "boq_history.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    hash TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    lop_name TEXT NOT NULL COLLATE NOCASE,
+    mode TEXT NOT NULL,
+    sumber TEXT,
+    template_name TEXT,
+    template_hash TEXT,
+    excel_hash TEXT NOT NULL,
+    kml_hashes TEXT NOT NULL,
+    total REAL NOT NULL,
+    inputs TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    updated_items TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_lop_name ON runs (lop_name, created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_created_at ON runs (created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_template ON runs (template_hash, created_at);
+"""
+
+# Listing columns; the JSON payloads are only loaded by get_run().
+RUN_COLUMNS = "id, created_at, lop_name, mode, sumber, template_name, template_hash, excel_hash, total"
+
+# Form values that hold upload objects rather than inputs.
+FILE_KEYS = ('uploaded_file', 'kml_file')
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BoqHistory:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _store_artifact(self, conn, data, kind):
+        digest = content_hash(data)
+        conn.execute(
+            "INSERT OR IGNORE INTO artifacts (hash, kind, size, data) VALUES (?, ?, ?, ?)",
+            (digest, kind, len(data), sqlite3.Binary(data)),
+        )
+        return digest
+
+    def record_run(self, lop_name, mode, inputs, summary, updated_items, excel_data,
+                   template_data=None, template_name=None, kml_files=()):
+        """Persist one generate. ``kml_files`` is a list of ``(name, bytes)``.
+
+        Returns the new run id.
+        """
+        clean_inputs = {k: v for k, v in inputs.items() if k not in FILE_KEYS}
+        with self._lock, closing(self._connect()) as conn, conn:
+            excel_hash = self._store_artifact(conn, excel_data, 'xlsx')
+            template_hash = self._store_artifact(conn, template_data, 'template') if template_data else None
+            kml_hashes = [
+                {'name': name, 'hash': self._store_artifact(conn, data, 'kml')}
+                for name, data in kml_files
+            ]
+            cur = conn.execute(
+                "INSERT INTO runs (created_at, lop_name, mode, sumber, template_name, template_hash,"
+                " excel_hash, kml_hashes, total, inputs, summary, updated_items)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    datetime.now().isoformat(timespec='seconds'),
+                    lop_name,
+                    mode,
+                    clean_inputs.get('sumber'),
+                    template_name,
+                    template_hash,
+                    excel_hash,
+                    json.dumps(kml_hashes),
+                    float(summary.get('total', 0)),
+                    json.dumps(clean_inputs, default=str),
+                    json.dumps(summary, default=str),
+                    json.dumps(updated_items, default=str),
+                ),
+            )
+            return cur.lastrowid
+
+    def search(self, lop_name=None, date_from=None, date_to=None, template_hash=None, limit=50):
+        """Newest-first runs matching a LOP name prefix, date range and template."""
+        clauses = []
+        params = []
+        if lop_name:
+            # Prefix LIKE on a NOCASE column can use idx_runs_lop_name.
+            escaped = lop_name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("lop_name LIKE ? ESCAPE '\\'")
+            params.append(escaped + "%")
+        if date_from:
+            clauses.append("created_at >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            clauses.append("created_at < ?")
+            params.append(date_to.isoformat())
+        if template_hash:
+            clauses.append("template_hash = ?")
+            params.append(template_hash)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT {RUN_COLUMNS} FROM runs {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def templates(self):
+        """Distinct templates seen so far, newest first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT template_hash, template_name, MAX(created_at) AS last_used, COUNT(*) AS runs"
+                " FROM runs WHERE template_hash IS NOT NULL"
+                " GROUP BY template_hash ORDER BY last_used DESC"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_run(self, run_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        for key in ('inputs', 'summary', 'updated_items', 'kml_hashes'):
+            run[key] = json.loads(run[key])
+        return run
+
+    def get_artifact(self, digest):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT data FROM artifacts WHERE hash = ?", (digest,)).fetchone()
+        return bytes(row['data']) if row else None
+
+    def compare(self, run_a, run_b):
+        """Per-designator volume differences between two runs (b minus a)."""
+        def volumes(run):
+            totals = {}
+            for item in run['updated_items']:
+                totals[item['designator']] = item['volume']
+            return totals
+
+        a = volumes(self.get_run(run_a))
+        b = volumes(self.get_run(run_b))
+        rows = []
+        for designator in list(dict.fromkeys(list(a) + list(b))):
+            va, vb = a.get(designator, 0), b.get(designator, 0)
+            rows.append({'designator': designator, 'volume_a': va, 'volume_b': vb, 'delta': vb - va})
+        return rows
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """Process-wide history store."""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = BoqHistory()
+        return _history
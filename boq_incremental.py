@@ -0,0 +1,164 @@
+"""Filled BOQ template kept between generates of one planner session.
+
+The template is loaded, indexed by designator and filled once. Later
+generates compare the inputs with the previous ones, look up the
+designators the changed fields feed (``dependencies``), patch only their
+cells and move the material/jasa totals by the difference. Inputs that
+are not in the dependency map (e.g. ``sumber``, which also changes the
+Base Tray rule) refill every designator.
+"""
+from io import BytesIO
+
+import openpyxl
+
+from odp_optimizer import effective_volumes
+from template_formulas import compile_template, write_cached_values
+from upload_buffer import upload_buffer
+
+FIRST_ROW = 9
+LAST_ROW = 1082
+
+# Form values that hold upload objects rather than inputs.
+FILE_KEYS = ('uploaded_file', 'kml_file')
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class IncrementalBoq:
+    """One template workbook, filled and then patched as inputs change.
+
+    ``calculate`` is the volume calculation of the BOQ mode and
+    ``dependencies`` maps an input field to the designators it affects.
+    """
+
+    def __init__(self, uploaded_file, calculate, dependencies):
+        template = upload_buffer(uploaded_file)
+        self.digest = template.digest()
+        self.calculate = calculate
+        self.dependencies = dependencies
+        self.wb = openpyxl.load_workbook(template.reader())
+        self.ws = self.wb.active
+        self.formulas = compile_template(self.digest, self.ws)
+
+        self.rows = {}
+        self.original = {}
+        for row in range(FIRST_ROW, LAST_ROW + 1):
+            designator = str(self.ws[f'B{row}'].value or "").strip()
+            self.rows.setdefault(designator, []).append(row)
+            self.original[row] = (self.ws[f'F{row}'].value, self.ws[f'G{row}'].value)
+        self.contribution = {}
+        self.changed = {}
+        self.inputs = None
+        self.items = []
+        self.material = self.jasa = 0.0
+
+    @property
+    def loaded(self):
+        return self.wb is not None
+
+    def evict(self):
+        """Drop the workbook to free its memory; the next generate for the
+        session loads and fills the template again."""
+        self.wb = self.ws = None
+
+    def _row_cost(self, row, sumber):
+        # Same rules as the template fill: non-numeric rows and, for ODC, Base Tray rows are free.
+        designator = str(self.ws[f'B{row}'].value or "").strip()
+        if sumber == 'ODC' and "BASE TRAY" in designator.upper():
+            return 0.0, 0.0
+        h_mat, h_jasa, vol = (_number(self.ws[f'{column}{row}'].value) for column in "EFG")
+        if None in (h_mat, h_jasa, vol):
+            return 0.0, 0.0
+        return h_mat * vol, h_jasa * vol
+
+    def _set(self, ref, value, original):
+        self.ws[ref] = value
+        if value == original:
+            self.changed.pop(ref, None)
+        else:
+            self.changed[ref] = value
+
+    def affected(self, inputs):
+        """Designators to refill for ``inputs``, or None to refill all."""
+        if self.inputs is None:
+            return None
+        fields = {
+            key for key in set(self.inputs) | set(inputs)
+            if key not in FILE_KEYS and self.inputs.get(key) != inputs.get(key)
+        }
+        if any(field not in self.dependencies for field in fields):
+            return None
+        return {designator for field in fields for designator in self.dependencies[field]}
+
+    def apply(self, inputs):
+        """Bring the workbook up to date with ``inputs``; returns the number
+        of designators refilled."""
+        designators = self.affected(inputs)
+        if designators is None:
+            designators = set(self.rows) - {""}
+            full = True
+        else:
+            full = False
+        self.items = self.calculate(inputs)
+        volumes = effective_volumes(self.items)
+        izin = {item['designator']: item['izin_value'] for item in self.items if 'izin_value' in item}
+        sumber = inputs.get('sumber')
+
+        for designator in designators:
+            for row in self.rows.get(designator, ()):
+                original_f, original_g = self.original[row]
+                if designator in volumes:
+                    self._set(f'G{row}', volumes[designator], original_g)
+                    if "Preliminary" in designator and designator in izin:
+                        self._set(f'F{row}', izin[designator], original_f)
+                    else:
+                        self._set(f'F{row}', original_f, original_f)
+                else:
+                    self._set(f'G{row}', original_g, original_g)
+                    self._set(f'F{row}', original_f, original_f)
+                if not full:
+                    old_mat, old_jasa = self.contribution[row]
+                    self.contribution[row] = self._row_cost(row, sumber)
+                    self.material += self.contribution[row][0] - old_mat
+                    self.jasa += self.contribution[row][1] - old_jasa
+
+        if full:
+            self.contribution = {row: self._row_cost(row, sumber) for row in self.original}
+            self.material = sum(mat for mat, _ in self.contribution.values())
+            self.jasa = sum(jasa for _, jasa in self.contribution.values())
+        self.inputs = {key: value for key, value in inputs.items() if key not in FILE_KEYS}
+        return len(designators)
+
+    def summary(self):
+        total = self.material + self.jasa
+        total_odp = self.inputs.get('odp_8', 0) + self.inputs.get('odp_16', 0)
+        total_ports = (total_odp * 8) + (1 if self.inputs.get('otb_12', 0) > 0 else 0) * 8
+        cpp = round(total / total_ports, 2) if total_ports > 0 else 0
+        return {
+            'material': self.material,
+            'jasa': self.jasa,
+            'total': total,
+            'cpp': cpp,
+            'total_odp': total_odp,
+            'total_ports': total_ports
+        }
+
+    def save(self):
+        """The filled workbook with formula results cached."""
+        output = BytesIO()
+        self.wb.save(output)
+        values = self.formulas.evaluate(self.changed)
+        return write_cached_values(output.getvalue(), self.wb.worksheets.index(self.ws), values)
+
+    def result(self):
+        """Same shape as a regular template fill."""
+        return {
+            'excel_data': self.save(),
+            'summary': self.summary(),
+            'updated_items': [item for item in self.items if item['volume'] > 0]
+        }
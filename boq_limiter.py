@@ -0,0 +1,220 @@
+"""Process-wide admission control for BOQ template processing.
+
+Loading and saving a large template with openpyxl is the memory-heavy part
+of a generate. All callers in the process (every Streamlit session and the
+HTTP service) go through one FIFO limiter that caps the number of
+templates processed at once and the estimated memory they hold.
+
+Memory a session keeps between jobs (the manual tab's filled workbook) is
+registered with ``retain`` and counts against the same budget. Retained
+memory is released, oldest first, when a job needs the room, and after
+sitting idle for ``BOQ_RETAINED_IDLE_SECONDS``.
+
+Configuration (environment variables):
+    BOQ_MAX_CONCURRENT_TEMPLATES   concurrent jobs (default 2)
+    BOQ_TEMPLATE_MEMORY_BUDGET_MB  estimated memory budget (default 1024)
+    BOQ_ADMISSION_TIMEOUT          seconds a job may wait (default 300)
+    BOQ_RETAINED_IDLE_SECONDS      idle seconds before retained memory is released (default 900)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from boq_metrics import METRICS
+
+# openpyxl peaks at roughly 100x the compressed xlsx size during load + save.
+MEMORY_PER_TEMPLATE_BYTE = 100
+MIN_JOB_MEMORY_MB = 16
+WAIT_POLL_SECONDS = 0.5
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+def upload_size(upload):
+    """Size in bytes of an uploaded file object, without reading it."""
+    if hasattr(upload, '__len__'):
+        return len(upload)
+    if hasattr(upload, 'getvalue'):
+        # getvalue() shares an unmodified BytesIO's bytes; getbuffer() would copy them.
+        return len(upload.getvalue())
+    position = upload.tell()
+    upload.seek(0, os.SEEK_END)
+    size = upload.tell()
+    upload.seek(position)
+    return size
+
+
+def estimate_template_memory_mb(template_file):
+    """Rough peak memory (MB) to load and save ``template_file``."""
+    size = upload_size(template_file)
+    return max(MIN_JOB_MEMORY_MB, size * MEMORY_PER_TEMPLATE_BYTE / (1024 * 1024))
+
+
+class AdmissionLimiter:
+    def __init__(self, max_concurrent=2, memory_budget_mb=1024, timeout=300, retained_idle_seconds=900):
+        self.max_concurrent = max_concurrent
+        self.memory_budget_mb = memory_budget_mb
+        self.timeout = timeout
+        self.retained_idle_seconds = retained_idle_seconds
+        self._cond = threading.Condition()
+        self._queue = []
+        self._running = 0
+        self._memory_in_use = 0.0
+        # id(owner) -> (owner, cost_mb, release, last_used), least recently used first.
+        self._retained = OrderedDict()
+        self._memory_retained = 0.0
+        self.retained_released = 0
+        self._next_ticket = 0
+        self.admitted = 0
+        self.waited = 0
+        self.timed_out = 0
+        self.max_queue_length = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _release_retained(self, key):
+        _, cost_mb, release, _ = self._retained.pop(key)
+        self._memory_retained -= cost_mb
+        self.retained_released += 1
+        release()
+
+    def _release_idle(self):
+        cutoff = time.monotonic() - self.retained_idle_seconds
+        while self._retained and next(iter(self._retained.values()))[3] < cutoff:
+            self._release_retained(next(iter(self._retained)))
+
+    def _can_start(self, ticket, cost_mb):
+        if self._queue[0] != ticket or self._running >= self.max_concurrent:
+            return False
+        # Retained memory gives way to jobs, least recently used first.
+        while self._retained and self._memory_in_use + self._memory_retained + cost_mb > self.memory_budget_mb:
+            self._release_retained(next(iter(self._retained)))
+        # A job larger than the whole budget still runs, but only on its own.
+        return self._running == 0 or self._memory_in_use + cost_mb <= self.memory_budget_mb
+
+    @contextmanager
+    def admit(self, cost_mb=MIN_JOB_MEMORY_MB, on_wait=None):
+        """Hold a processing slot for the duration of the ``with`` block.
+
+        Jobs start in arrival order. While waiting, ``on_wait(position)`` is
+        called with the 1-based queue position whenever it changes.
+        Raises ``AdmissionTimeout`` after waiting ``timeout`` seconds.
+        """
+        started = time.monotonic()
+        with self._cond:
+            self._release_idle()
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._queue.append(ticket)
+            self.max_queue_length = max(self.max_queue_length, len(self._queue))
+            last_position = None
+            waited_in_queue = False
+            try:
+                while not self._can_start(ticket, cost_mb):
+                    position = self._queue.index(ticket) + 1
+                    waited_in_queue = True
+                    if on_wait is not None and position != last_position:
+                        last_position = position
+                        # Report outside the lock; UI callbacks may be slow.
+                        self._cond.release()
+                        try:
+                            on_wait(position)
+                        finally:
+                            self._cond.acquire()
+                        continue
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise AdmissionTimeout("Timed out waiting for a template processing slot")
+                    self._cond.wait(min(WAIT_POLL_SECONDS, remaining))
+            except BaseException:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._queue.pop(0)
+            self._running += 1
+            self._memory_in_use += cost_mb
+            waited = time.monotonic() - started
+            self.admitted += 1
+            self.waited += waited_in_queue
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self._cond.notify_all()
+        METRICS.observe('boq_admission_wait_seconds', waited)
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._memory_in_use -= cost_mb
+                self._cond.notify_all()
+
+    def retain(self, owner, cost_mb, release):
+        """Count ``cost_mb`` held by ``owner`` between jobs against the budget.
+
+        ``release()`` is called (under the limiter lock, so it must be
+        quick) when the memory is reclaimed; the owner then has to rebuild
+        its state on the next job. Registering again refreshes the entry.
+        """
+        with self._cond:
+            self._release_idle()
+            key = id(owner)
+            if key in self._retained:
+                self._memory_retained -= self._retained.pop(key)[1]
+            self._retained[key] = (owner, cost_mb, release, time.monotonic())
+            self._memory_retained += cost_mb
+
+    def forget(self, owner):
+        """Stop counting ``owner``'s retained memory without releasing it,
+        e.g. while it is used inside an admitted job or once it is discarded."""
+        with self._cond:
+            entry = self._retained.pop(id(owner), None)
+            if entry is not None:
+                self._memory_retained -= entry[1]
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'running': self._running,
+                'queue_length': len(self._queue),
+                'memory_in_use_mb': round(self._memory_in_use, 1),
+                'memory_retained_mb': round(self._memory_retained, 1),
+                'retained': len(self._retained),
+                'retained_released': self.retained_released,
+                'max_concurrent': self.max_concurrent,
+                'memory_budget_mb': self.memory_budget_mb,
+                'admitted': self.admitted,
+                'waited': self.waited,
+                'timed_out': self.timed_out,
+                'max_queue_length': self.max_queue_length,
+                'total_wait_seconds': round(self.total_wait_seconds, 3),
+                'avg_wait_seconds': round(self.total_wait_seconds / self.admitted, 3) if self.admitted else 0.0,
+                'max_wait_seconds': round(self.max_wait_seconds, 3),
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Process-wide limiter configured from the environment."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdmissionLimiter(
+                max_concurrent=int(os.environ.get("BOQ_MAX_CONCURRENT_TEMPLATES", 2)),
+                memory_budget_mb=float(os.environ.get("BOQ_TEMPLATE_MEMORY_BUDGET_MB", 1024)),
+                timeout=float(os.environ.get("BOQ_ADMISSION_TIMEOUT", 300)),
+                retained_idle_seconds=float(os.environ.get("BOQ_RETAINED_IDLE_SECONDS", 900)),
+            )
+            limiter = _limiter
+            METRICS.register_gauges(lambda: {
+                f"boq_admission_{key}": value for key, value in limiter.stats().items()
+            })
+        return _limiter
@@ -0,0 +1,225 @@
+"""Process-wide operational metrics for the BOQ generator.
+
+Metrics are kept in memory and can be exported in two optional ways:
+
+    BOQ_METRICS_PORT=9108           serve Prometheus text on http://127.0.0.1:9108/metrics
+    BOQ_METRICS_JSON=metrics.json   write a JSON snapshot every BOQ_METRICS_INTERVAL
+                                    seconds (default 60)
+
+Without either variable nothing is exported and recording stays cheap.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (10e3, 50e3, 100e3, 500e3, 1e6, 5e6, 10e6, 50e6)
+
+HELP = {
+    'boq_kml_parse_seconds': "KML parse, length measurement and summary latency by tab",
+    'boq_volume_calc_seconds': "Volume calculation latency by tab and sumber",
+    'boq_template_fill_seconds': "Template load and fill latency by tab and sumber",
+    'boq_template_save_seconds': "Workbook save latency by tab and sumber",
+    'boq_generate_total': "Generated BOQs by tab and sumber",
+    'boq_upload_bytes': "Upload sizes by kind",
+    'boq_cache_requests_total': "Cache lookups by cache and result",
+    'boq_admission_wait_seconds': "Time spent waiting for a template processing slot",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauge_callbacks = []
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_gauges(self, callback):
+        """``callback()`` returns ``{name: value}``, read at export time."""
+        with self._lock:
+            self._gauge_callbacks.append(callback)
+
+    def _gauges(self):
+        gauges = {}
+        for callback in list(self._gauge_callbacks):
+            try:
+                gauges.update(callback())
+            except Exception:
+                continue
+        return gauges
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {hist.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {hist.total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+        for name, value in sorted(self._gauges().items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-friendly view, including cache hit ratios."""
+        with self._lock:
+            counters = {
+                name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            histograms = {
+                name: [{
+                    'labels': dict(key),
+                    'count': hist.count,
+                    'sum': hist.total,
+                    'buckets': dict(zip([str(b) for b in hist.buckets] + ['+Inf'], hist.counts)),
+                } for key, hist in series.items()]
+                for name, series in self._histograms.items()
+            }
+            cache = {}
+            for key, value in self._counters.get('boq_cache_requests_total', {}).items():
+                labels = dict(key)
+                entry = cache.setdefault(labels.get('cache', ""), {'hit': 0, 'miss': 0})
+                entry[labels.get('result', 'miss')] += value
+        for entry in cache.values():
+            lookups = entry['hit'] + entry['miss']
+            entry['hit_ratio'] = entry['hit'] / lookups if lookups else 0.0
+        return {
+            'timestamp': time.time(),
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': self._gauges(),
+            'cache': cache,
+        }
+
+
+METRICS = MetricsRegistry()
+
+
+def record_cache(cache, hit):
+    METRICS.inc('boq_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def _serve_prometheus(port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = METRICS.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', "text/plain; version=0.0.4")
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="boq-metrics-http", daemon=True).start()
+    return server
+
+
+def _dump_json_forever(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(METRICS.snapshot(), f, indent=2, default=str)
+            os.replace(tmp_path, path)
+        except OSError:
+            continue
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters():
+    """Start the exporters configured in the environment, once per process."""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        port = os.environ.get("BOQ_METRICS_PORT")
+        if port:
+            try:
+                _serve_prometheus(int(port))
+            except OSError:
+                # Another process (e.g. a second worker) already owns the port.
+                pass
+        path = os.environ.get("BOQ_METRICS_JSON")
+        if path:
+            interval = float(os.environ.get("BOQ_METRICS_INTERVAL", 60))
+            threading.Thread(target=_dump_json_forever, args=(path, interval),
+                             name="boq-metrics-json", daemon=True).start()
@@ -0,0 +1,443 @@
+"""Local HTTP service around the BOQ generator.
+
+Lets other tools (ticketing, GIS portal) get BOQ numbers without going
+through the Streamlit UI. Run with::
+
+    python boq_service.py serve --port 8502 --workers 4
+
+Endpoints:
+    GET  /healthz                  -> {"status": "ok", ...}
+    POST /parse?mode=kml|adss&sumber=ODC&length=exact|fast
+                                   body: raw KML -> detected values (JSON)
+    POST /cost?mode=kml|adss       body: JSON inputs -> volume list (JSON)
+                                   or multipart (template, inputs, kml)
+                                   -> summary + updated items (JSON)
+    POST /generate?mode=kml|adss   multipart (template, inputs, kml)
+                                   -> BOQ xlsx, streamed in chunks
+
+Multipart fields: ``template`` (xlsx), ``kml`` (optional KML) and
+``inputs`` (JSON object with the same keys as the form). Work runs in a
+bounded worker pool; requests beyond ``workers + queue`` get a 503.
+
+A small load generator is included::
+
+    python boq_service.py bench --url http://127.0.0.1:8502/cost --requests 200 --concurrency 8
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+import app
+from boq_limiter import AdmissionTimeout, estimate_template_memory_mb, get_limiter
+from boq_metrics import METRICS
+from kml_geometry import LENGTH_MODES
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_INPUTS = {
+    'lop_name': "",
+    'sumber': "ODC",
+    'kabel_12': 0.0,
+    'kabel_24': 0.0,
+    'kabel_adss_12': 0.0,
+    'kabel_adss_24': 0.0,
+    'odp_8': 0,
+    'odp_16': 0,
+    'tiang_new': 0,
+    'tiang_existing': 0,
+    'tikungan': 0,
+    'izin': "",
+    'closure': 0,
+    'otb_12': 0,
+    'pu_as_hl': 0,
+    'pu_as_sc': 0,
+}
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+# Jobs are module-level functions taking plain bytes/dicts so they can run
+# in either a thread pool or a process pool.
+
+def parse_job(kml_bytes, mode, sumber, length_mode="exact"):
+    if mode == "adss":
+        return app.parse_kml_file_adss(BytesIO(kml_bytes), sumber, length_mode)
+    return app.parse_kml_file(BytesIO(kml_bytes), length_mode)
+
+
+def volumes_job(inputs, mode):
+    if mode == "adss":
+        return app.calculate_volumes_adss(inputs)
+    return app.calculate_volumes(inputs)
+
+
+def generate_job(template_bytes, kml_bytes, inputs, mode):
+    inputs = dict(inputs)
+    if kml_bytes:
+        kml_values = parse_job(kml_bytes, mode, inputs['sumber'])
+        if kml_values is None:
+            raise ServiceError(422, "KML could not be parsed")
+        inputs.update({k: v for k, v in kml_values.items() if k in DEFAULT_INPUTS})
+    template = BytesIO(template_bytes)
+    try:
+        # Same admission as app.process_boq_template, but a timeout becomes a 503.
+        with get_limiter().admit(estimate_template_memory_mb(template)):
+            result = app.fill_boq_template(template, inputs, inputs['lop_name'], adss_mode=(mode == "adss"))
+    except AdmissionTimeout:
+        raise ServiceError(503, "Template processing is busy, try again later")
+    if result is None:
+        raise ServiceError(422, "BOQ template could not be processed")
+    # Service generates never reach app.record_history, which counts the UI's.
+    METRICS.inc('boq_generate_total', tab=mode, sumber=inputs['sumber'])
+    return {
+        'excel_data': result['excel_data'].getvalue(),
+        'summary': result['summary'],
+        'updated_items': result['updated_items'],
+        'inputs': inputs,
+    }
+
+
+class WorkerPool:
+    """Bounded executor: ``workers`` running jobs plus ``queue`` waiting ones."""
+
+    def __init__(self, workers=4, queue=16, processes=False, timeout=120):
+        executor_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.executor = executor_cls(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.timeout = timeout
+        self.workers = workers
+        self.queue = queue
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ServiceError(503, "Server busy, try again later")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._finished()
+            raise
+        # The slot is freed when the job ends, not when the caller stops
+        # waiting, so timed-out jobs still count against workers + queue.
+        future.add_done_callback(lambda _: self._finished())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise ServiceError(504, "Job timed out")
+
+    def _finished(self):
+        with self._lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_multipart(content_type, body):
+    msg = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    if not msg.is_multipart():
+        raise ServiceError(400, "Expected multipart/form-data body")
+    fields = {}
+    for part in msg.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            fields[name] = part.get_payload(decode=True) or b""
+    return fields
+
+
+def _coerce(key, default, value):
+    if value is None:
+        return default
+    try:
+        if isinstance(default, int):
+            # Counts must be whole numbers; 3.7 is rejected rather than truncated.
+            number = float(value)
+            if not number.is_integer():
+                raise ServiceError(400, f"{key!r} must be a whole number")
+            return int(number)
+        return type(default)(value)
+    except (TypeError, ValueError):
+        raise ServiceError(400, f"Invalid value for {key!r}")
+
+
+def normalize_inputs(raw):
+    if not isinstance(raw, dict):
+        raise ServiceError(400, "inputs must be a JSON object")
+    inputs = dict(DEFAULT_INPUTS)
+    for key, default in DEFAULT_INPUTS.items():
+        if key in raw:
+            inputs[key] = _coerce(key, default, raw[key])
+    if inputs['sumber'] not in ("ODC", "ODP"):
+        raise ServiceError(400, "sumber must be ODC or ODP")
+    return inputs
+
+
+def make_handler(pool):
+    class BoqRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        server_version = "BOQService/1.0"
+
+        def log_message(self, format, *args):
+            if self.server.verbose:
+                super().log_message(format, *args)
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == "/healthz":
+                self.send_json(200, {
+                    'status': "ok",
+                    'workers': pool.workers,
+                    'queue': pool.queue,
+                    'in_flight': pool.in_flight,
+                    'rejected': pool.rejected,
+                    'template_limiter': get_limiter().stats(),
+                })
+            else:
+                self.send_json(404, {'error': "Not found"})
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            try:
+                body = self.read_body()
+                mode = query.get('mode', "kml")
+                if mode not in ("kml", "adss"):
+                    raise ServiceError(400, "mode must be kml or adss")
+                if url.path == "/parse":
+                    self.handle_parse(body, mode, query.get('sumber', "ODC"),
+                                      query.get('length', "exact"))
+                elif url.path == "/cost":
+                    self.handle_cost(body, mode)
+                elif url.path == "/generate":
+                    self.handle_generate(body, mode)
+                else:
+                    raise ServiceError(404, "Not found")
+            except ServiceError as e:
+                headers = {'Retry-After': "1"} if e.status == 503 else None
+                self.send_json(e.status, {'error': e.message}, headers)
+            except Exception as e:
+                self.send_json(500, {'error': str(e)})
+
+        def read_body(self):
+            # A body left unread would be parsed as the next request, so
+            # every rejection here also closes the connection.
+            if self.headers.get('Transfer-Encoding', "").lower() == "chunked":
+                self.close_connection = True
+                raise ServiceError(411, "Content-Length required")
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.close_connection = True
+                raise ServiceError(400, "Invalid Content-Length")
+            if length > self.server.max_upload:
+                self.close_connection = True
+                raise ServiceError(413, "Upload too large")
+            return self.rfile.read(length) if length else b""
+
+        def form_fields(self, body):
+            content_type = self.headers.get('Content-Type', "")
+            if not content_type.startswith("multipart/form-data"):
+                raise ServiceError(400, "Expected multipart/form-data body")
+            fields = parse_multipart(content_type, body)
+            if not fields.get('template'):
+                raise ServiceError(400, "Missing template field")
+            try:
+                raw_inputs = json.loads(fields.get('inputs') or b"{}")
+            except ValueError:
+                raise ServiceError(400, "inputs is not valid JSON")
+            return fields['template'], fields.get('kml'), normalize_inputs(raw_inputs)
+
+        def handle_parse(self, body, mode, sumber, length_mode):
+            if not body:
+                raise ServiceError(400, "Empty KML body")
+            if length_mode not in LENGTH_MODES:
+                raise ServiceError(400, "length must be exact or fast")
+            values = pool.run(parse_job, body, mode, sumber, length_mode)
+            if values is None:
+                raise ServiceError(422, "KML could not be parsed")
+            self.send_json(200, values)
+
+        def handle_cost(self, body, mode):
+            if self.headers.get('Content-Type', "").startswith("multipart/form-data"):
+                template, kml, inputs = self.form_fields(body)
+                result = pool.run(generate_job, template, kml, inputs, mode)
+                self.send_json(200, {
+                    'summary': result['summary'],
+                    'updated_items': result['updated_items'],
+                })
+                return
+            try:
+                raw = json.loads(body or b"{}")
+            except ValueError:
+                raise ServiceError(400, "Body is not valid JSON")
+            items = pool.run(volumes_job, normalize_inputs(raw), mode)
+            self.send_json(200, {'items': items})
+
+        def handle_generate(self, body, mode):
+            template, kml, inputs = self.form_fields(body)
+            result = pool.run(generate_job, template, kml, inputs, mode)
+            lop_name = result['inputs']['lop_name'] or "LOP"
+            self.send_response(200)
+            self.send_header('Content-Type', XLSX_MIME)
+            self.send_header('Content-Disposition', f'attachment; filename="BOQ-{lop_name}.xlsx"')
+            self.send_header('X-BOQ-Summary', json.dumps(result['summary']))
+            self.send_header('Transfer-Encoding', "chunked")
+            self.end_headers()
+            data = memoryview(result['excel_data'])
+            for start in range(0, len(data), CHUNK_SIZE):
+                chunk = data[start:start + CHUNK_SIZE]
+                self.wfile.write(f"{len(chunk):X}\r\n".encode())
+                self.wfile.write(chunk)
+                self.wfile.write(b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def send_json(self, status, payload, headers=None):
+            data = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', "application/json")
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return BoqRequestHandler
+
+
+def create_server(host="127.0.0.1", port=8502, workers=4, queue=16, processes=False,
+                  max_upload=50 * 1024 * 1024, verbose=False):
+    pool = WorkerPool(workers=workers, queue=queue, processes=processes)
+    server = ThreadingHTTPServer((host, port), make_handler(pool))
+    server.daemon_threads = True
+    server.pool = pool
+    server.max_upload = max_upload
+    server.verbose = verbose
+    return server
+
+
+def serve(args):
+    server = create_server(args.host, args.port, args.workers, args.queue,
+                           args.processes, args.max_upload_mb * 1024 * 1024, args.verbose)
+    print(f"BOQ service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+
+
+def bench(args):
+    """Fire ``requests`` POSTs at ``url`` from ``concurrency`` keep-alive clients."""
+    url = urlsplit(args.url)
+    body = b""
+    content_type = "application/json"
+    if args.body:
+        with open(args.body, "rb") as f:
+            body = f.read()
+        if args.body.lower().endswith(".kml"):
+            content_type = "application/vnd.google-earth.kml+xml"
+    elif url.path == "/cost":
+        body = json.dumps({'sumber': "ODC", 'kabel_12': 1200.0, 'odp_8': 6, 'odp_16': 2}).encode()
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def client():
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=120)
+        target = url.path + (f"?{url.query}" if url.query else "")
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            start = time.perf_counter()
+            try:
+                conn.request("POST", target, body=body, headers={'Content-Type': content_type})
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=120)
+                status = "error"
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    print(f"requests={len(latencies)} concurrency={args.concurrency} wall={wall:.2f}s "
+          f"rps={len(latencies) / wall:.1f}")
+    print(f"latency ms: p50={pct(50):.1f} p95={pct(95):.1f} p99={pct(99):.1f} max={latencies[-1] * 1000:.1f}")
+    print(f"status: {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BOQ generator HTTP service")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="run the HTTP service")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8502)
+    p_serve.add_argument("--workers", type=int, default=4)
+    p_serve.add_argument("--queue", type=int, default=16, help="jobs allowed to wait for a worker")
+    p_serve.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    p_serve.add_argument("--max-upload-mb", type=int, default=50)
+    p_serve.add_argument("--verbose", action="store_true")
+    p_serve.set_defaults(func=serve)
+
+    p_bench = sub.add_parser("bench", help="load-test a running service")
+    p_bench.add_argument("--url", default="http://127.0.0.1:8502/cost")
+    p_bench.add_argument("--body", help="file to POST (KML for /parse); defaults to sample JSON for /cost")
+    p_bench.add_argument("--requests", type=int, default=200)
+    p_bench.add_argument("--concurrency", type=int, default=8)
+    p_bench.set_defaults(func=bench)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Topology of the cable routes: shared segments and disconnected islands.
+
+Route vertices are snapped to a grid of ``tolerance`` meters, vertices of
+different routes within ``tolerance`` of each other are merged, and every
+segment is split at the vertices of other routes lying on it. A stretch
+drawn twice (an overlapping DIS NEW and ADSS line, or split lines whose
+ends overlap) then comes out as the same pair of end nodes even when the
+two lines put their vertices in different places, and a branch ending on
+the middle of a trunk segment shares a node with it. Unique pieces are
+joined with a vectorized union-find over the nodes to find the connected
+islands.
+"""
+import numpy as np
+
+from kml_geometry import planar_lengths, project_local
+from kml_network import CABLE_CLASSES
+from spatial_index import GridIndex, point_boxes, point_segment_distance, segment_boxes
+
+DEFAULT_SNAP_TOLERANCE = 1.0  # meter
+
+_KEY_OFFSET = 2 ** 31
+
+
+def _components(n_nodes, edges_a, edges_b):
+    """Component label (0..k-1) of every node.
+
+    Vectorized union-find: each round hooks the larger root of every edge
+    whose ends still differ onto the smaller one, then flattens the labels
+    by pointer jumping, until no edge joins two components.
+    """
+    label = np.arange(n_nodes)
+    while True:
+        root_a, root_b = label[edges_a], label[edges_b]
+        differ = root_a != root_b
+        if not differ.any():
+            break
+        root_a, root_b = root_a[differ], root_b[differ]
+        np.minimum.at(label, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        while True:
+            jumped = label[label]
+            if (jumped == label).all():
+                break
+            label = jumped
+    return np.unique(label, return_inverse=True)[1].ravel()
+
+
+def build_topology(features, tolerance=DEFAULT_SNAP_TOLERANCE, classes=CABLE_CLASSES):
+    """Shared segments and islands of the cable routes in ``classes``.
+
+    Segments are counted after splitting. A piece drawn more than once is
+    kept for the route listed first and its other copies count as
+    duplicated length, per cable class in
+    ``duplicated_by_class``. Returns ``{'tolerance', 'routes', 'segments',
+    'unique_segments', 'total_length', 'duplicated_length',
+    'duplicated_by_class', 'overlaps': [...], 'islands': [...]}``.
+    """
+    routes = [f for f in features if f['kind'] == 'line' and f['cls'] in classes and len(f['coords']) > 1]
+    result = {
+        'tolerance': tolerance,
+        'routes': len(routes),
+        'segments': 0,
+        'unique_segments': 0,
+        'total_length': 0.0,
+        'duplicated_length': 0.0,
+        'duplicated_by_class': {},
+        'overlaps': [],
+        'islands': [],
+    }
+    if not routes:
+        return result
+
+    lonlat = np.concatenate([f['coords'][:, :2] for f in routes])
+    sizes = np.array([len(f['coords']) for f in routes])
+    vertex_route = np.repeat(np.arange(len(routes)), sizes)
+    xy, _ = project_local(lonlat)
+    grid = np.round(xy / tolerance).astype(np.int64)
+    _, node_of = np.unique(grid[:, 0] * (2 ** 32) + (grid[:, 1] + _KEY_OFFSET), return_inverse=True)
+    node_of = node_of.ravel()
+    n_nodes = int(node_of.max()) + 1
+
+    # Vertices of different routes within tolerance are one node, even across grid cells.
+    index = GridIndex(point_boxes(xy), 2 * tolerance)
+    p, q = index.candidates(xy, tolerance)
+    near = (p < q) & (vertex_route[p] != vertex_route[q]) & (node_of[p] != node_of[q])
+    p, q = p[near], q[near]
+    near = np.hypot(*(xy[p] - xy[q]).T) <= tolerance
+    if near.any():
+        pairs = np.concatenate([node_of[p[near]], node_of[q[near]]])
+        involved, local = np.unique(pairs, return_inverse=True)
+        group = _components(len(involved), *local.ravel().reshape(2, -1))
+        representative = np.full(group.max() + 1, n_nodes)
+        np.minimum.at(representative, group, involved)
+        merged = np.arange(n_nodes)
+        merged[involved] = representative[group]
+        _, node_of = np.unique(merged[node_of], return_inverse=True)
+        node_of = node_of.ravel()
+        n_nodes = int(node_of.max()) + 1
+
+    # Segments join consecutive vertices of the same route; snapping may collapse some.
+    within_route = np.ones(len(lonlat) - 1, dtype=bool)
+    within_route[np.cumsum(sizes)[:-1] - 1] = False
+    first = np.flatnonzero(within_route)
+    seg_route = np.repeat(np.arange(len(routes)), sizes - 1)
+    a, b = node_of[first], node_of[first + 1]
+    keep = a != b
+    first, seg_route, a, b = first[keep], seg_route[keep], a[keep], b[keep]
+    seg_lengths = planar_lengths(lonlat[first], lonlat[first + 1])
+
+    # Split every segment at the vertices of other routes lying on it.
+    starts, ends = xy[first], xy[first + 1]
+    cell = max(tolerance, float(np.median(np.hypot(*(ends - starts).T)))) if len(first) else tolerance
+    vertex, seg = GridIndex(segment_boxes(starts, ends), cell).candidates(xy, tolerance)
+    other = (vertex_route[vertex] != seg_route[seg]) & (node_of[vertex] != a[seg]) & (node_of[vertex] != b[seg])
+    vertex, seg = vertex[other], seg[other]
+    dist, t = point_segment_distance(xy[vertex], starts[seg], ends[seg])
+    inside = (dist <= tolerance) & (t > 0) & (t < 1)
+    vertex, seg, t = vertex[inside], seg[inside], t[inside]
+
+    n_segments = len(first)
+    cut_seg = np.concatenate([np.arange(n_segments), seg, np.arange(n_segments)])
+    cut_t = np.concatenate([np.zeros(n_segments), t, np.ones(n_segments)])
+    cut_node = np.concatenate([a, node_of[vertex], b])
+    order = np.lexsort((cut_t, cut_seg))
+    cut_seg, cut_t, cut_node = cut_seg[order], cut_t[order], cut_node[order]
+    piece = (cut_seg[:-1] == cut_seg[1:]) & (cut_node[:-1] != cut_node[1:])
+    owner = cut_seg[:-1][piece]
+    a, b = cut_node[:-1][piece], cut_node[1:][piece]
+    lengths = seg_lengths[owner] * (cut_t[1:][piece] - cut_t[:-1][piece])
+    seg_route = seg_route[owner]
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+
+    keys, first_copy, inverse = np.unique(lo * n_nodes + hi, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    duplicate = np.ones(len(lo), dtype=bool)
+    duplicate[first_copy] = False
+    result['segments'] = len(lo)
+    result['unique_segments'] = len(keys)
+    result['total_length'] = float(lengths.sum())
+    result['duplicated_length'] = float(lengths[duplicate].sum())
+
+    route_cls = np.array([CABLE_CLASSES.index(f['cls']) for f in routes])
+    by_class = np.bincount(route_cls[seg_route[duplicate]], weights=lengths[duplicate], minlength=len(CABLE_CLASSES))
+    result['duplicated_by_class'] = {cls: float(m) for cls, m in zip(CABLE_CLASSES, by_class) if m > 0}
+
+    # Overlaps grouped by (route that keeps the segment, route that repeats it).
+    owner = seg_route[first_copy][inverse]
+    pairs, pair_inverse = np.unique(owner[duplicate] * len(routes) + seg_route[duplicate], return_inverse=True)
+    pair_length = np.bincount(pair_inverse.ravel(), weights=lengths[duplicate])
+    pair_count = np.bincount(pair_inverse.ravel())
+    for pair, length, count in zip(pairs.tolist(), pair_length.tolist(), pair_count.tolist()):
+        route_a, route_b = routes[pair // len(routes)], routes[pair % len(routes)]
+        result['overlaps'].append({
+            'route_a': route_a['name'],
+            'route_b': route_b['name'],
+            'cls_b': route_b['cls'],
+            'segments': count,
+            'length': length,
+        })
+    result['overlaps'].sort(key=lambda o: -o['length'])
+
+    component = _components(n_nodes, lo[first_copy], hi[first_copy])
+    # Nodes left without segments form empty components; renumber the rest.
+    _, island_of = np.unique(component[lo[first_copy]], return_inverse=True)
+    island_of = island_of.ravel()
+    island_length = np.bincount(island_of, weights=lengths[first_copy])
+    island_segments = np.bincount(island_of)
+    island_routes = {}
+    members = np.unique(island_of[inverse] * len(routes) + seg_route)
+    for island, route in zip((members // len(routes)).tolist(), (members % len(routes)).tolist()):
+        island_routes.setdefault(island, []).append(routes[route]['name'])
+    order = np.argsort(-island_length, kind='stable')
+    for number, island in enumerate(order.tolist(), start=1):
+        result['islands'].append({
+            'island': number,
+            'segments': int(island_segments[island]),
+            'length': float(island_length[island]),
+            'routes': ", ".join(dict.fromkeys(island_routes[island])),
+        })
+    return result
+
+
+def count_shared_once(values, topology):
+    """Take the duplicated length of each cable class off ``values``."""
+    for cls, length in topology['duplicated_by_class'].items():
+        if cls in values:
+            values[cls] = max(values[cls] - length, 0.0)
+    return values
@@ -0,0 +1,106 @@
+"""Compare two revisions of a LOP network placemark by placemark."""
+import numpy as np
+
+from kml_geometry import cable_lengths, geodesic_lengths
+from kml_network import CABLE_CLASSES, feature_key
+
+# Placemarks that moved less than this are reported as unchanged (meter).
+MOVE_TOLERANCE = 0.5
+
+
+def _line_length(feature):
+    if 'length' not in feature:
+        lengths, _ = cable_lengths([feature['coords']])
+        feature['length'] = float(lengths[0])
+    return feature['length']
+
+
+def diff_features(old_features, new_features):
+    """Match the features of two revisions and list what changed.
+
+    Features are matched by hashed identity (class, name and rounded
+    coordinates) through a dict, then the leftovers are paired by class and
+    name, so the whole diff is linear in the number of placemarks. Paired
+    points are reported as ``moved`` and paired cables as ``rerouted``;
+    everything else is ``added`` or ``removed``.
+
+    Returns ``{'changes': [...], 'unchanged': n, 'counts': {cls: {...}},
+    'cable_lengths': {cls: {'old', 'new', 'delta'}}}``.
+    """
+    by_key = {}
+    for feature in old_features:
+        by_key.setdefault(feature_key(feature), []).append(feature)
+
+    unchanged = 0
+    unmatched_new = []
+    for feature in new_features:
+        same = by_key.get(feature_key(feature))
+        if same:
+            same.pop()
+            unchanged += 1
+        else:
+            unmatched_new.append(feature)
+
+    by_name = {}
+    for features in by_key.values():
+        for feature in features:
+            by_name.setdefault((feature['kind'], feature['cls'], feature['name']), []).append(feature)
+    for features in by_name.values():
+        features.reverse()  # pop() from the end pairs them in document order
+
+    pairs = []
+    added = []
+    for feature in unmatched_new:
+        candidates = by_name.get((feature['kind'], feature['cls'], feature['name']))
+        if candidates:
+            pairs.append((candidates.pop(), feature))
+        else:
+            added.append(feature)
+    removed = [feature for features in by_name.values() for feature in reversed(features)]
+
+    changes = []
+    point_pairs = [(a, b) for a, b in pairs if a['kind'] == 'point' and len(a['coords']) and len(b['coords'])]
+    unchanged += sum(1 for a, b in pairs if a['kind'] == 'point') - len(point_pairs)
+    if point_pairs:
+        distances = geodesic_lengths(
+            np.array([a['coords'][0, :2] for a, _ in point_pairs]),
+            np.array([b['coords'][0, :2] for _, b in point_pairs]),
+        )
+    else:
+        distances = []
+    for (old, new), distance in zip(point_pairs, distances):
+        if distance < MOVE_TOLERANCE:
+            unchanged += 1
+            continue
+        changes.append({'change': 'moved', 'kind': 'point', 'cls': new['cls'], 'name': new['name'],
+                        'distance': float(distance), 'length_old': None, 'length_new': None})
+    for old, new in pairs:
+        if old['kind'] != 'line':
+            continue
+        changes.append({'change': 'rerouted', 'kind': 'line', 'cls': new['cls'], 'name': new['name'],
+                        'distance': None, 'length_old': _line_length(old), 'length_new': _line_length(new)})
+    for change, features in (('added', added), ('removed', removed)):
+        for feature in features:
+            length = _line_length(feature) if feature['kind'] == 'line' else None
+            changes.append({
+                'change': change, 'kind': feature['kind'], 'cls': feature['cls'], 'name': feature['name'],
+                'distance': None,
+                'length_old': length if change == 'removed' else None,
+                'length_new': length if change == 'added' else None,
+            })
+
+    counts = {}
+    for change in changes:
+        entry = counts.setdefault(change['cls'], {'added': 0, 'removed': 0, 'moved': 0, 'rerouted': 0})
+        entry[change['change']] += 1
+
+    totals = {}
+    for side, features in (('old', old_features), ('new', new_features)):
+        for feature in features:
+            if feature['kind'] == 'line' and feature['cls'] in CABLE_CLASSES:
+                entry = totals.setdefault(feature['cls'], {'old': 0.0, 'new': 0.0})
+                entry[side] += _line_length(feature)
+    for entry in totals.values():
+        entry['delta'] = entry['new'] - entry['old']
+
+    return {'changes': changes, 'unchanged': unchanged, 'counts': counts, 'cable_lengths': totals}
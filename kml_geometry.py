@@ -0,0 +1,175 @@
+"""Geometry helpers for the KML parsers (coordinate decoding, lengths)."""
+import re
+
+import numpy as np
+from geopy.distance import geodesic
+
+_COMMA_WS = re.compile(r'\s*,\s*')
+
+
+def decode_coordinates(text):
+    """Decode a KML ``<coordinates>`` string into a float array.
+
+    Returns ``(coords, invalid)``: ``coords`` is an (N, 2) array of lon/lat,
+    or (N, 3) when every tuple carries an altitude; ``invalid`` lists
+    ``(index, token)`` for tuples that could not be decoded and were left out.
+    Whitespace around commas is tolerated.
+    """
+    if not text:
+        return np.empty((0, 2)), []
+    normalized = _COMMA_WS.sub(',', text.strip())
+    tokens = normalized.split()
+    if not tokens:
+        return np.empty((0, 2)), []
+
+    # Fast path: every tuple has the same arity, decode in one shot.
+    commas = tokens[0].count(',')
+    if commas in (1, 2) and all(t.count(',') == commas for t in tokens):
+        try:
+            coords = np.array(normalized.replace(',', ' ').split(), dtype=np.float64)
+        except ValueError:
+            pass
+        else:
+            # An empty component ('100,,1') leaves the count short; report it below.
+            if coords.size == len(tokens) * (commas + 1):
+                coords = coords.reshape(len(tokens), commas + 1)
+                if np.isfinite(coords).all():
+                    return coords, []
+
+    # Slow path: decode tuple by tuple so bad ones can be reported.
+    rows = []
+    invalid = []
+    for index, token in enumerate(tokens):
+        parts = token.split(',')
+        if len(parts) not in (2, 3):
+            invalid.append((index, token))
+            continue
+        try:
+            row = [float(p) for p in parts]
+        except ValueError:
+            invalid.append((index, token))
+            continue
+        if not all(np.isfinite(row)):
+            invalid.append((index, token))
+            continue
+        rows.append(row)
+
+    if not rows:
+        return np.empty((0, 2)), invalid
+    if all(len(r) == 3 for r in rows):
+        return np.array(rows, dtype=np.float64), invalid
+    return np.array([r[:2] for r in rows], dtype=np.float64), invalid
+
+
+LENGTH_MODES = ("exact", "fast")
+
+# WGS84 ellipsoid, used for the local radii of curvature in fast mode.
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+# Segments checked against the exact geodesic to estimate the fast-mode error;
+# the estimate is the worst error on this sample, not a bound over all segments.
+ERROR_SAMPLE_SIZE = 64
+
+
+def _line_segments(lines):
+    """Flatten lon/lat lines into segment start/end arrays plus owning line index."""
+    parts = [np.asarray(line, dtype=np.float64)[:, :2] for line in lines if len(line) > 1]
+    owners = [i for i, line in enumerate(lines) if len(line) > 1]
+    if not parts:
+        empty = np.empty((0, 2))
+        return empty, empty, np.empty(0, dtype=np.intp)
+    starts = np.concatenate([p[:-1] for p in parts])
+    ends = np.concatenate([p[1:] for p in parts])
+    line_ids = np.repeat(owners, [len(p) - 1 for p in parts])
+    return starts, ends, line_ids
+
+
+def planar_lengths(starts, ends):
+    """Segment lengths in meters on a local equirectangular projection.
+
+    Each segment uses the ellipsoid's meridional and prime-vertical radii at
+    its mid latitude, which is accurate to well under 0.1% for the short
+    spans found in distribution designs.
+    """
+    lon1, lat1 = np.radians(starts[:, 0]), np.radians(starts[:, 1])
+    lon2, lat2 = np.radians(ends[:, 0]), np.radians(ends[:, 1])
+    phi = (lat1 + lat2) / 2
+    w = 1 - WGS84_E2 * np.sin(phi) ** 2
+    meridional = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    prime_vertical = WGS84_A / np.sqrt(w)
+    dlon = (lon2 - lon1 + np.pi) % (2 * np.pi) - np.pi
+    dx = dlon * prime_vertical * np.cos(phi)
+    dy = (lat2 - lat1) * meridional
+    return np.hypot(dx, dy)
+
+
+def geodesic_lengths(starts, ends):
+    """Exact ellipsoidal segment lengths in meters (geopy geodesic)."""
+    return np.array([
+        geodesic((lat1, lon1), (lat2, lon2)).meters
+        for (lon1, lat1), (lon2, lat2) in zip(starts.tolist(), ends.tolist())
+    ], dtype=np.float64)
+
+
+def _sampled_relative_error(starts, ends, fast):
+    """Worst fast-vs-exact relative error over a sample of the segments
+    (the longest ones plus an even spread of the rest)."""
+    if not len(fast):
+        return 0.0
+    half = ERROR_SAMPLE_SIZE // 2
+    longest = np.argsort(fast)[-half:]
+    spread = np.linspace(0, len(fast) - 1, num=min(half, len(fast)), dtype=np.intp)
+    sample = np.unique(np.concatenate([longest, spread]))
+    exact = geodesic_lengths(starts[sample], ends[sample])
+    nonzero = exact > 0
+    if not nonzero.any():
+        return 0.0
+    return float(np.max(np.abs(fast[sample][nonzero] - exact[nonzero]) / exact[nonzero]))
+
+
+def cable_lengths(lines, mode="exact", exact_lengths=geodesic_lengths):
+    """Lengths in meters of a list of lon/lat coordinate arrays.
+
+    ``mode`` is ``"exact"`` (ellipsoidal geodesic per segment) or ``"fast"``
+    (all segments in one vectorized planar pass). Returns ``(lengths,
+    max_rel_error)``; the error is 0 for exact mode and, for fast mode, a
+    sampled estimate: the worst relative error against the exact geodesic
+    over ``ERROR_SAMPLE_SIZE`` segments that always include the longest of
+    the file. Segments outside the sample may be off by more. ``exact_lengths``
+    measures the segments in exact mode (e.g. through a memo).
+    """
+    if mode not in LENGTH_MODES:
+        raise ValueError(f"Unknown length mode: {mode}")
+    starts, ends, line_ids = _line_segments(lines)
+    if mode == "fast":
+        segments = planar_lengths(starts, ends)
+        max_rel_error = _sampled_relative_error(starts, ends, segments)
+    else:
+        segments = exact_lengths(starts, ends)
+        max_rel_error = 0.0
+    lengths = np.bincount(line_ids, weights=segments, minlength=len(lines))
+    return lengths, max_rel_error
+
+
+def project_local(lonlat, origin=None):
+    """Project lon/lat onto a local tangent plane in meters.
+
+    Uses the WGS84 radii of curvature at ``origin`` (lon, lat), which
+    defaults to the centre of ``lonlat``. Good to a fraction of a meter
+    over a few kilometers, i.e. the extent of a single LOP.
+    Returns ``(xy, origin)``.
+    """
+    lonlat = np.asarray(lonlat, dtype=np.float64).reshape(-1, 2)
+    if origin is None:
+        origin = (lonlat.min(axis=0) + lonlat.max(axis=0)) / 2 if len(lonlat) else np.zeros(2)
+    lon0, lat0 = origin
+    phi = np.radians(lat0)
+    w = 1 - WGS84_E2 * np.sin(phi) ** 2
+    meridional = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    prime_vertical = WGS84_A / np.sqrt(w)
+    xy = np.empty_like(lonlat)
+    xy[:, 0] = np.radians(lonlat[:, 0] - lon0) * prime_vertical * np.cos(phi)
+    xy[:, 1] = np.radians(lonlat[:, 1] - lat0) * meridional
+    return xy, np.asarray(origin, dtype=np.float64)
@@ -0,0 +1,482 @@
+"""Classified network features extracted from a KML design.
+
+The KML parsers work in two steps: ``extract_features`` turns the
+placemarks into a flat list of classified features (poles, ODPs, OTBs,
+closures, homepasses and cable routes with their coordinates), and
+``summarize_features`` turns such a list into the values the BOQ forms
+use. Keeping the features around lets several files be merged, compared
+or cached without going back to the XML.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import numpy as np
+
+from kml_geometry import cable_lengths, decode_coordinates, geodesic_lengths
+from length_memo import get_length_memo
+from upload_buffer import UploadBuffer
+
+KML_NS = {'kml': 'http://www.opengis.net/kml/2.2'}
+GX_NS = 'http://www.google.com/kml/ext/2.2'
+
+POINT_CLASSES = ('tiang_new', 'tiang_existing', 'odp_8', 'odp_16', 'otb_12', 'closure')
+CABLE_CLASSES = ('kabel_12', 'kabel_adss_12', 'kabel_adss_24')
+POLE_CLASSES = ('tiang_new', 'tiang_existing')
+HOMEPASS_CLASS = 'homepass'
+HOMEPASS_RE = re.compile(r"(?:HP|HOME ?PASS)(?![A-Z])")
+
+# Coordinates are rounded to this many decimals (~0.1 m) for identity keys.
+KEY_DECIMALS = 6
+
+
+class KMLParseError(ValueError):
+    pass
+
+
+def classify_point(name, desc, adss=False):
+    """Return the point class for a placemark name/description, or None."""
+    # The ADSS parser matches ODP descriptions against the upper-cased text.
+    desc = desc.upper() if adss else desc
+    # Homepass names would otherwise match the looser pole/closure keywords.
+    if HOMEPASS_RE.match(name):
+        return HOMEPASS_CLASS
+    if any(keyword in name for keyword in ["TN", "TN7", "TIANG NEW"]):
+        return 'tiang_new'
+    if any(keyword in name for keyword in ["TE", "TIANG EXISTING"]):
+        return 'tiang_existing'
+    if "ODP" in name and any(keyword in name for keyword in ["NEW", "BARU"]):
+        if "8" in name or "ODP Solid-PB-8 AS" in desc:
+            return 'odp_8'
+        if "16" in name or "ODP Solid-PB-16 AS" in desc:
+            return 'odp_16'
+        return None
+    if "OTB" in name and any(keyword in name for keyword in ["NEW", "BARU"]):
+        return 'otb_12'
+    if any(keyword in name for keyword in ["CL", "CLOSURE"]):
+        return 'closure'
+    return None
+
+
+def classify_line(name):
+    """Return the cable class for a LineString placemark name, or None."""
+    if any(keyword in name for keyword in ["DIS NEW", "DISTRIBUSI", "AC-OF-SM-12"]):
+        return 'kabel_12'
+    if "AC-OF-SM-ADSS-12D" in name:
+        return 'kabel_adss_12'
+    if "AC-OF-SM-ADSS-24D" in name:
+        return 'kabel_adss_24'
+    return None
+
+
+def pu_as_type(desc):
+    """PU-AS fitting named in a pole description: 'HL', 'SC' or None."""
+    desc = desc.upper()
+    if "PU-AS-HL" in desc:
+        return 'HL'
+    if "PU-AS" in desc:
+        return 'SC'
+    return None
+
+
+def _decode(text, name, warnings):
+    coords, invalid = decode_coordinates(text)
+    if invalid:
+        shown = ", ".join(f"#{index + 1} '{token}'" for index, token in invalid[:3])
+        more = f" (+{len(invalid) - 3} lainnya)" if len(invalid) > 3 else ""
+        warnings.append(f"Koordinat tidak valid pada '{name}' dilewati: {shown}{more}")
+    return coords[:, :2]
+
+
+def _tag(name, ns=KML_NS['kml']):
+    return f"{{{ns}}}{name}"
+
+
+PLACEMARK_TAG = _tag('Placemark')
+NAME_TAG = _tag('name')
+DESCRIPTION_TAG = _tag('description')
+POINT_TAG = _tag('Point')
+LINESTRING_TAG = _tag('LineString')
+COORDINATES_TAG = _tag('coordinates')
+TRACK_TAGS = (_tag('Track'), _tag('Track', GX_NS))
+TRACK_COORD_TAG = _tag('coord', GX_NS)
+
+
+def walk_geometry(placemark):
+    """Collect a placemark's geometry in one traversal of its subtree.
+
+    Returns ``(points, lines)`` as lists of coordinate texts. Every Point
+    and LineString is found, including those nested in MultiGeometry, and
+    each gx:Track becomes one line.
+    """
+    points = []
+    lines = []
+    for elem in placemark.iter():
+        tag = elem.tag
+        if tag == POINT_TAG or tag == LINESTRING_TAG:
+            coords_elem = elem.find(COORDINATES_TAG)
+            text = coords_elem.text if coords_elem is not None else None
+            if tag == POINT_TAG:
+                # A Point still counts (e.g. as a pole) without coordinates.
+                points.append(text or "")
+            elif text:
+                lines.append(text)
+        elif tag in TRACK_TAGS:
+            # gx:coord holds "lon lat alt"; rewrite as a coordinates tuple list.
+            text = " ".join(",".join(c.text.split()) for c in elem.iter(TRACK_COORD_TAG) if c.text)
+            if text:
+                lines.append(text)
+    return points, lines
+
+
+def extract_features(root, adss=False):
+    """Classify the placemarks under ``root``.
+
+    Returns ``(features, warnings)``. Each feature is a dict with ``kind``
+    ('point' or 'line'), ``cls``, ``name``, ``coords`` (lon/lat array) and,
+    for poles, ``pu_as``. A cable drawn as several LineStrings (e.g. a
+    MultiGeometry) yields one line feature per part. Placemarks that match
+    no class are left out.
+    """
+    features = []
+    warnings = []
+    for placemark in root.iter(PLACEMARK_TAG):
+        name = desc = ""
+        for child in placemark:
+            if child.tag == NAME_TAG and child.text:
+                name = child.text.upper().strip()
+            elif child.tag == DESCRIPTION_TAG and child.text:
+                desc = child.text.strip()
+
+        points, lines = walk_geometry(placemark)
+        if points:
+            cls = classify_point(name, desc, adss)
+            if cls is None:
+                continue
+            feature = {
+                'kind': 'point',
+                'cls': cls,
+                'name': name,
+                'coords': _decode(points[0], name, warnings)[:1],
+            }
+            if cls in POLE_CLASSES:
+                feature['pu_as'] = pu_as_type(desc)
+            features.append(feature)
+
+        elif lines:
+            cls = classify_line(name)
+            if cls is None:
+                continue
+            for text in lines:
+                features.append({
+                    'kind': 'line',
+                    'cls': cls,
+                    'name': name,
+                    'coords': _decode(text, name, warnings),
+                })
+    return features, warnings
+
+
+def parse_kml_bytes(kml_data, adss=False):
+    """Parse raw KML bytes into ``(features, warnings)``.
+
+    Raises ``KMLParseError`` for empty or malformed files.
+    """
+    if not kml_data:
+        raise KMLParseError("KML file is empty")
+    try:
+        root = ET.fromstring(kml_data)
+    except ET.ParseError as e:
+        raise KMLParseError(f"Invalid KML format: {str(e)}")
+    return extract_features(root, adss)
+
+
+def summarize_features(features, adss=False, sumber="ODC", length_mode="exact"):
+    """Aggregate classified features into the values used by the BOQ forms."""
+    values = {
+        'tiang_new': 0,
+        'tiang_existing': 0,
+        'kabel_12': 0.0,
+        'kabel_24': 0.0,
+        'odp_8': 0,
+        'odp_16': 0,
+        'closure': 0,
+        'otb_12': 0,
+        HOMEPASS_CLASS: 0
+    }
+    cable_keys = ('kabel_12',)
+    if adss:
+        values.update({
+            'total_tiang': 0,
+            'kabel_adss_12': 0.0,
+            'kabel_adss_24': 0.0,
+            'pu_as_hl_count': 0,  # Jumlah marker dengan deskripsi PU-AS-HL
+            'pu_as_sc_count': 0,  # Jumlah marker dengan deskripsi PU-AS atau PU-AS-SC
+            'pu_as_hl': 0,       # Volume akhir PU-AS-HL
+            'pu_as_sc': 0        # Volume akhir PU-AS-SC
+        })
+        cable_keys = CABLE_CLASSES
+
+    cable_lines = {key: [] for key in cable_keys}
+    for feature in features:
+        cls = feature['cls']
+        if feature['kind'] == 'point':
+            values[cls] += 1
+            if adss and cls in POLE_CLASSES:
+                values['total_tiang'] += 1
+                if feature.get('pu_as') == 'HL':
+                    values['pu_as_hl_count'] += 1
+                elif feature.get('pu_as') == 'SC':
+                    values['pu_as_sc_count'] += 1
+        elif cls in cable_lines:
+            cable_lines[cls].append(feature)
+
+    add_cable_lengths(values, cable_lines, length_mode)
+
+    if adss:
+        # Calculate PU-AS-HL based on source
+        if sumber == "ODC":
+            values['pu_as_hl'] = (values['pu_as_hl_count'] * 2) - 1
+        else:  # ODP
+            values['pu_as_hl'] = (values['pu_as_hl_count'] * 2) - 2 if values['pu_as_hl_count'] > 0 else 0
+
+        # Calculate PU-AS-SC volume (total poles minus PU-AS-HL count)
+        values['pu_as_sc'] = values['total_tiang'] - values['pu_as_hl_count']
+
+        # Ensure non-negative values
+        values['pu_as_hl'] = max(values['pu_as_hl'], 0)
+        values['pu_as_sc'] = max(values['pu_as_sc'], 0)
+    return values
+
+
+def add_cable_lengths(values, cable_lines, length_mode):
+    """Add the total length of each cable category to ``values``.
+
+    ``cable_lines`` maps a values key (e.g. ``kabel_12``) to its list of
+    line features; all lines are measured in one batch. Exact lengths are
+    kept on the features so later summaries (per file, merged, snapshot)
+    do not measure the same line again. With the length memo enabled, exact
+    segment lengths are looked up there first and the hits are reported in
+    ``length_memo_hits`` out of ``length_memo_segments``.
+    """
+    pending = []
+    for key, features in cable_lines.items():
+        for feature in features:
+            if length_mode == "exact" and feature.get('length') is not None:
+                values[key] += feature['length']
+            else:
+                pending.append((key, feature))
+    memo = get_length_memo()
+    values['length_memo_segments'] = values['length_memo_hits'] = 0
+
+    def memo_lengths(starts, ends):
+        lengths, hits = memo.lengths(starts, ends, geodesic_lengths)
+        values['length_memo_segments'] += len(lengths)
+        values['length_memo_hits'] += hits
+        return lengths
+
+    lengths, max_rel_error = cable_lengths(
+        [f['coords'] for _, f in pending], length_mode,
+        exact_lengths=memo_lengths if memo is not None else geodesic_lengths,
+    )
+    for (key, feature), length in zip(pending, lengths.tolist()):
+        values[key] += length
+        if length_mode == "exact":
+            feature['length'] = length
+    values['length_mode'] = length_mode
+    values['length_max_rel_error'] = max_rel_error
+
+
+SNAPSHOT_VERSION = 1
+# New classes go at the end so older snapshots keep their class codes.
+SNAPSHOT_CLASSES = POINT_CLASSES + CABLE_CLASSES + (HOMEPASS_CLASS,)
+PU_AS_CODES = (None, 'HL', 'SC')
+
+
+def save_snapshot(features, adss=False):
+    """Serialize classified features into a compact binary snapshot.
+
+    The snapshot is a compressed NumPy archive holding per-feature kind,
+    class and PU-AS codes, the names, all coordinates in one array with
+    offsets, and exact cable lengths, so it can be summarized again
+    without the KML or any geodesic computation. Lines parsed in fast mode
+    are measured here, through the length memo when it is enabled.
+    """
+    lines = [f['coords'] for f in features if f['kind'] == 'line' and f.get('length') is None]
+    memo = get_length_memo()
+    exact_lengths = geodesic_lengths if memo is None else (lambda s, e: memo.lengths(s, e, geodesic_lengths)[0])
+    measured = iter(cable_lengths(lines, "exact", exact_lengths=exact_lengths)[0].tolist())
+    lengths = np.zeros(len(features))
+    for i, feature in enumerate(features):
+        if feature['kind'] == 'line':
+            length = feature.get('length')
+            lengths[i] = next(measured) if length is None else length
+
+    coords = [np.asarray(f['coords'], dtype=np.float64).reshape(-1, 2) for f in features]
+    offsets = np.zeros(len(features) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(c) for c in coords])
+    meta = {'version': SNAPSHOT_VERSION, 'adss': adss}
+
+    buffer = BytesIO()
+    np.savez_compressed(
+        buffer,
+        meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+        kind=np.array([f['kind'] == 'line' for f in features], dtype=np.uint8),
+        cls=np.array([SNAPSHOT_CLASSES.index(f['cls']) for f in features], dtype=np.uint8),
+        pu_as=np.array([PU_AS_CODES.index(f.get('pu_as')) for f in features], dtype=np.uint8),
+        names=np.frombuffer("\0".join(f['name'] for f in features).encode(), dtype=np.uint8),
+        offsets=offsets,
+        coords=np.concatenate(coords) if coords else np.empty((0, 2)),
+        lengths=lengths,
+    )
+    return buffer.getvalue()
+
+
+def load_snapshot(data):
+    """Load features saved by ``save_snapshot``.
+
+    Returns ``(features, meta)``; raises ``KMLParseError`` if ``data`` is
+    not a readable snapshot.
+    """
+    try:
+        with np.load(BytesIO(data), allow_pickle=False) as archive:
+            arrays = {key: archive[key] for key in archive.files}
+        meta = json.loads(arrays['meta'].tobytes())
+    except Exception as e:
+        raise KMLParseError(f"Invalid network snapshot: {str(e)}")
+    if meta.get('version') != SNAPSHOT_VERSION:
+        raise KMLParseError(f"Unsupported network snapshot version: {meta.get('version')}")
+
+    count = len(arrays['kind'])
+    names = arrays['names'].tobytes().decode().split("\0") if count else []
+    offsets = arrays['offsets']
+    features = []
+    for i in range(count):
+        feature = {
+            'kind': 'line' if arrays['kind'][i] else 'point',
+            'cls': SNAPSHOT_CLASSES[arrays['cls'][i]],
+            'name': names[i],
+            'coords': arrays['coords'][offsets[i]:offsets[i + 1]],
+        }
+        if feature['kind'] == 'line':
+            feature['length'] = float(arrays['lengths'][i])
+        elif feature['cls'] in POLE_CLASSES:
+            feature['pu_as'] = PU_AS_CODES[arrays['pu_as'][i]]
+        features.append(feature)
+    return features, meta
+
+
+def snapshot_values(data, sumber="ODC", adss=None, length_mode="exact"):
+    """Summarize a snapshot straight into BOQ input values (for scripts).
+
+    ``adss`` defaults to the mode the snapshot was saved in.
+    """
+    features, meta = load_snapshot(data)
+    if adss is None:
+        adss = meta['adss']
+    return summarize_features(features, adss=adss, sumber=sumber, length_mode=length_mode)
+
+
+def is_snapshot(data):
+    return data[:4] == b"PK\x03\x04"
+
+
+def feature_key(feature):
+    """Hashed identity of a feature: class, name and rounded coordinates."""
+    coords = np.round(np.asarray(feature['coords'], dtype=np.float64), KEY_DECIMALS)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{feature['cls']}|{feature['name']}|".encode())
+    h.update(np.ascontiguousarray(coords + 0.0).tobytes())  # + 0.0 folds -0.0 into 0.0
+    return h.hexdigest()
+
+
+def merge_features(feature_sets, dedupe=False):
+    """Concatenate per-file feature lists.
+
+    With ``dedupe`` a feature whose identity already appeared in an earlier
+    file is dropped. Returns ``(features, duplicates_dropped)``.
+    """
+    merged = []
+    seen = set()
+    dropped = 0
+    for features in feature_sets:
+        file_keys = set()
+        for feature in features:
+            if dedupe:
+                key = feature_key(feature)
+                if key in seen:
+                    dropped += 1
+                    continue
+                file_keys.add(key)
+            merged.append(feature)
+        seen |= file_keys
+    return merged, dropped
+
+
+_process_pool = None
+
+
+def _get_process_pool():
+    # One pool per process; spawned workers only import this module, which
+    # keeps them safe to start from a threaded server such as Streamlit.
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=min(4, os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def _reset_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _process_pool = None
+
+
+def _parse_job(kml_data, adss):
+    try:
+        if is_snapshot(kml_data):
+            return (load_snapshot(kml_data)[0], []), None
+        return parse_kml_bytes(kml_data, adss), None
+    except KMLParseError as e:
+        return None, str(e)
+
+
+def parse_many(named_files, adss=False, use_processes=True):
+    """Parse several KML payloads (or network snapshots) concurrently.
+
+    ``named_files`` is a list of ``(name, bytes or UploadBuffer)``. Returns a list of
+    ``(name, features, warnings, error)`` in input order; ``error`` is a
+    message when the file could not be parsed.
+    """
+    payloads = [data.data if isinstance(data, UploadBuffer) else data for _, data in named_files]
+    outcomes = None
+    if len(payloads) > 1 and use_processes:
+        try:
+            executor = _get_process_pool()
+            futures = [executor.submit(_parse_job, data, adss) for data in payloads]
+            outcomes = [f.result() for f in futures]
+        except BrokenProcessPool:
+            # Workers could not start (e.g. restricted host); use threads instead.
+            _reset_process_pool()
+    if outcomes is None and len(payloads) > 1:
+        with ThreadPoolExecutor(max_workers=min(8, len(payloads))) as executor:
+            outcomes = list(executor.map(lambda data: _parse_job(data, adss), payloads))
+    elif outcomes is None:
+        outcomes = [_parse_job(data, adss) for data in payloads]
+
+    results = []
+    for (name, _), (parsed, error) in zip(named_files, outcomes):
+        if parsed is None:
+            results.append((name, [], [], error))
+        else:
+            results.append((name, parsed[0], parsed[1], None))
+    return results
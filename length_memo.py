@@ -0,0 +1,146 @@
+"""Persistent memo of exact cable segment lengths.
+
+Revisions of a LOP and neighbouring LOPs share most of their cable
+vertices, so the ellipsoidal length of a segment is stored in SQLite under
+its quantized end points (direction-independent) and looked up in bulk
+before anything is computed. The memo is off unless ``BOQ_LENGTH_MEMO``
+names a database file; ``BOQ_LENGTH_MEMO_SIZE`` bounds the number of
+segments kept, least recently used first out.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+
+from boq_metrics import METRICS
+
+DEFAULT_MEMO_PATH = os.environ.get("BOQ_LENGTH_MEMO")
+DEFAULT_MAX_ENTRIES = int(os.environ.get("BOQ_LENGTH_MEMO_SIZE", 1_000_000))
+
+# End points are quantized to 1e-7 degree (~1 cm) for the key.
+KEY_SCALE = 1e7
+# Keys per SQL statement, below SQLite's bound-parameter limit.
+BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segment_lengths (
+    key BLOB PRIMARY KEY,
+    length REAL NOT NULL,
+    used INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_segment_lengths_used ON segment_lengths (used);
+"""
+
+
+def segment_keys(starts, ends):
+    """16-byte key per segment from its quantized lon/lat end points."""
+    a = np.round(starts[:, :2] * KEY_SCALE).astype(np.int64)
+    b = np.round(ends[:, :2] * KEY_SCALE).astype(np.int64)
+    swap = (a[:, 0] > b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1]))
+    a[swap], b[swap] = b[swap], a[swap]
+    packed = np.ascontiguousarray(np.hstack([a, b]).astype('<i4'))
+    return packed.view(np.dtype((np.void, 16))).ravel().tolist()
+
+
+def _batches(items):
+    for i in range(0, len(items), BATCH_SIZE):
+        yield items[i:i + BATCH_SIZE]
+
+
+class LengthMemo:
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def lengths(self, starts, ends, compute):
+        """Lengths of the segments ``starts[i] -> ends[i]``.
+
+        Known segments come from the memo, the rest from ``compute(starts,
+        ends)`` and are stored. Returns ``(lengths, hits)``. A memo that
+        cannot be read or written falls back to computing everything.
+        """
+        if not len(starts):
+            return np.empty(0), 0
+        keys = segment_keys(starts, ends)
+        # Repeated segments within the request are looked up and computed once.
+        first = {}
+        for i, key in enumerate(keys):
+            first.setdefault(key, i)
+        unique = list(first)
+        try:
+            known = self._lookup(unique)
+        except sqlite3.Error:
+            return compute(starts, ends), 0
+
+        missing = [first[key] for key in unique if key not in known]
+        hits = sum(1 for key in keys if key in known)
+        if missing:
+            computed = compute(starts[missing], ends[missing]).tolist()
+            fresh = {keys[i]: length for i, length in zip(missing, computed)}
+            try:
+                self._store(fresh)
+            except sqlite3.Error:
+                pass
+            known.update(fresh)
+        METRICS.inc('boq_cache_requests_total', hits, cache='length_memo', result='hit')
+        METRICS.inc('boq_cache_requests_total', len(keys) - hits, cache='length_memo', result='miss')
+        return np.array([known[key] for key in keys], dtype=np.float64), hits
+
+    def _lookup(self, keys):
+        known = {}
+        now = time.time_ns()
+        with self._lock, closing(self._connect()) as conn, conn:
+            for batch in _batches(keys):
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(f"SELECT key, length FROM segment_lengths WHERE key IN ({marks})", batch).fetchall()
+                if rows:
+                    conn.execute(
+                        f"UPDATE segment_lengths SET used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [now] + [key for key, _ in rows],
+                    )
+                known.update(rows)
+        return known
+
+    def _store(self, lengths):
+        now = time.time_ns()
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO segment_lengths (key, length, used) VALUES (?, ?, ?)",
+                [(key, length, now) for key, length in lengths.items()],
+            )
+            excess = conn.execute("SELECT COUNT(*) FROM segment_lengths").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM segment_lengths WHERE key IN"
+                    " (SELECT key FROM segment_lengths ORDER BY used LIMIT ?)",
+                    (excess,),
+                )
+
+
+_memo = None
+_memo_lock = threading.Lock()
+
+
+def get_length_memo():
+    """Process-wide memo, or None when ``BOQ_LENGTH_MEMO`` is not set or
+    the database cannot be opened."""
+    global _memo
+    if not DEFAULT_MEMO_PATH:
+        return None
+    with _memo_lock:
+        if _memo is None:
+            try:
+                _memo = LengthMemo(DEFAULT_MEMO_PATH)
+            except sqlite3.Error:
+                return None
+        return _memo
@@ -0,0 +1,351 @@
+"""Concurrent-session load test for the Streamlit app.
+
+Drives N simulated planner sessions through the Manual, KML and ADSS tabs
+with Streamlit's app testing API (no browser, no server, no network) and
+reports latency percentiles per action plus the process memory sampled
+while the sessions run::
+
+    python loadtest.py --sessions 20 --iterations 2
+    python loadtest.py --sessions 8 --actions kml,adss --poles 400 --json result.json
+
+Every session gets its own synthetic KML (different content, so the
+opt-in ``BOQ_LENGTH_MEMO`` segment memo, if enabled, does not hide the
+length cost) and shares one synthetic BOQ template. Uploads are injected by replacing ``st.file_uploader`` with a
+stub that returns the session's files. Generated BOQs go to a temporary
+history database unless ``BOQ_HISTORY_DB`` is set.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+ACTIONS = ('manual', 'kml', 'adss')
+UPLOADS_KEY = '_loadtest_uploads'
+TEMPLATE_ROWS = range(9, 1083)
+GENERATE_BUTTONS = {
+    'manual': "🚀 Generate BOQ Manual",
+    'kml': "🚀 Generate BOQ dari KML",
+    'adss': "🚀 Generate BOQ ADSS",
+}
+LOP_INPUT_KEYS = {'kml': 'kml_lop_name', 'adss': 'adss_lop_name'}
+
+
+class SyntheticUpload(BytesIO):
+    """Stands in for Streamlit's UploadedFile."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def synthetic_template(seed=0):
+    """BOQ template with every designator the volume rules produce."""
+    import openpyxl
+
+    import app
+
+    sample = {'sumber': "ODC", 'izin': "", 'kabel_12': 1, 'kabel_24': 1, 'kabel_adss_12': 1,
+              'kabel_adss_24': 1, 'odp_8': 1, 'odp_16': 1, 'otb_12': 1, 'tiang_new': 1, 'closure': 1}
+    designators = list(dict.fromkeys(
+        item['designator'] for item in app.calculate_volumes(sample) + app.calculate_volumes_adss(sample)
+    ))
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for row in TEMPLATE_ROWS:
+        index = row - TEMPLATE_ROWS.start
+        designator = designators[index] if index < len(designators) else f"X-FILLER-{row}"
+        ws[f'A{row}'] = index + 1
+        ws[f'B{row}'] = designator
+        ws[f'E{row}'] = 0 if designator.startswith("J-") else rng.randrange(1, 200) * 1000
+        ws[f'F{row}'] = 0 if designator.startswith("M-") else rng.randrange(1, 50) * 500
+        ws[f'H{row}'] = f"=E{row}*G{row}"
+        ws[f'I{row}'] = f"=F{row}*G{row}"
+    total_row = TEMPLATE_ROWS.stop
+    ws[f'H{total_row}'] = f"=SUM(H{TEMPLATE_ROWS.start}:H{TEMPLATE_ROWS.stop - 1})"
+    ws[f'I{total_row}'] = f"=SUM(I{TEMPLATE_ROWS.start}:I{TEMPLATE_ROWS.stop - 1})"
+    ws[f'J{total_row}'] = f"=H{total_row}+I{total_row}"
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def synthetic_kml(seed, poles=200):
+    """A route with poles, ODPs, an OTB, a closure and distribution/ADSS cables."""
+    rng = random.Random(seed)
+    lon, lat = 106.8 + rng.uniform(-0.5, 0.5), -6.2 + rng.uniform(-0.5, 0.5)
+    route = [(lon + i * 0.0004, lat + 0.0001 * math.sin(i / 5 + seed)) for i in range(poles * 3)]
+
+    def point(name, lo, la, desc=""):
+        return (f"<Placemark><name>{name}</name><description>{desc}</description>"
+                f"<Point><coordinates>{lo:.7f},{la:.7f},0</coordinates></Point></Placemark>")
+
+    def line(name, coords):
+        text = " ".join(f"{lo:.7f},{la:.7f},0" for lo, la in coords)
+        return f"<Placemark><name>{name}</name><LineString><coordinates>{text}</coordinates></LineString></Placemark>"
+
+    placemarks = []
+    for i, (lo, la) in enumerate(route[::3]):
+        name = f"TN7-{i:04d} NEW" if i % 2 else f"TE-{i:04d}"
+        placemarks.append(point(name, lo + 0.00001, la - 0.00001, "PU-AS-HL" if i % 10 == 0 else ""))
+    for i in range(max(1, poles // 25)):
+        placemarks.append(point(f"ODP 8 NEW {i}", *route[(i * 75) % len(route)], "ODP Solid-PB-8 AS"))
+    for i in range(max(1, poles // 100)):
+        placemarks.append(point(f"ODP 16 BARU {i}", *route[(i * 150 + 20) % len(route)], "ODP Solid-PB-16 AS"))
+    placemarks.append(point("OTB 12 NEW", *route[0]))
+    placemarks.append(point("CLOSURE 1", *route[len(route) // 2]))
+    half = len(route) // 2
+    placemarks.append(line("DIS NEW JALAN UTAMA", route[:half + 1]))
+    placemarks.append(line("AC-OF-SM-ADSS-12D FEEDER", route[half:]))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Folder>'
+            + "".join(placemarks) + "</Folder></Document></kml>").encode()
+
+
+def install_upload_stub():
+    """Make ``st.file_uploader`` return the files of the running session."""
+    import streamlit as st
+
+    def file_uploader(label, type=None, accept_multiple_files=False, key=None, **kwargs):
+        uploads = st.session_state.get(UPLOADS_KEY, {})
+        kind = 'template' if "xlsx" in (type or []) else 'kml'
+        files = [SyntheticUpload(name, data) for name, data in uploads.get(kind, [])]
+        if accept_multiple_files:
+            return files
+        return files[0] if files else None
+
+    st.file_uploader = file_uploader
+
+
+def share_apptest_globals():
+    """Let AppTest instances run concurrently in one process.
+
+    Each ``AppTest.run()`` installs a mock ``Runtime`` singleton and turns
+    on the ``global.appTest`` option, then resets both when it finishes,
+    which pulls them out from under any other session still running. Keep
+    the first mock runtime and the option set for the whole load test.
+    """
+    from contextlib import nullcontext
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test
+
+    class KeepFirstRuntime(type):
+        def __setattr__(cls, name, value):
+            if name != '_instance':
+                setattr(Runtime, name, value)
+            elif value is not None and Runtime._instance is None:
+                Runtime._instance = value
+
+        def __getattr__(cls, name):
+            return getattr(Runtime, name)
+
+        def __dir__(cls):
+            return dir(Runtime)
+
+    class SharedRuntime(metaclass=KeepFirstRuntime):
+        pass
+
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda options: nullcontext()
+    app_test.Runtime = SharedRuntime
+
+
+def session_script(uploads, uploads_key):
+    # AppTest runs only this function's source, so it must not use module globals.
+    import streamlit as st
+
+    import app
+
+    st.session_state[uploads_key] = uploads
+    app.show()
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # ru_maxrss is the peak, not the current size, where /proc is unavailable.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name="loadtest-memory", daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._started_at = time.perf_counter()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append((time.perf_counter() - self._started_at, _rss_mb()))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.samples.append((time.perf_counter() - self._started_at, _rss_mb()))
+
+
+def run_session(session_id, uploads, actions, iterations, timeout, record):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_function(session_script, args=(uploads, UPLOADS_KEY), default_timeout=timeout)
+
+    def timed(action, step):
+        started = time.perf_counter()
+        error = None
+        try:
+            step()
+            if at.exception:
+                error = at.exception[0].value
+            elif at.error:
+                error = at.error[0].value
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        record(action, time.perf_counter() - started, error)
+
+    timed('load', lambda: at.run())
+    for iteration in range(iterations):
+        for action in actions:
+            def step(action=action):
+                lop_name = f"LT-{session_id:03d}-{iteration}-{action}"
+                if action in LOP_INPUT_KEYS:
+                    at.text_input(key=LOP_INPUT_KEYS[action]).input(lop_name)
+                else:
+                    at.text_input[0].input(lop_name)
+                next(b for b in at.button if b.label == GENERATE_BUTTONS[action]).click()
+                at.run()
+            timed(action, step)
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def report(latencies, errors, samples, sessions, wall):
+    rows = []
+    for action in ['load'] + [a for a in ACTIONS if a in latencies]:
+        values = sorted(latencies.get(action, []))
+        if not values:
+            continue
+        rows.append({
+            'action': action,
+            'count': len(values),
+            'errors': len(errors.get(action, [])),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': values[-1] * 1000,
+        })
+    rss = [mb for _, mb in samples]
+    return {
+        'sessions': sessions,
+        'wall_seconds': wall,
+        'actions': rows,
+        'errors': {action: messages[:5] for action, messages in errors.items()},
+        'memory_mb': {
+            'start': rss[0] if rss else None,
+            'peak': max(rss) if rss else None,
+            'end': rss[-1] if rss else None,
+            'samples': [{'t': round(t, 2), 'rss_mb': round(mb, 1)} for t, mb in samples],
+        },
+    }
+
+
+def print_report(result):
+    print(f"sessions={result['sessions']} wall={result['wall_seconds']:.1f}s")
+    print(f"{'action':<8} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in result['actions']:
+        print(f"{row['action']:<8} {row['count']:>6} {row['errors']:>6} {row['p50_ms']:>9.0f} "
+              f"{row['p95_ms']:>9.0f} {row['p99_ms']:>9.0f} {row['max_ms']:>9.0f}")
+    memory = result['memory_mb']
+    print(f"memory MB: start={memory['start']:.0f} peak={memory['peak']:.0f} end={memory['end']:.0f}")
+    samples = memory['samples']
+    step = max(1, len(samples) // 10)
+    print("memory over time: " + "  ".join(f"{s['t']:.0f}s={s['rss_mb']:.0f}" for s in samples[::step]))
+    for action, messages in result['errors'].items():
+        for message in messages:
+            print(f"error [{action}]: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the BOQ Streamlit app")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated sessions")
+    parser.add_argument("--iterations", type=int, default=1, help="passes through the actions per session")
+    parser.add_argument("--actions", default=",".join(ACTIONS), help="comma-separated: manual,kml,adss")
+    parser.add_argument("--poles", type=int, default=200, help="poles per synthetic KML")
+    parser.add_argument("--files", type=int, default=1, help="KML files uploaded per session")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds per script run")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="memory sampling interval (s)")
+    parser.add_argument("--json", help="also write the result to this file")
+    args = parser.parse_args()
+
+    actions = [a.strip() for a in args.actions.split(",") if a.strip()]
+    unknown = set(actions) - set(ACTIONS)
+    if unknown:
+        parser.error(f"unknown actions: {', '.join(sorted(unknown))}")
+    if 'BOQ_HISTORY_DB' not in os.environ:
+        os.environ['BOQ_HISTORY_DB'] = os.path.join(tempfile.mkdtemp(prefix="boq-loadtest-"), "history.sqlite3")
+
+    install_upload_stub()
+    share_apptest_globals()
+    template = synthetic_template(args.seed)
+    uploads = [{
+        'template': [("template.xlsx", template)],
+        'kml': [(f"session-{i}-{k}.kml", synthetic_kml(args.seed * 1000 + i * 10 + k, args.poles))
+                for k in range(args.files)],
+    } for i in range(args.sessions)]
+
+    # Start the KML worker processes from this module: spawned workers
+    # re-import __main__, which inside a test script run is not importable.
+    from kml_network import parse_many
+    parse_many([(f"warmup-{i}.kml", synthetic_kml(-1 - i, 2)) for i in range(8)])
+
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def record(action, seconds, error):
+        with lock:
+            latencies.setdefault(action, []).append(seconds)
+            if error:
+                errors.setdefault(action, []).append(str(error))
+
+    sampler = MemorySampler(args.sample_interval)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        futures = [
+            executor.submit(run_session, i, uploads[i], actions, args.iterations, args.timeout, record)
+            for i in range(args.sessions)
+        ]
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - started
+    sampler.stop()
+
+    result = report(latencies, errors, sampler.samples, args.sessions, wall)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
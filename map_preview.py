@@ -0,0 +1,165 @@
+"""Decimated map geometry for previewing a classified network.
+
+The browser only needs what is visible at the chosen zoom level: routes
+are simplified with Douglas-Peucker at a tolerance of about a pixel and
+points closer than a few pixels are merged into clusters, so designs with
+hundreds of thousands of vertices are drawn from a few thousand.
+"""
+import math
+
+import numpy as np
+
+from kml_geometry import project_local
+from kml_network import CABLE_CLASSES
+
+EARTH_CIRCUMFERENCE = 40075016.686  # meter, web mercator equator
+TILE_SIZE = 256
+VIEW_WIDTH = 700    # px, approximate width of the chart in the form
+VIEW_HEIGHT = 450   # px
+MAX_ZOOM = 20
+PIXEL_TOLERANCE = 1.0   # route simplification, in screen pixels
+CLUSTER_PIXELS = 12     # points closer than this are drawn as one marker
+
+LABELS = {
+    'tiang_new': "Tiang Baru",
+    'tiang_existing': "Tiang Existing",
+    'odp_8': "ODP 8",
+    'odp_16': "ODP 16",
+    'otb_12': "OTB 12",
+    'closure': "Closure",
+    'homepass': "Homepass",
+    'kabel_12': "Kabel Distribusi",
+    'kabel_adss_12': "Kabel ADSS 12",
+    'kabel_adss_24': "Kabel ADSS 24",
+}
+COLORS = {
+    'tiang_new': [46, 160, 67],
+    'tiang_existing': [120, 120, 120],
+    'odp_8': [31, 119, 180],
+    'odp_16': [148, 103, 189],
+    'otb_12': [255, 127, 14],
+    'closure': [214, 39, 40],
+    'homepass': [188, 189, 34],
+    'kabel_12': [31, 119, 180],
+    'kabel_adss_12': [255, 127, 14],
+    'kabel_adss_24': [214, 39, 40],
+}
+
+
+def meters_per_pixel(zoom, lat):
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(lat)) / (TILE_SIZE * 2 ** zoom)
+
+
+def fit_zoom(lonlat, width=VIEW_WIDTH, height=VIEW_HEIGHT):
+    """Largest whole zoom level at which ``lonlat`` fits in the view."""
+    if not len(lonlat):
+        return 12
+    span_lon, span_lat = np.ptp(lonlat, axis=0)
+    lat = float(np.mean(lonlat[:, 1]))
+    zoom = MAX_ZOOM
+    for z in range(MAX_ZOOM, -1, -1):
+        degrees_per_px = 360 / (TILE_SIZE * 2 ** z)
+        zoom = z
+        if span_lon / degrees_per_px <= width and span_lat / (degrees_per_px * math.cos(math.radians(lat))) <= height:
+            break
+    return zoom
+
+
+def simplify(xy, tolerance):
+    """Indices of the vertices Douglas-Peucker keeps at ``tolerance``."""
+    n = len(xy)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = xy[first], xy[last]
+        inner = xy[first + 1:last]
+        d = end - start
+        length = math.hypot(d[0], d[1])
+        if length == 0:
+            dist = np.hypot(*(inner - start).T)
+        else:
+            # Perpendicular distance to the chord.
+            dist = np.abs(d[0] * (inner[:, 1] - start[1]) - d[1] * (inner[:, 0] - start[0])) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def cluster_points(xy, cell):
+    """Group points into grid cells of ``cell`` meters; returns the point
+    indices of each cluster."""
+    if not len(xy):
+        return []
+    keys = np.floor(xy / cell).astype(np.int64)
+    _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+def build_preview(features, detail=0):
+    """Decimated layers for the features.
+
+    The view is fitted to the features and ``detail`` zooms in that many
+    levels, decimating for the finer resolution.
+
+    Returns ``{'view': {...}, 'paths': [...], 'points': [...],
+    'vertices_in': n, 'vertices_out': m}``; coordinates are lon/lat.
+    """
+    located = [f for f in features if len(f['coords'])]
+    preview = {'view': None, 'paths': [], 'points': [], 'vertices_in': 0, 'vertices_out': 0}
+    if not located:
+        return preview
+    lonlat = np.concatenate([f['coords'][:, :2] for f in located])
+    xy, _ = project_local(lonlat)
+    zoom = min(fit_zoom(lonlat) + detail, MAX_ZOOM)
+    lon0, lat0 = (lonlat.min(axis=0) + lonlat.max(axis=0)) / 2
+    preview['view'] = {'longitude': float(lon0), 'latitude': float(lat0), 'zoom': zoom}
+    resolution = meters_per_pixel(zoom, lat0)
+
+    offsets = np.cumsum([0] + [len(f['coords']) for f in located])
+    point_rows = {}
+    for feature, lo, hi in zip(located, offsets[:-1], offsets[1:]):
+        preview['vertices_in'] += hi - lo
+        if feature['kind'] == 'line':
+            if feature['cls'] not in CABLE_CLASSES:
+                continue
+            kept = simplify(xy[lo:hi], PIXEL_TOLERANCE * resolution)
+            preview['paths'].append({
+                'cls': feature['cls'],
+                'label': f"{LABELS[feature['cls']]}: {feature['name']}",
+                'color': COLORS[feature['cls']],
+                'path': lonlat[lo:hi][kept].tolist(),
+            })
+            preview['vertices_out'] += len(kept)
+        else:
+            point_rows.setdefault(feature['cls'], []).append((lo, feature['name']))
+
+    for cls, rows in point_rows.items():
+        idx = np.array([row[0] for row in rows])
+        members = cluster_points(xy[idx], CLUSTER_PIXELS * resolution)
+        for member in members:
+            if len(member) == 1:
+                position = lonlat[idx[member[0]]]
+                label = f"{LABELS[cls]}: {rows[member[0]][1]}"
+            else:
+                position = lonlat[idx[member]].mean(axis=0)
+                label = f"{LABELS[cls]}: {len(member)} titik"
+            preview['points'].append({
+                'cls': cls,
+                'label': label,
+                'color': COLORS[cls],
+                'count': int(len(member)),
+                'position': [float(position[0]), float(position[1])],
+            })
+        preview['vertices_out'] += len(members)
+    return preview
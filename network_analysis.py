@@ -0,0 +1,158 @@
+"""Checks on a classified network that relate features to each other."""
+import math
+
+import numpy as np
+
+from kml_geometry import project_local
+from kml_network import CABLE_CLASSES, HOMEPASS_CLASS, POLE_CLASSES
+from spatial_index import GridIndex, nearest_within, point_segment_distance, segment_boxes
+
+DEFAULT_MAX_SPAN = 50.0   # meter antar tiang
+DEFAULT_MAX_SNAP = 30.0   # jarak maksimum tiang ke jalur kabel
+DEFAULT_MAX_DROP = 150.0  # jarak maksimum kabel drop homepass ke ODP
+
+ODP_CAPACITY = {'odp_8': 8, 'odp_16': 16}
+
+
+def _project_features(features):
+    """Project all feature coordinates onto one local plane (meters)."""
+    coords = [f['coords'] for f in features if len(f['coords'])]
+    if not coords:
+        return {}
+    xy, origin = project_local(np.concatenate(coords))
+    projected = {}
+    offset = 0
+    for feature in features:
+        n = len(feature['coords'])
+        if n:
+            projected[id(feature)] = xy[offset:offset + n]
+            offset += n
+    return projected
+
+
+def analyze_spans(features, max_span=DEFAULT_MAX_SPAN, max_snap=DEFAULT_MAX_SNAP):
+    """Snap poles onto cable routes and measure the spans between them.
+
+    Each pole is attached to the nearest cable segment within ``max_snap``
+    meters (found through a grid index over the segments), poles are
+    ordered by their position along the route, and the route ends count as
+    supports. Spans longer than ``max_span`` are flagged with the number of
+    extra poles they need, which gives a suggested ``tiang_new``.
+    """
+    routes = [f for f in features if f['kind'] == 'line' and f['cls'] in CABLE_CLASSES and len(f['coords']) > 1]
+    poles = [f for f in features if f['kind'] == 'point' and f['cls'] in POLE_CLASSES and len(f['coords'])]
+    tiang_new = sum(1 for f in features if f['kind'] == 'point' and f['cls'] == 'tiang_new')
+    result = {
+        'max_span': max_span,
+        'spans': [],
+        'over_limit': 0,
+        'missing_poles': 0,
+        'unsnapped_poles': 0,
+        'oversized_segments': 0,
+        'suggested_tiang_new': tiang_new,
+    }
+    if not routes:
+        result['unsnapped_poles'] = len(poles)
+        return result
+
+    projected = _project_features(routes + poles)
+
+    # Flatten every route into segments with their chainage (distance from route start).
+    starts, ends, route_ids, chain_starts, route_lengths = [], [], [], [], []
+    for route_id, route in enumerate(routes):
+        xy = projected[id(route)]
+        seg_len = np.hypot(*np.diff(xy, axis=0).T)
+        starts.append(xy[:-1])
+        ends.append(xy[1:])
+        route_ids.append(np.full(len(seg_len), route_id))
+        chain_starts.append(np.concatenate([[0.0], np.cumsum(seg_len)[:-1]]))
+        route_lengths.append(float(seg_len.sum()))
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    route_ids = np.concatenate(route_ids)
+    chain_starts = np.concatenate(chain_starts)
+    seg_lengths = np.hypot(*(ends - starts).T)
+
+    pole_xy = np.array([projected[id(p)][0] for p in poles]).reshape(-1, 2)
+    index = GridIndex(segment_boxes(starts, ends), cell_size=max(max_snap, 1.0))
+    result['oversized_segments'] = len(index.oversized)
+    pole_idx, seg_idx = index.candidates(pole_xy, max_snap)
+    dist, t = point_segment_distance(pole_xy[pole_idx], starts[seg_idx], ends[seg_idx])
+    keep = dist <= max_snap
+    pole_idx, seg_idx, dist, t = pole_idx[keep], seg_idx[keep], dist[keep], t[keep]
+
+    # Nearest segment per pole.
+    order = np.lexsort((dist, pole_idx))
+    pole_idx, seg_idx, t = pole_idx[order], seg_idx[order], t[order]
+    first = np.ones(len(pole_idx), dtype=bool)
+    first[1:] = pole_idx[1:] != pole_idx[:-1]
+    pole_idx, seg_idx, t = pole_idx[first], seg_idx[first], t[first]
+    result['unsnapped_poles'] = len(poles) - len(pole_idx)
+
+    pole_route = route_ids[seg_idx]
+    pole_chain = chain_starts[seg_idx] + t * seg_lengths[seg_idx]
+    order = np.lexsort((pole_chain, pole_route))
+    pole_idx, pole_route, pole_chain = pole_idx[order], pole_route[order], pole_chain[order]
+
+    bounds = np.searchsorted(pole_route, np.arange(len(routes) + 1))
+    for route_id, route in enumerate(routes):
+        lo, hi = bounds[route_id], bounds[route_id + 1]
+        labels = ["(awal)"] + [poles[i]['name'] for i in pole_idx[lo:hi]] + ["(akhir)"]
+        chain = np.concatenate([[0.0], pole_chain[lo:hi], [route_lengths[route_id]]])
+        for k, span in enumerate(np.diff(chain).tolist()):
+            over = span > max_span
+            missing = math.ceil(span / max_span) - 1 if over else 0
+            result['spans'].append({
+                'route': route['name'],
+                'from': labels[k],
+                'to': labels[k + 1],
+                'length': span,
+                'over_limit': over,
+                'missing_poles': missing,
+            })
+            result['over_limit'] += over
+            result['missing_poles'] += missing
+
+    result['suggested_tiang_new'] = tiang_new + result['missing_poles']
+    return result
+
+
+def assign_homepass(features, max_drop=DEFAULT_MAX_DROP):
+    """Assign every homepass to the nearest new ODP within ``max_drop`` meters.
+
+    ODPs are looked up through a grid index, so tens of thousands of
+    homepasses cost a few array operations. Each ODP's load is compared
+    with its port capacity; homes beyond capacity count as served but are
+    reported as ``excess_homes``. Utilization is the share of ODP ports
+    actually used.
+    """
+    homes = [f for f in features if f['kind'] == 'point' and f['cls'] == HOMEPASS_CLASS and len(f['coords'])]
+    odps = [f for f in features if f['kind'] == 'point' and f['cls'] in ODP_CAPACITY and len(f['coords'])]
+    capacity = np.array([ODP_CAPACITY[f['cls']] for f in odps], dtype=np.int64)
+    nearest = np.full(len(homes), -1, dtype=np.int64)
+    if homes and odps:
+        projected = _project_features(odps + homes)
+        odp_xy = np.array([projected[id(f)][0] for f in odps])
+        home_xy = np.array([projected[id(f)][0] for f in homes])
+        nearest, _ = nearest_within(home_xy, odp_xy, max_drop)
+    served = nearest >= 0
+    load = np.bincount(nearest[served], minlength=len(odps))
+    used = np.minimum(load, capacity)
+    total_ports = int(capacity.sum())
+
+    return {
+        'max_drop': max_drop,
+        'homepass': len(homes),
+        'served': int(served.sum()),
+        'unserved': int((~served).sum()),
+        'total_ports': total_ports,
+        'used_ports': int(used.sum()),
+        'utilization': float(used.sum()) / total_ports if total_ports else 0.0,
+        'overloaded_odps': int((load > capacity).sum()),
+        'excess_homes': int(np.maximum(load - capacity, 0).sum()),
+        'odps': [
+            {'odp': f['name'], 'cls': f['cls'], 'capacity': c, 'load': n, 'utilization': u / c, 'over_capacity': n > c}
+            for f, c, n, u in zip(odps, capacity.tolist(), load.tolist(), used.tolist())
+        ],
+        'unserved_homes': [homes[i]['name'] for i in np.flatnonzero(~served)],
+    }
@@ -0,0 +1,120 @@
+"""Search ODP-8 / ODP-16 / OTB mixes for the cheapest way to serve a port count.
+
+Only a handful of designators change with the mix; their volume rules are
+mirrored here as numpy expressions so every candidate is costed at once.
+All other designators are costed once from the regular volume calculation.
+The best candidates are then re-costed exactly through that calculation,
+so the reported numbers match what a generate would produce.
+"""
+import numpy as np
+
+PORTS_ODP_8 = 8
+PORTS_ODP_16 = 16
+PORTS_OTB = 8
+DEFAULT_SPARE_PORTS = 16
+DEFAULT_TOP = 5
+
+
+def _groups_of_4(total_odp):
+    return np.where(total_odp > 0, (total_odp - 1) // 4 + 1, 0)
+
+
+# Designators whose volume depends on the mix, as functions of
+# (odp_8, odp_16, otb_12, total_odp) arrays.
+MIX_RULES = {
+    'J-OS-SM-1': lambda n8, n16, otb, total: total * 2,
+    'J-PC-UPC-652-2': lambda n8, n16, otb, total: _groups_of_4(total),
+    'M-PC-UPC-652-2': lambda n8, n16, otb, total: _groups_of_4(total),
+    'J-PC-APC/UPC-652-A1': lambda n8, n16, otb, total: 18 * _groups_of_4(total),
+    'M-PC-APC/UPC-652-A1': lambda n8, n16, otb, total: 18 * _groups_of_4(total),
+    'J-PS-1-4-ODC': lambda n8, n16, otb, total: _groups_of_4(total),
+    'M-PS-1-4-ODC': lambda n8, n16, otb, total: _groups_of_4(total),
+    'J-ODP Solid-PB-8 AS': lambda n8, n16, otb, total: n8,
+    'M-ODP Solid-PB-8 AS': lambda n8, n16, otb, total: n8,
+    'J-ODP Solid-PB-16 AS': lambda n8, n16, otb, total: n16,
+    'M-ODP Solid-PB-16 AS': lambda n8, n16, otb, total: n16,
+    'J-TC-SM-12': lambda n8, n16, otb, total: otb,
+    'M-TC-SM-12': lambda n8, n16, otb, total: otb,
+    'J-PS-1-8-ODX': lambda n8, n16, otb, total: (otb > 0).astype(np.int64),
+    'M-PS-1-8-ODX': lambda n8, n16, otb, total: (otb > 0).astype(np.int64),
+}
+
+
+def effective_volumes(items):
+    """Volume written per designator; like the template fill, the last
+    positive volume listed for a designator wins."""
+    volumes = {}
+    for item in items:
+        if item['volume'] > 0:
+            volumes[item['designator']] = item['volume']
+    return volumes
+
+
+def items_cost(items, prices):
+    """Total cost of calculated items with ``prices`` ({designator: (material, jasa)})."""
+    izin = {item['designator']: item['izin_value'] for item in items if 'izin_value' in item}
+    total = 0.0
+    for designator, volume in effective_volumes(items).items():
+        h_mat, h_jasa = prices.get(designator, (0.0, 0.0))
+        if "Preliminary" in designator and designator in izin:
+            h_jasa = izin[designator]
+        total += (h_mat + h_jasa) * volume
+    return total
+
+
+def _candidates(required_ports, spare_ports, allow_otb):
+    max_ports = required_ports + spare_ports
+    n8, n16, otb = np.meshgrid(
+        np.arange(max_ports // PORTS_ODP_8 + 1),
+        np.arange(max_ports // PORTS_ODP_16 + 1),
+        np.arange(2 if allow_otb else 1),
+        indexing='ij',
+    )
+    n8, n16, otb = n8.ravel(), n16.ravel(), otb.ravel()
+    ports = n8 * PORTS_ODP_8 + n16 * PORTS_ODP_16 + otb * PORTS_OTB
+    keep = (ports >= required_ports) & (ports <= max_ports) & (n8 + n16 > 0)
+    return n8[keep], n16[keep], otb[keep], ports[keep]
+
+
+def optimize_odp_mix(required_ports, inputs, calculate, prices,
+                     spare_ports=DEFAULT_SPARE_PORTS, allow_otb=True, top=DEFAULT_TOP):
+    """Cheapest ODP mixes that provide at least ``required_ports`` ports.
+
+    ``inputs`` are the other BOQ inputs (cable, poles, sumber, ...),
+    ``calculate`` the volume calculation for the BOQ mode and ``prices``
+    the template prices. Mixes with up to ``spare_ports`` extra ports are
+    considered, which lets a cheaper port cost win over a tight fit.
+
+    Returns ``{'by_total': [...], 'by_cpp': [...], 'candidates': n}``;
+    each entry has ``odp_8``, ``odp_16``, ``otb_12``, ``ports``, ``total``
+    and ``cpp`` (total per physical port).
+    """
+    n8, n16, otb, ports = _candidates(required_ports, spare_ports, allow_otb)
+    result = {'by_total': [], 'by_cpp': [], 'candidates': len(ports)}
+    if not len(ports):
+        return result
+
+    base_items = calculate({**inputs, 'odp_8': 0, 'odp_16': 0, 'otb_12': 0})
+    calculated = {item['designator'] for item in base_items}
+    fixed = [item for item in base_items if item['designator'] not in MIX_RULES]
+    cost = np.full(len(ports), items_cost(fixed, prices))
+    total_odp = n8 + n16
+    for designator, rule in MIX_RULES.items():
+        if designator not in calculated:
+            continue
+        h_mat, h_jasa = prices.get(designator, (0.0, 0.0))
+        cost += (h_mat + h_jasa) * rule(n8, n16, otb, total_odp)
+    cpp = cost / ports
+
+    # Screen with the vectorized costs, then re-cost the short list exactly.
+    shortlist = set(np.lexsort((ports, cost))[:top * 2].tolist())
+    shortlist |= set(np.lexsort((-ports, cpp))[:top * 2].tolist())
+    exact = []
+    for i in shortlist:
+        mix = {'odp_8': int(n8[i]), 'odp_16': int(n16[i]), 'otb_12': int(otb[i])}
+        total = items_cost(calculate({**inputs, **mix}), prices)
+        exact.append({**mix, 'ports': int(ports[i]), 'total': total, 'cpp': total / int(ports[i])})
+
+    result['by_total'] = sorted(exact, key=lambda m: (m['total'], m['ports']))[:top]
+    result['by_cpp'] = sorted(exact, key=lambda m: (m['cpp'], -m['ports']))[:top]
+    return result
@@ -0,0 +1,178 @@
+"""One workbook for a program submission: a recap sheet plus one sheet per LOP.
+
+The template is read once in read-only mode and every LOP sheet is
+streamed from those rows into a write-only workbook with the LOP's
+volumes filled in, so memory stays flat however many LOPs are included.
+Column widths and merged cells, which read-only sheets do not expose,
+come from one regular load of the template.
+Costs are totalled while the rows are written and the recap sheet is
+filled in the same pass; formula results are cached as in a single BOQ.
+"""
+import re
+from copy import copy
+from io import BytesIO
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+
+from odp_optimizer import effective_volumes
+from template_formulas import compile_template, write_cached_sheets
+from upload_buffer import UploadBuffer
+
+FIRST_ROW = 9
+LAST_ROW = 1082
+VOLUME_COLUMN = 7  # G
+JASA_COLUMN = 6    # F
+
+RECAP_TITLE = "Rekap"
+RECAP_HEADER = ["No", "Nama LOP", "Sumber", "Material", "Jasa", "Total", "Total ODP", "Total Port", "CPP"]
+INVALID_TITLE_RE = re.compile(r"[\[\]:*?/\\]")
+
+
+def _sheet_title(lop_name, used):
+    base = INVALID_TITLE_RE.sub("-", lop_name).strip("'") or "LOP"
+    title = base[:31]
+    n = 2
+    while title.upper() in used:
+        suffix = f" ({n})"
+        title = base[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(title.upper())
+    return title
+
+
+class _StyleCopier:
+    """Copies template cell styles into the target workbook, once per style."""
+
+    def __init__(self):
+        self.styles = {}
+
+    def cell(self, ws, source, value):
+        cell = WriteOnlyCell(ws, value)
+        if not getattr(source, 'has_style', False):
+            return cell
+        key = tuple(source.style_array)
+        style = self.styles.get(key)
+        if style is None:
+            cell.font = copy(source.font)
+            cell.fill = copy(source.fill)
+            cell.border = copy(source.border)
+            cell.alignment = copy(source.alignment)
+            cell.protection = copy(source.protection)
+            cell.number_format = source.number_format
+            self.styles[key] = cell._style
+        else:
+            cell._style = copy(style)
+        return cell
+
+
+def _template_layout(template):
+    """Column dimensions and merged ranges of the template's active sheet."""
+    wb = openpyxl.load_workbook(template.reader())
+    try:
+        ws = wb.active
+        columns = [
+            (key, dim.width, dim.hidden, dim.min, dim.max)
+            for key, dim in ws.column_dimensions.items()
+            if dim.customWidth or dim.hidden
+        ]
+        merged = [str(cells) for cells in ws.merged_cells.ranges]
+    finally:
+        wb.close()
+    return columns, merged
+
+
+def _apply_layout(ws, layout):
+    columns, merged = layout
+    for key, width, hidden, min_column, max_column in columns:
+        dim = ws.column_dimensions[key]
+        dim.width = width
+        dim.hidden = hidden
+        dim.min = min_column
+        dim.max = max_column
+    for cells in merged:
+        ws.merged_cells.add(cells)
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def write_program_workbook(template_data, lops):
+    """Workbook with a recap sheet and one filled template sheet per LOP.
+
+    ``lops`` is a list of ``{'lop_name', 'inputs', 'items'}`` where
+    ``items`` are the calculated volume items of that LOP. Volumes and
+    costs follow the single-LOP template fill. Returns the workbook as a
+    BytesIO.
+    """
+    template = UploadBuffer(template_data)
+    source = openpyxl.load_workbook(template.reader(), read_only=True)
+    try:
+        source_ws = source.active
+        # Read-only rows are padded to the sheet width; drop unstyled trailing
+        # blanks, keeping the volume column of BOQ rows.
+        rows = []
+        for row_number, row in enumerate(source_ws.iter_rows(), start=1):
+            row = list(row)
+            keep = VOLUME_COLUMN if FIRST_ROW <= row_number <= LAST_ROW else 0
+            while len(row) > keep and row[-1].value is None and not getattr(row[-1], 'has_style', False):
+                row.pop()
+            rows.append(row)
+        formulas = compile_template(template.digest(), source_ws)
+    finally:
+        source.close()
+    layout = _template_layout(template)
+
+    wb = openpyxl.Workbook(write_only=True)
+    recap = wb.create_sheet(RECAP_TITLE)
+    recap.append(["REKAP BOQ PROGRAM"])
+    recap.append(RECAP_HEADER)
+    styles = _StyleCopier()
+    used_titles = {RECAP_TITLE.upper()}
+    totals = [0.0, 0.0, 0.0, 0, 0]
+    cached = {}
+
+    for number, lop in enumerate(lops, start=1):
+        inputs = lop['inputs']
+        volumes = effective_volumes(lop['items'])
+        izin = {item['designator']: item['izin_value'] for item in lop['items'] if 'izin_value' in item}
+        skip_base_tray = inputs.get('sumber') == 'ODC'
+        ws = wb.create_sheet(_sheet_title(lop['lop_name'], used_titles))
+        _apply_layout(ws, layout)
+        changed = {}
+        material = jasa = 0.0
+
+        for row_number, row in enumerate(rows, start=1):
+            values = [cell.value for cell in row]
+            if FIRST_ROW <= row_number <= LAST_ROW and len(values) >= VOLUME_COLUMN:
+                designator = str(values[1] or "").strip()
+                if designator in volumes:
+                    values[VOLUME_COLUMN - 1] = changed[f'G{row_number}'] = volumes[designator]
+                    if "Preliminary" in designator and designator in izin:
+                        values[JASA_COLUMN - 1] = changed[f'F{row_number}'] = izin[designator]
+                h_mat, h_jasa, vol = (_number(values[i]) for i in (4, 5, 6))
+                if None not in (h_mat, h_jasa, vol) and not (skip_base_tray and "BASE TRAY" in designator.upper()):
+                    material += h_mat * vol
+                    jasa += h_jasa * vol
+            ws.append([styles.cell(ws, cell, value) for cell, value in zip(row, values)])
+        cached[number] = formulas.evaluate(changed)
+
+        total = material + jasa
+        total_odp = inputs.get('odp_8', 0) + inputs.get('odp_16', 0)
+        total_ports = (total_odp * 8) + (1 if inputs.get('otb_12', 0) > 0 else 0) * 8
+        cpp = round(total / total_ports, 2) if total_ports > 0 else 0
+        recap.append([number, lop['lop_name'], inputs.get('sumber'), material, jasa, total, total_odp, total_ports, cpp])
+        for i, value in enumerate((material, jasa, total, total_odp, total_ports)):
+            totals[i] += value
+
+    material, jasa, total, total_odp, total_ports = totals
+    recap.append([None, "TOTAL", None, material, jasa, total, total_odp, total_ports,
+                  round(total / total_ports, 2) if total_ports > 0 else 0])
+
+    output = BytesIO()
+    wb.save(output)
+    return write_cached_sheets(output.getvalue(), cached)
@@ -0,0 +1,127 @@
+"""Uniform grid spatial index over projected (meter) coordinates.
+
+Items are axis-aligned boxes (points are zero-size boxes, segments their
+bounding boxes). Both building and querying are vectorized: cell keys are
+sorted once and queries are resolved with ``searchsorted``, so candidate
+pairs for thousands of query points come out of a few array operations.
+An item whose box would cover more than ``MAX_CELLS_PER_ITEM`` cells (a
+stray vertex far from the rest, say) is kept out of the grid and offered
+as a candidate to every query instead.
+"""
+import numpy as np
+
+_KEY_OFFSET = 2 ** 31
+
+MAX_CELLS_PER_ITEM = 4096
+
+
+def _cell_keys(ix, iy):
+    return ix.astype(np.int64) * (2 ** 32) + (iy.astype(np.int64) + _KEY_OFFSET)
+
+
+def _cell_range(boxes, cell_size):
+    """Lowest cell and number of cells along x and y covered by each box."""
+    lo = np.floor(boxes[:, :2] / cell_size).astype(np.int64)
+    hi = np.floor(boxes[:, 2:] / cell_size).astype(np.int64)
+    return lo, hi - lo + 1
+
+
+def _covered_cells(boxes, cell_size):
+    """Cell keys covered by each box, flattened, with the owning box index."""
+    lo, span = _cell_range(boxes, cell_size)
+    nx, ny = span[:, 0], span[:, 1]
+    counts = nx * ny
+    owners = np.repeat(np.arange(len(boxes)), counts)
+    # Position of each covered cell within its box, decomposed into (dx, dy).
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ny_rep = ny[owners]
+    ix = lo[owners, 0] + local // ny_rep
+    iy = lo[owners, 1] + local % ny_rep
+    return _cell_keys(ix, iy), owners
+
+
+def segment_boxes(starts, ends):
+    return np.hstack([np.minimum(starts, ends), np.maximum(starts, ends)])
+
+
+def point_boxes(points, radius=0.0):
+    return np.hstack([points - radius, points + radius])
+
+
+class GridIndex:
+    def __init__(self, boxes, cell_size):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = float(cell_size)
+        self.size = len(boxes)
+        span = _cell_range(boxes, self.cell_size)[1]
+        oversized = span[:, 0] * span[:, 1] > MAX_CELLS_PER_ITEM
+        # Indices of the items left out of the grid; callers may warn about them.
+        self.oversized = np.flatnonzero(oversized)
+        gridded = np.flatnonzero(~oversized)
+        keys, owners = _covered_cells(boxes[gridded], self.cell_size)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.items = gridded[owners[order]]
+
+    def candidates(self, points, radius):
+        """Candidate ``(point_index, item_index)`` pairs within ``radius``.
+
+        Every item whose box comes within ``radius`` of a point is returned
+        (plus some that do not); callers filter by exact distance.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points) or not self.size:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        keys, owners = _covered_cells(point_boxes(points, radius), self.cell_size)
+        left = np.searchsorted(self.keys, keys, side='left')
+        right = np.searchsorted(self.keys, keys, side='right')
+        counts = right - left
+        point_idx = np.repeat(owners, counts)
+        starts = np.repeat(left, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        item_idx = self.items[starts + offsets]
+        if len(self.oversized):
+            point_idx = np.concatenate([point_idx, np.repeat(np.arange(len(points)), len(self.oversized))])
+            item_idx = np.concatenate([item_idx, np.tile(self.oversized, len(points))])
+        # An item spanning several cells can be reached more than once.
+        pairs = np.sort(point_idx * self.size + item_idx)
+        pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])] if len(pairs) else pairs
+        return pairs // self.size, pairs % self.size
+
+
+def point_segment_distance(points, starts, ends):
+    """Distance from each point to its paired segment, and the position
+    along the segment as a fraction ``t`` in [0, 1]."""
+    d = ends - starts
+    length_sq = np.einsum('ij,ij->i', d, d)
+    t = np.einsum('ij,ij->i', points - starts, d) / np.where(length_sq > 0, length_sq, 1)
+    t = np.clip(np.where(length_sq > 0, t, 0), 0, 1)
+    nearest = starts + d * t[:, None]
+    return np.hypot(*(points - nearest).T), t
+
+
+def nearest_within(query_points, item_points, radius, cell_size=None):
+    """For each query point, the nearest item point within ``radius``.
+
+    Returns ``(item_index, distance)``; ``item_index`` is -1 when nothing
+    is in range.
+    """
+    query_points = np.asarray(query_points, dtype=np.float64).reshape(-1, 2)
+    item_points = np.asarray(item_points, dtype=np.float64).reshape(-1, 2)
+    nearest = np.full(len(query_points), -1, dtype=np.int64)
+    distance = np.full(len(query_points), np.inf)
+    index = GridIndex(point_boxes(item_points), cell_size or max(radius, 1.0))
+    q, i = index.candidates(query_points, radius)
+    if not len(q):
+        return nearest, distance
+    dist = np.hypot(*(query_points[q] - item_points[i]).T)
+    keep = dist <= radius
+    q, i, dist = q[keep], i[keep], dist[keep]
+    order = np.lexsort((dist, q))
+    q, i, dist = q[order], i[order], dist[order]
+    first = np.ones(len(q), dtype=bool)
+    first[1:] = q[1:] != q[:-1]
+    nearest[q[first]] = i[first]
+    distance[q[first]] = dist[first]
+    return nearest, distance
@@ -0,0 +1,454 @@
+"""Evaluate the formula cells of a BOQ template.
+
+openpyxl saves formulas without cached values, so readers that do not
+recalculate (pandas, previews, other services) see blanks in the
+generated workbook. A template's formulas are compiled once into Python
+expressions plus a dependency graph; filling volumes then re-evaluates
+only the cells downstream of the changed inputs, and the results are
+written into the saved sheet as cached ``<v>`` values.
+
+Supported: numbers, cell references, ranges, + - * / ^ and unary minus
+(with Excel's precedence: -2^2 is 4), parentheses and SUM, MIN, MAX, ABS, ROUND. Cells with anything else (and
+everything depending on them) are left for Excel to calculate.
+"""
+import math
+import re
+import threading
+import zipfile
+from collections import OrderedDict, deque
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+
+from boq_metrics import record_cache
+
+# Compiled templates kept per process, keyed by template content hash.
+TEMPLATE_CACHE_SIZE = 8
+
+TOKEN_RE = re.compile(
+    r"\s*(?:"
+    r"(?P<range>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)"
+    r"|(?P<func>[A-Z][A-Z0-9.]*)\("
+    r"|(?P<cell>\$?[A-Z]{1,3}\$?\d+)"
+    r"|(?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<op>[-+*/^(),])"
+    r")"
+)
+CELL_RE = re.compile(r"\$?([A-Z]{1,3})\$?(\d+)")
+
+FUNCTIONS = {
+    'SUM': '_sum',
+    'MIN': '_min',
+    'MAX': '_max',
+    'ABS': 'abs',
+    'ROUND': '_round',
+}
+
+
+class UnsupportedFormula(ValueError):
+    pass
+
+
+class FormulaError(Exception):
+    """An Excel error value (``#DIV/0!``, ``#VALUE!``) raised while evaluating."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def _ref(text):
+    column, row = CELL_RE.fullmatch(text).groups()
+    return f"{column}{row}"
+
+
+def _expand(range_text):
+    start, end = range_text.split(":")
+    c1, r1 = CELL_RE.fullmatch(start).groups()
+    c2, r2 = CELL_RE.fullmatch(end).groups()
+    c1, c2 = sorted((column_index_from_string(c1), column_index_from_string(c2)))
+    r1, r2 = sorted((int(r1), int(r2)))
+    return tuple(
+        f"{get_column_letter(c)}{r}"
+        for r in range(r1, r2 + 1)
+        for c in range(c1, c2 + 1)
+    )
+
+
+def _tokens(formula):
+    text = (formula[1:] if formula.startswith("=") else formula).rstrip()
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if match is None or match.end() == pos:
+            raise UnsupportedFormula(formula)
+        pos = match.end()
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent over the tokens with Excel's operator precedence.
+
+    From loosest to tightest: + -, * /, ^ (left-associative), unary minus.
+    Every operation is parenthesized in the output, so Python's own
+    precedence (where ``-2**2`` is -4 and ``**`` is right-associative)
+    never applies.
+    """
+
+    def __init__(self, formula):
+        self.formula = formula
+        self.tokens = _tokens(formula)
+        self.pos = 0
+        self.refs = set()
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, op=None):
+        kind, token = self.peek()
+        if kind is None or (op is not None and (kind, token) != ('op', op)):
+            raise UnsupportedFormula(self.formula)
+        self.pos += 1
+        return kind, token
+
+    def parse(self):
+        expression = self.additive()
+        if self.pos != len(self.tokens):
+            raise UnsupportedFormula(self.formula)
+        return expression
+
+    def additive(self):
+        expression = self.multiplicative()
+        while self.peek() in (('op', "+"), ('op', "-")):
+            _, op = self.take()
+            expression = f"({expression} {op} {self.multiplicative()})"
+        return expression
+
+    def multiplicative(self):
+        expression = self.power()
+        while self.peek() in (('op', "*"), ('op', "/")):
+            _, op = self.take()
+            expression = f"({expression} {op} {self.power()})"
+        return expression
+
+    def power(self):
+        expression = self.unary()
+        while self.peek() == ('op', "^"):
+            self.take()
+            expression = f"_pow({expression}, {self.unary()})"
+        return expression
+
+    def unary(self):
+        if self.peek() in (('op', "-"), ('op', "+")):
+            _, op = self.take()
+            return f"({op}{self.unary()})"
+        return self.primary()
+
+    def primary(self):
+        kind, token = self.take()
+        if kind == 'num':
+            return token
+        if kind == 'cell':
+            ref = _ref(token)
+            self.refs.add(ref)
+            return f"_num(v, {ref!r})"
+        if kind == 'range':
+            cells = _expand(token)
+            self.refs.update(cells)
+            return f"_rng(v, {cells!r})"
+        if kind == 'func':
+            if token not in FUNCTIONS:
+                raise UnsupportedFormula(self.formula)
+            args = []
+            if self.peek() != ('op', ")"):
+                args.append(self.additive())
+                while self.peek() == ('op', ","):
+                    self.take()
+                    args.append(self.additive())
+            self.take(")")
+            return f"{FUNCTIONS[token]}({', '.join(args)})"
+        if (kind, token) == ('op', "("):
+            expression = self.additive()
+            self.take(")")
+            return expression
+        raise UnsupportedFormula(self.formula)
+
+
+def translate(formula):
+    """Translate an Excel formula into a Python expression.
+
+    Returns ``(expression, references)``; raises UnsupportedFormula.
+    References are coerced to numbers, except in a formula that is a single
+    reference (``=B9``), which takes the referenced value as is.
+    """
+    parser = _Parser(formula)
+    if len(parser.tokens) == 1 and parser.tokens[0][0] == 'cell':
+        ref = _ref(parser.tokens[0][1])
+        return f"_cell(v, {ref!r})", {ref}
+    expression = parser.parse()
+    return expression, parser.refs
+
+
+def _value(v, ref):
+    value = v.get(ref)
+    if isinstance(value, FormulaError):
+        raise value
+    return value
+
+
+def _cell(v, ref):
+    value = _value(v, ref)
+    return 0 if value is None else value
+
+
+def _num(v, ref):
+    value = _value(v, ref)
+    if value is None:
+        return 0
+    if isinstance(value, (bool, int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise FormulaError("#VALUE!")
+
+
+def _rng(v, refs):
+    # Like Excel, text and empty cells in a range are ignored by SUM/MIN/MAX.
+    values = (_value(v, ref) for ref in refs)
+    return [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+
+def _flatten(args):
+    for arg in args:
+        if isinstance(arg, list):
+            yield from arg
+        else:
+            yield arg
+
+
+def _sum(*args):
+    return sum(_flatten(args))
+
+
+def _min(*args):
+    values = list(_flatten(args))
+    return min(values) if values else 0
+
+
+def _max(*args):
+    values = list(_flatten(args))
+    return max(values) if values else 0
+
+
+def _pow(base, exponent):
+    # Excel numbers are floats: huge powers overflow to #NUM! instead of
+    # growing Python ints, as does a negative base with a fractional exponent.
+    try:
+        result = float(base) ** exponent
+    except OverflowError:
+        raise FormulaError("#NUM!")
+    if isinstance(result, complex):
+        raise FormulaError("#NUM!")
+    return result
+
+
+def _round(value, digits=0):
+    # Excel rounds halves away from zero.
+    factor = 10 ** int(digits)
+    return math.copysign(math.floor(abs(value) * factor + 0.5), value) / factor
+
+
+EVAL_GLOBALS = {
+    '__builtins__': {},
+    'abs': abs,
+    '_cell': _cell,
+    '_num': _num,
+    '_rng': _rng,
+    '_sum': _sum,
+    '_min': _min,
+    '_max': _max,
+    '_round': _round,
+    '_pow': _pow,
+}
+
+
+class CompiledTemplate:
+    """Formula cells of one worksheet with their dependency graph.
+
+    ``constants`` holds the template's plain cell values and ``values`` the
+    formula results for the unmodified template.
+    """
+
+    def __init__(self, ws):
+        self.constants = {}
+        self.code = {}
+        self.unsupported = set()
+        depends_on = {}
+        for row in ws.iter_rows():
+            for cell in row:
+                value = cell.value
+                if value is None:
+                    continue
+                if isinstance(value, str) and value.startswith("="):
+                    try:
+                        expression, refs = translate(value)
+                        self.code[cell.coordinate] = compile(expression, cell.coordinate, 'eval')
+                    except (UnsupportedFormula, SyntaxError):
+                        self.unsupported.add(cell.coordinate)
+                        continue
+                    depends_on[cell.coordinate] = refs
+                elif isinstance(value, (bool, int, float, str)):
+                    self.constants[cell.coordinate] = value
+
+        self.dependents = {}
+        for ref, refs in depends_on.items():
+            for dep in refs:
+                self.dependents.setdefault(dep, []).append(ref)
+        self.order = self._topological_order(depends_on)
+        # Unsupported and cyclic cells poison whatever depends on them.
+        for ref in self._downstream(self.unsupported | (set(self.code) - set(self.order))):
+            self.code.pop(ref, None)
+            self.unsupported.add(ref)
+        self.order = [ref for ref in self.order if ref in self.code]
+        self.position = {ref: i for i, ref in enumerate(self.order)}
+        self.values = self._evaluate(self.order, self.constants)
+
+    def _topological_order(self, depends_on):
+        pending = {ref: sum(1 for dep in refs if dep in depends_on) for ref, refs in depends_on.items()}
+        queue = deque(ref for ref, count in pending.items() if count == 0)
+        order = []
+        while queue:
+            ref = queue.popleft()
+            order.append(ref)
+            for dependent in self.dependents.get(ref, ()):
+                if dependent in pending:
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0:
+                        queue.append(dependent)
+        return order
+
+    def _downstream(self, refs):
+        seen = set(refs)
+        queue = deque(refs)
+        while queue:
+            for dependent in self.dependents.get(queue.popleft(), ()):
+                if dependent not in seen:
+                    seen.add(dependent)
+                    queue.append(dependent)
+        return seen
+
+    def _evaluate(self, refs, inputs, results=None):
+        results = {} if results is None else results
+        lookup = _Lookup(results, inputs)
+        for ref in refs:
+            try:
+                value = eval(self.code[ref], EVAL_GLOBALS, {'v': lookup})
+                if isinstance(value, float) and not math.isfinite(value):
+                    value = FormulaError("#NUM!")
+            except FormulaError as e:
+                value = e
+            except ZeroDivisionError:
+                value = FormulaError("#DIV/0!")
+            except (TypeError, ValueError, OverflowError):
+                value = FormulaError("#VALUE!")
+            results[ref] = value
+        return results
+
+    def evaluate(self, changed):
+        """Formula values after setting the cells in ``changed`` ({ref: value}).
+
+        Only formulas downstream of the changed cells are recalculated;
+        the rest come from the template's own results. Changed cells that
+        were formulas in the template become plain values.
+        """
+        affected = self._downstream(changed) - set(changed)
+        refs = sorted((ref for ref in affected if ref in self.position), key=self.position.get)
+        inputs = _Lookup(changed, self.values, self.constants)
+        results = {ref: value for ref, value in self.values.items() if ref not in changed}
+        return self._evaluate(refs, inputs, results)
+
+
+class _Lookup:
+    """Read-only view over several dicts, first hit wins."""
+
+    def __init__(self, *maps):
+        self.maps = []
+        for mapping in maps:
+            self.maps.extend(mapping.maps if isinstance(mapping, _Lookup) else [mapping])
+
+    def get(self, key, default=None):
+        for mapping in self.maps:
+            if key in mapping:
+                return mapping[key]
+        return default
+
+
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+
+
+def compile_template(template_hash, ws):
+    """Compiled formulas of ``ws``, reused for templates with the same hash."""
+    with _templates_lock:
+        compiled = _templates.get(template_hash)
+        if compiled is not None:
+            _templates.move_to_end(template_hash)
+    record_cache('template_formulas', compiled is not None)
+    if compiled is not None:
+        return compiled
+    compiled = CompiledTemplate(ws)
+    with _templates_lock:
+        _templates[template_hash] = compiled
+        while len(_templates) > TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    return compiled
+
+
+XML_CELL_RE = re.compile(rb'<c r="([A-Z]+[0-9]+)"([^>]*)>(<f>[^<]*</f>|<f[^>]*/>)(?:<v\s*/>|<v>[^<]*</v>)?</c>')
+TYPE_ATTR_RE = re.compile(rb'\s+t="[^"]*"')
+
+
+def _cached_cell(match, values):
+    ref = match.group(1).decode()
+    if ref not in values:
+        return match.group(0)
+    value = values[ref]
+    attrs = TYPE_ATTR_RE.sub(b"", match.group(2))
+    if isinstance(value, FormulaError):
+        cell_type, text = b' t="e"', value.code
+    elif isinstance(value, bool):
+        cell_type, text = b' t="b"', str(int(value))
+    elif isinstance(value, str):
+        cell_type, text = b' t="str"', escape(value)
+    else:
+        cell_type, text = b"", repr(value) if isinstance(value, float) else str(value)
+    return b'<c r="%s"%s%s>%s<v>%s</v></c>' % (match.group(1), attrs, cell_type, match.group(3), text.encode())
+
+
+def write_cached_values(xlsx_data, sheet_index, values):
+    """Copy of a saved workbook with formula results cached in one sheet.
+
+    ``sheet_index`` is the 0-based worksheet position (openpyxl writes
+    worksheets as ``sheet1.xml``, ``sheet2.xml``, ... in order).
+    """
+    return write_cached_sheets(xlsx_data, {sheet_index: values})
+
+
+def write_cached_sheets(xlsx_data, sheet_values):
+    """Like ``write_cached_values`` for several sheets ({sheet_index: values})."""
+    paths = {f"xl/worksheets/sheet{index + 1}.xml": values for index, values in sheet_values.items()}
+    output = BytesIO()
+    with zipfile.ZipFile(BytesIO(xlsx_data)) as source, \
+            zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            values = paths.get(item.filename)
+            if values is not None:
+                data = XML_CELL_RE.sub(lambda m: _cached_cell(m, values), data)
+            target.writestr(item, data)
+    output.seek(0)
+    return output
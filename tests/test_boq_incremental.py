@@ -0,0 +1,104 @@
+import random
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+import app
+from boq_incremental import IncrementalBoq
+from loadtest import synthetic_template
+
+BASE_INPUTS = {
+    'lop_name': "LOP-TEST",
+    'sumber': "ODC",
+    'kabel_12': 350.0,
+    'kabel_24': 0.0,
+    'kabel_adss_12': 0.0,
+    'kabel_adss_24': 0.0,
+    'odp_8': 4,
+    'odp_16': 2,
+    'tiang_new': 0,
+    'tiang_existing': 0,
+    'tikungan': 0,
+    'izin': "",
+    'closure': 1,
+    'otb_12': 1,
+    'pu_as_hl': 0,
+    'pu_as_sc': 0,
+}
+
+
+@pytest.fixture(scope="module")
+def template():
+    return synthetic_template(seed=7)
+
+
+def _cached_rows(excel_data):
+    # Plain values plus the cached formula results, as a non-recalculating reader sees them.
+    wb = openpyxl.load_workbook(BytesIO(excel_data.getvalue()), data_only=True, read_only=True)
+    return list(wb.active.iter_rows(values_only=True))
+
+
+def _assert_same_workbook(patched, full):
+    assert _cached_rows(patched['excel_data']) == _cached_rows(full['excel_data'])
+    assert patched['summary'] == pytest.approx(full['summary'])
+    assert patched['updated_items'] == full['updated_items']
+
+
+def _check(boq, template, inputs):
+    boq.apply(inputs)
+    full = app.fill_boq_template(BytesIO(template), inputs, inputs['lop_name'])
+    _assert_same_workbook(boq.result(), full)
+
+
+def _row(ws, designator):
+    return next(row for row in range(9, 1083) if ws[f'B{row}'].value == designator)
+
+
+def test_patched_workbook_matches_full_fill(template):
+    boq = IncrementalBoq(BytesIO(template), app.calculate_volumes, app.MANUAL_DEPENDENCIES)
+    inputs = dict(BASE_INPUTS)
+    _check(boq, template, inputs)
+
+    rng = random.Random(3)
+    choices = {
+        'kabel_12': [0.0, 120.0, 350.5, 1000.0],
+        'kabel_24': [0.0, 80.0, 640.0],
+        'odp_8': [0, 1, 4, 9],
+        'odp_16': [0, 2, 5],
+        'otb_12': [0, 1],
+        'closure': [0, 1, 3],
+        'izin': ["", "150000", "275000.5"],
+        'lop_name': ["LOP-A", "LOP-B"],
+        'sumber': ["ODC", "ODP"],
+    }
+    for _ in range(8):
+        field = rng.choice(sorted(choices))
+        inputs = {**inputs, field: rng.choice(choices[field])}
+        _check(boq, template, inputs)
+
+
+def test_inputs_falling_to_zero_clear_their_cells(template):
+    boq = IncrementalBoq(BytesIO(template), app.calculate_volumes, app.MANUAL_DEPENDENCIES)
+    _check(boq, template, BASE_INPUTS)
+    inputs = {**BASE_INPUTS, 'kabel_12': 0.0, 'closure': 0, 'otb_12': 0}
+    _check(boq, template, inputs)
+
+    ws = boq.ws
+    for designator in ("AC-OF-SM-12-SC_O_STOCK", "J-SC-OF-SM-24", "J-TC-SM-12"):
+        assert ws[f'G{_row(ws, designator)}'].value is None
+    assert "AC-OF-SM-12-SC_O_STOCK" not in {item['designator'] for item in boq.result()['updated_items']}
+
+
+def test_preliminary_izin_value_is_written_and_restored(template):
+    original = openpyxl.load_workbook(BytesIO(template)).active
+    row = _row(original, "J-Preliminary Project")
+    boq = IncrementalBoq(BytesIO(template), app.calculate_volumes, app.MANUAL_DEPENDENCIES)
+
+    _check(boq, template, {**BASE_INPUTS, 'izin': "150000"})
+    assert boq.ws[f'F{row}'].value == 150000.0
+    assert boq.ws[f'G{row}'].value == 1
+
+    _check(boq, template, BASE_INPUTS)
+    assert boq.ws[f'F{row}'].value == original[f'F{row}'].value
+    assert boq.ws[f'G{row}'].value is None
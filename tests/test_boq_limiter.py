@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from boq_limiter import AdmissionLimiter, AdmissionTimeout
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def _start_job(limiter, cost_mb, started, release):
+    def job():
+        with limiter.admit(cost_mb):
+            started.append(cost_mb)
+            release.wait(5)
+
+    thread = threading.Thread(target=job, daemon=True)
+    thread.start()
+    return thread
+
+
+def _admit_and_record(limiter, name, order):
+    with limiter.admit(10):
+        order.append(name)
+
+
+def test_jobs_start_in_arrival_order():
+    limiter = AdmissionLimiter(max_concurrent=1, memory_budget_mb=100, timeout=5)
+    order = []
+    threads = []
+    with limiter.admit(10):
+        for name in range(4):
+            thread = threading.Thread(target=_admit_and_record, args=(limiter, name, order), daemon=True)
+            thread.start()
+            threads.append(thread)
+            _wait_for(lambda: limiter.stats()['queue_length'] == name + 1)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 3]
+    assert limiter.stats()['waited'] == 4
+
+
+def test_oversized_job_runs_only_alone():
+    limiter = AdmissionLimiter(max_concurrent=2, memory_budget_mb=100, timeout=5)
+    started = []
+    release_small, release_large = threading.Event(), threading.Event()
+
+    small = _start_job(limiter, 10, started, release_small)
+    _wait_for(lambda: started == [10])
+    large = _start_job(limiter, 150, started, release_large)
+    _wait_for(lambda: limiter.stats()['queue_length'] == 1)
+    # Two slots, but the oversized job waits for the running one to finish.
+    assert started == [10]
+
+    release_small.set()
+    small.join(5)
+    _wait_for(lambda: started == [10, 150])
+
+    # While it runs, nothing else fits.
+    follower = _start_job(limiter, 10, started, release_large)
+    _wait_for(lambda: limiter.stats()['queue_length'] == 1)
+    assert started == [10, 150]
+    release_large.set()
+    large.join(5)
+    _wait_for(lambda: started == [10, 150, 10])
+    follower.join(5)
+
+
+def test_retained_memory_is_released_when_a_job_needs_room():
+    limiter = AdmissionLimiter(max_concurrent=2, memory_budget_mb=100, timeout=5)
+    released = []
+    old, recent = object(), object()
+    limiter.retain(old, 40, lambda: released.append('old'))
+    limiter.retain(recent, 40, lambda: released.append('recent'))
+    assert limiter.stats()['memory_retained_mb'] == 80
+
+    with limiter.admit(30):
+        # Only the least recently used entry had to go.
+        assert released == ['old']
+        assert limiter.stats()['memory_retained_mb'] == 40
+
+    limiter.forget(recent)
+    assert released == ['old']
+    assert limiter.stats()['retained'] == 0
+    assert limiter.stats()['retained_released'] == 1
+
+
+def test_retaining_again_refreshes_the_entry():
+    limiter = AdmissionLimiter(max_concurrent=1, memory_budget_mb=100, timeout=5)
+    released = []
+    first, second = object(), object()
+    limiter.retain(first, 40, lambda: released.append('first'))
+    limiter.retain(second, 40, lambda: released.append('second'))
+    limiter.retain(first, 40, lambda: released.append('first'))
+
+    with limiter.admit(30):
+        assert released == ['second']
+    assert limiter.stats()['memory_retained_mb'] == 40
+
+
+def test_idle_retained_memory_is_released():
+    limiter = AdmissionLimiter(max_concurrent=1, memory_budget_mb=100, timeout=5, retained_idle_seconds=0.01)
+    released = []
+    limiter.retain(object(), 10, lambda: released.append(True))
+    time.sleep(0.02)
+
+    with limiter.admit(10):
+        pass
+    assert released == [True]
+    assert limiter.stats()['memory_retained_mb'] == 0
+
+
+def test_timeout_removes_the_ticket_from_the_queue():
+    limiter = AdmissionLimiter(max_concurrent=1, memory_budget_mb=100, timeout=0.05)
+    with limiter.admit(10):
+        with pytest.raises(AdmissionTimeout):
+            with limiter.admit(10):
+                pass
+        stats = limiter.stats()
+        assert stats['queue_length'] == 0
+        assert stats['timed_out'] == 1
+
+    # The abandoned ticket does not block the next job.
+    with limiter.admit(10):
+        assert limiter.stats()['running'] == 1
+    assert limiter.stats()['running'] == 0
+    assert limiter.stats()['memory_in_use_mb'] == 0
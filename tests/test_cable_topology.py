@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from cable_topology import build_topology, count_shared_once
+
+LAT = -6.2
+
+
+def _line(name, cls, coords):
+    return {'kind': 'line', 'cls': cls, 'name': name, 'coords': np.array(coords, dtype=np.float64)}
+
+
+def test_collinear_overlap_with_offset_vertices():
+    adss = _line('ADSS', 'kabel_adss_24', [(106.800 + i * 0.001, LAT) for i in range(6)])
+    dis_new = _line('DIS NEW', 'kabel_12', [(106.8005 + i * 0.001, LAT) for i in range(4)])
+
+    topology = build_topology([adss, dis_new])
+
+    # The whole DIS NEW line (3 x 0.001 degree) runs over the ADSS line.
+    assert topology['duplicated_length'] == pytest.approx(332.0, abs=1.0)
+    assert set(topology['duplicated_by_class']) == {'kabel_12'}
+    assert [(o['route_a'], o['route_b']) for o in topology['overlaps']] == [('ADSS', 'DIS NEW')]
+    assert len(topology['islands']) == 1
+
+    values = count_shared_once({'kabel_12': 400.0, 'kabel_adss_24': 560.0}, topology)
+    assert values['kabel_12'] == pytest.approx(68.0, abs=1.0)
+    assert values['kabel_adss_24'] == 560.0
+
+
+def test_split_lines_with_overlapping_ends():
+    first = _line('A', 'kabel_12', [(106.800, LAT), (106.802, LAT)])
+    second = _line('B', 'kabel_12', [(106.8015, LAT), (106.804, LAT)])
+
+    topology = build_topology([first, second])
+
+    assert topology['duplicated_length'] == pytest.approx(55.3, abs=0.5)
+    assert len(topology['islands']) == 1
+
+
+def test_branch_meeting_trunk_mid_segment_is_connected():
+    trunk = _line('Trunk', 'kabel_12', [(106.800, LAT), (106.810, LAT)])
+    branch = _line('Branch', 'kabel_12', [(106.805, LAT), (106.805, LAT + 0.005)])
+
+    topology = build_topology([trunk, branch])
+
+    assert topology['duplicated_length'] == 0
+    assert len(topology['islands']) == 1
+    assert topology['islands'][0]['routes'] == "Trunk, Branch"
+
+
+def test_separate_routes_are_separate_islands():
+    near = _line('A', 'kabel_12', [(106.800, LAT), (106.801, LAT)])
+    far = _line('B', 'kabel_12', [(106.800, LAT + 0.001), (106.801, LAT + 0.001)])
+
+    topology = build_topology([near, far])
+
+    assert topology['duplicated_length'] == 0
+    assert len(topology['islands']) == 2
@@ -0,0 +1,81 @@
+import openpyxl
+import pytest
+
+from template_formulas import EVAL_GLOBALS, CompiledTemplate, FormulaError, UnsupportedFormula, translate
+
+
+def _eval(formula, values=None):
+    expression, _ = translate(formula)
+    return eval(expression, EVAL_GLOBALS, {'v': values or {}})
+
+
+def _compiled(cells):
+    ws = openpyxl.Workbook().active
+    for ref, value in cells.items():
+        ws[ref] = value
+    return CompiledTemplate(ws)
+
+
+@pytest.mark.parametrize("formula, expected", [
+    ("=-2^2", 4),
+    ("=2^3^2", 64),
+    ("=-A1^2", 9),
+    ("=2^-1", 0.5),
+    ("=1+2*3", 7),
+    ("=(1+2)*3", 9),
+    ("=10-4-3", 3),
+    ("=12/3/2", 2),
+    ("=SUM(A1:A2, 1)*-2", -10),
+    ("=ROUND(2.5)+ABS(-1)", 4),
+])
+def test_translate_follows_excel_precedence(formula, expected):
+    assert _eval(formula, {'A1': 3, 'A2': 1}) == pytest.approx(expected)
+
+
+def test_translate_collects_references():
+    _, refs = translate("=SUM(B2:C3)+$D$4")
+    assert refs == {'B2', 'C2', 'B3', 'C3', 'D4'}
+
+
+@pytest.mark.parametrize("formula", ["=1+", "=(1+2", "=IF(A1,1,2)", "=A1&B1", "=1 2"])
+def test_translate_rejects_unsupported_formulas(formula):
+    with pytest.raises(UnsupportedFormula):
+        translate(formula)
+
+
+def test_single_reference_keeps_text():
+    compiled = _compiled({'A1': "Jakarta", 'B1': "=A1", 'C1': "=A1+1"})
+    assert compiled.values['B1'] == "Jakarta"
+    assert compiled.values['C1'].code == "#VALUE!"
+
+
+def test_division_by_zero_and_negative_root_are_errors():
+    compiled = _compiled({'A1': 0, 'B1': "=1/A1", 'C1': "=B1+1", 'D1': "=(-8)^(1/3)"})
+    assert isinstance(compiled.values['B1'], FormulaError)
+    assert compiled.values['B1'].code == "#DIV/0!"
+    assert compiled.values['C1'].code == "#DIV/0!"
+    assert compiled.values['D1'].code == "#NUM!"
+
+
+def test_evaluate_recalculates_downstream_only():
+    compiled = _compiled({'A1': 2, 'A2': 3, 'B1': "=A1*10", 'B2': "=A2*10", 'C1': "=B1+B2"})
+    assert compiled.values == {'B1': 20, 'B2': 30, 'C1': 50}
+
+    values = compiled.evaluate({'A1': 5})
+    assert values == {'B1': 50, 'B2': 30, 'C1': 80}
+    # The template's own results are left untouched.
+    assert compiled.values['B1'] == 20
+
+
+def test_cycles_and_unsupported_cells_poison_their_dependents():
+    compiled = _compiled({
+        'A1': "=B1+1",
+        'B1': "=A1+1",
+        'C1': "=A1*2",
+        'D1': "=IF(1,2,3)",
+        'E1': "=D1+1",
+        'F1': "=2*3",
+    })
+    assert compiled.unsupported == {'A1', 'B1', 'C1', 'D1', 'E1'}
+    assert compiled.values == {'F1': 6}
+    assert compiled.evaluate({'F1': 1}) == {}
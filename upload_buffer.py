@@ -0,0 +1,72 @@
+"""Uploaded files captured once as immutable bytes.
+
+Streamlit's ``UploadedFile`` is a ``BytesIO`` over the bytes the server
+already holds, and ``getvalue()`` on an unmodified BytesIO returns that
+same object without copying (``getbuffer()`` does copy). An
+``UploadBuffer`` keeps a reference to those bytes, so the parser, the KML
+rewriter, the history store and the caches all share one copy and can
+re-read it any number of times.
+"""
+import hashlib
+import threading
+import weakref
+from io import BytesIO
+
+
+class UploadBuffer:
+    """Read-only view of one upload's bytes."""
+
+    __slots__ = ('name', 'data', '_digest', '__weakref__')
+
+    def __init__(self, data, name=""):
+        self.name = name
+        self.data = data if isinstance(data, bytes) else bytes(data)
+        self._digest = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def view(self):
+        """Zero-copy memoryview over the bytes."""
+        return memoryview(self.data)
+
+    def reader(self):
+        """Fresh file object positioned at the start (shares the bytes)."""
+        return BytesIO(self.data)
+
+    def digest(self):
+        """Content hash, computed once."""
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.view(), digest_size=16).hexdigest()
+        return self._digest
+
+
+# Held weakly: a buffer is reused (with its digest) only while something
+# else, e.g. a session's state, still keeps it alive.
+_buffers = weakref.WeakValueDictionary()
+_buffers_lock = threading.Lock()
+
+
+def upload_buffer(upload):
+    """The ``UploadBuffer`` for an uploaded file object (or bytes)."""
+    if isinstance(upload, UploadBuffer):
+        return upload
+    name = getattr(upload, 'name', "")
+    if isinstance(upload, (bytes, bytearray, memoryview)):
+        data = bytes(upload)
+    elif hasattr(upload, 'getvalue'):
+        data = upload.getvalue()
+    else:
+        position = upload.tell()
+        upload.seek(0)
+        data = upload.read()
+        upload.seek(position)
+
+    # A live buffer holds a reference to ``data``, so its id stays unique while cached.
+    key = (id(data), name)
+    with _buffers_lock:
+        buffer = _buffers.get(key)
+        if buffer is None or buffer.data is not data:
+            buffer = UploadBuffer(data, name)
+            _buffers[key] = buffer
+    return buffer